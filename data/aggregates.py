@@ -0,0 +1,166 @@
+# Builds the aggregate cube: the summary figures of every state, county, city
+# and tribal area (tract, DAC and QCT counts, population, housing and
+# indicator means, plain and population-weighted), so the report cover page
+# and the national rankings read one precomputed row instead of totalling
+# tracts and properties per request.
+#
+# Each boundary covers the same tracts and properties its report selects:
+# GEOID prefixes for states and counties, the membership index for cities
+# and tribal areas, and the keys and tribal membership index assigned to the
+# housing by nhpd_clean.py.
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from artifacts import write_artifact
+
+start = time.perf_counter()
+
+dac = pd.read_parquet("report_data/dac.parquet",
+                      columns=[
+                          "GEOID", "city", "county_name", "population",
+                          "DAC_status", "QCT_status",
+                          "avg_energy_burden_natl_pctile",
+                          "nonwhite_pct_natl_pctile"
+                      ])
+geoid = dac["GEOID"].astype(np.int64).values
+rows = np.arange(len(dac), dtype=np.int64)
+# Cities are keyed the same way the Report page names them
+city = (dac["city"].astype(object) + " (" + dac["county_name"].astype(object) +
+        ")").values
+has_city = dac["city"].notna().values
+tribes = pd.read_parquet("report_data/dac_index.parquet",
+                         filters=[("level", "==", "tribe")])
+
+
+def state_key(codes):
+    return pd.Series(codes).astype(np.int64).astype(str).str.zfill(2).values
+
+
+def county_key(codes):
+    return pd.Series(codes).astype(np.int64).astype(str).str.zfill(5).values
+
+
+# Every (boundary, tract) pair. fraction is the share of the tract's area in
+# the boundary, 1.0 except for tribal areas. A tribe report lists its tracts
+# whole, so the counts and plain means below match it, while the population
+# figures (and the population-weighted means) only count the part of each
+# tract inside the tribal area.
+members = pd.concat([
+    pd.DataFrame({"level": "state", "key": state_key(geoid // 10**9),
+                  "row": rows, "fraction": 1.0}),
+    pd.DataFrame({"level": "county", "key": county_key(geoid // 10**6),
+                  "row": rows, "fraction": 1.0}),
+    pd.DataFrame({"level": "city", "key": city[has_city],
+                  "row": rows[has_city], "fraction": 1.0}),
+    pd.DataFrame({"level": "tribe", "key": tribes["key"].values,
+                  "row": tribes["row"].values.astype(np.int64),
+                  "fraction": tribes["fraction"].values.astype(np.float64)}),
+], ignore_index=True)
+
+# Indicators as the report shows them: float64 rounded to two decimals
+energy_burden = dac["avg_energy_burden_natl_pctile"].astype(
+    np.float64).round(2).values[members["row"].values]
+nonwhite = dac["nonwhite_pct_natl_pctile"].astype(
+    np.float64).round(2).values[members["row"].values]
+# Population inside the boundary, assuming it is spread evenly over the tract
+weight = np.nan_to_num(
+    dac["population"].astype(np.float64).values[members["row"].values] *
+    members["fraction"].values)
+is_dac = (dac["DAC_status"] == "Disadvantaged").values[members["row"].values]
+is_qct = (dac["QCT_status"] == "Eligible").values[members["row"].values]
+members = members.assign(
+    population=weight,
+    dac=is_dac.astype(np.int32),
+    qct=is_qct.astype(np.int32),
+    dac_population=weight * is_dac,
+    qct_population=weight * is_qct,
+    energy_burden=energy_burden,
+    nonwhite=nonwhite,
+    # Population-weighted means skip tracts without the indicator
+    energy_burden_weighted=np.where(np.isnan(energy_burden), 0,
+                                    weight * energy_burden),
+    energy_burden_weight=np.where(np.isnan(energy_burden), 0, weight),
+    nonwhite_weighted=np.where(np.isnan(nonwhite), 0, weight * nonwhite),
+    nonwhite_weight=np.where(np.isnan(nonwhite), 0, weight),
+)
+aggregates = members.groupby(["level", "key"]).agg(
+    tracts=("row", "size"),
+    population=("population", "sum"),
+    dac_tracts=("dac", "sum"),
+    qct_tracts=("qct", "sum"),
+    dac_population=("dac_population", "sum"),
+    qct_population=("qct_population", "sum"),
+    avg_energy_burden_natl_pctile=("energy_burden", "mean"),
+    avg_nonwhite_pct_natl_pctile=("nonwhite", "mean"),
+    energy_burden_weighted=("energy_burden_weighted", "sum"),
+    energy_burden_weight=("energy_burden_weight", "sum"),
+    nonwhite_weighted=("nonwhite_weighted", "sum"),
+    nonwhite_weight=("nonwhite_weight", "sum"),
+)
+with np.errstate(invalid="ignore", divide="ignore"):
+    aggregates["pop_energy_burden_natl_pctile"] = (
+        aggregates.pop("energy_burden_weighted") /
+        aggregates.pop("energy_burden_weight"))
+    aggregates["pop_nonwhite_pct_natl_pctile"] = (
+        aggregates.pop("nonwhite_weighted") / aggregates.pop("nonwhite_weight"))
+print(f"Aggregated {len(members)} boundary tracts "
+      f"in {time.perf_counter() - start:.1f}s")
+
+# Housing, selected the way nhpd_selector does: by the state and county keys
+# of each property, by tract for cities and by the membership index for
+# tribal areas (a property can be in several)
+nhpd = pd.read_parquet("report_data/nhpd.parquet",
+                       columns=[
+                           "tract_geoid", "county_fips", "state_fips",
+                           "Assisted Units"
+                       ])
+units = nhpd["Assisted Units"].astype(np.float64).values
+tract_city = pd.Series(city[has_city], index=geoid[has_city])
+property_city = tract_city.reindex(
+    nhpd["tract_geoid"].fillna(-1).astype(np.int64).values)
+has_state = nhpd["state_fips"].notna().values
+has_county = nhpd["county_fips"].notna().values
+has_property_city = property_city.notna().values
+property_tribes = pd.read_parquet("report_data/nhpd_index.parquet",
+                                  filters=[("level", "==", "tribe")])
+housing = pd.concat([
+    pd.DataFrame({"level": "state",
+                  "key": state_key(nhpd["state_fips"][has_state]),
+                  "units": units[has_state]}),
+    pd.DataFrame({"level": "county",
+                  "key": county_key(nhpd["county_fips"][has_county]),
+                  "units": units[has_county]}),
+    pd.DataFrame({"level": "city",
+                  "key": property_city.values[has_property_city],
+                  "units": units[has_property_city]}),
+    pd.DataFrame({"level": "tribe",
+                  "key": property_tribes["key"].values,
+                  "units": units[property_tribes["row"].values]}),
+], ignore_index=True).groupby(["level", "key"]).agg(
+    properties=("units", "size"), assisted_units=("units", "sum"))
+aggregates = aggregates.join(housing, how="outer")
+counts = ["tracts", "dac_tracts", "qct_tracts", "properties"]
+aggregates[counts] = aggregates[counts].fillna(0).astype(np.int64)
+sums = ["population", "dac_population", "qct_population", "assisted_units"]
+aggregates[sums] = aggregates[sums].fillna(0)
+aggregates = aggregates.reset_index()
+
+# Display names for the rankings; cities are keyed by theirs
+names = pd.concat([
+    pd.read_parquet("report_data/states.parquet",
+                    columns=["GEOID", "NAME"]).assign(level="state"),
+    pd.read_parquet("report_data/counties.parquet",
+                    columns=["GEOID", "NAME"]).assign(level="county"),
+    pd.read_parquet("report_data/tt_shp.parquet",
+                    columns=["GEOID", "NAME"]).assign(level="tribe"),
+]).rename(columns={"GEOID": "key"})
+names["key"] = names["key"].astype(str)
+aggregates = aggregates.merge(names, on=["level", "key"], how="left")
+aggregates["NAME"] = aggregates["NAME"].fillna(aggregates["key"])
+
+write_artifact(aggregates, "aggregates", sort_by=["level", "key"])
+print(f"Aggregate cube exported with {len(aggregates)} boundaries "
+      f"in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,63 @@
+# Writes the columnar report artifacts in report_data/.
+# Each artifact is a (Geo)Parquet file with a small JSON sidecar that records
+# the schema version, row count, columns and a content hash, so the app can
+# read only the columns and row groups it needs instead of unpickling the
+# whole frame, and is not tied to the pandas/geopandas version that built it.
+
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+REPORT_DATA = "report_data"
+# Bump whenever the layout of an artifact changes so the app refuses stale files
+SCHEMA_VERSION = 5
+# Small row groups let the app skip most of a national file when it filters on
+# a sorted key such as GEOID
+ROW_GROUP_SIZE = 4096
+
+
+def artifact_path(name):
+    return os.path.join(REPORT_DATA, f"{name}.parquet")
+
+
+def meta_path(name):
+    return os.path.join(REPORT_DATA, f"{name}.meta.json")
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_artifact(frame, name, sort_by=None, row_group_size=ROW_GROUP_SIZE):
+    """Writes frame to report_data/<name>.parquet and its sidecar.
+
+    The frame is written with a fresh RangeIndex (sorted by sort_by if given)
+    and that exact frame is returned, so anything derived from row positions
+    afterwards lines up with the file on disk.
+    """
+    if sort_by is not None:
+        frame = frame.sort_values(by=sort_by, kind="stable")
+    frame = frame.reset_index(drop=True)
+    path = artifact_path(name)
+    frame.to_parquet(path, index=False, row_group_size=row_group_size)
+    meta = {
+        "name": name,
+        "schema_version": SCHEMA_VERSION,
+        "rows": len(frame),
+        "columns": [str(column) for column in frame.columns],
+        "sorted_by": sort_by,
+        "sha256": file_sha256(path),
+        "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    # Write the sidecar atomically so concurrent build stages never see a
+    # half-written file
+    tmp_path = meta_path(name) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, meta_path(name))
+    return frame
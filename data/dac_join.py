@@ -11,9 +11,57 @@ import subprocess
 import sys
 import os
 from os import mkdir
-from os.path import exists, sep
+from os.path import exists, getmtime, sep
 import pyproj
+import time
 from shapely.validation import explain_validity, make_valid
+from artifacts import write_artifact
+from geometry_prep import (add_viewports, normalize_geometries,
+                           write_geometry_tiers)
+
+
+# Prints how long each step of the build took
+class StepTimer:
+
+    def __init__(self):
+        self.last = time.perf_counter()
+
+    def lap(self, step):
+        now = time.perf_counter()
+        print(f"{step} ({now - self.last:.2f}s)")
+        self.last = now
+
+
+# Rounds like Python's round(x, 2), but over a whole array. np.round can
+# disagree with round() when x * 100 lands right next to a .5 tie, so those
+# few values are recomputed with round() to keep the output identical.
+def round2(values):
+    values = np.asarray(values, dtype=float)
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    rounded[near_tie] = [round(x, 2) for x in values[near_tie]]
+    return rounded
+
+
+# Compact schema for the tract artifact: GEOID as an int64 code (state and
+# county prefixes are GEOID // 10**9 and GEOID // 10**6), percentiles as
+# float32, repeated strings as categoricals and the DAC indicator as a
+# nullable int8, since some tracts have none. The app formats these back to
+# the usual strings only for the rows it displays.
+def compact_tracts(dac):
+    dac = dac.copy()
+    dac["GEOID"] = dac["GEOID"].astype(np.int64)
+    for column in ["city", "county_name", "DAC_status", "QCT_status"]:
+        dac[column] = dac[column].astype("category")
+    dac["DAC_indicator"] = dac["DAC_indicator"].astype("Int8")
+    for column in dac.columns:
+        if dac[column].dtype == np.float64:
+            dac[column] = dac[column].astype(np.float32)
+    return dac
+
+
+timer = StepTimer()
 
 qct = pd.read_csv("raw/qct.csv", dtype=str)
 
@@ -26,11 +74,27 @@ qct["GEOID"] = qct["GEOID"].str.pad(12, side="left", fillchar="0")
 # Remove the last character from the GEOID
 qct["GEOID"] = qct["GEOID"].str[:-1]
 
+
+# Reads a view exported by sqlite_extract.py: GeoParquet from the default
+# streaming mode (geometries are decoded from WKB in bulk), GeoJSON from the
+# ogr2ogr mode
+def read_view(view):
+    # Either sqlite_extract.py mode may have exported the view; read the most
+    # recent export so an older GeoParquet never shadows a new GeoJSON
+    parquet_path = f"sql_output/{view}.parquet"
+    geojson_path = f"sql_output/{view}.geojson"
+    if exists(parquet_path) and (not exists(geojson_path) or
+                                 getmtime(parquet_path) >= getmtime(geojson_path)):
+        return gpd.read_parquet(parquet_path)
+    return gpd.read_file(geojson_path)
+
+
 # Load DAC files
 dac_pct = pd.read_csv("sql_output/dac_pct.csv", dtype=str)
-dac_shp = gpd.read_file("sql_output/MappingDisplay_Data.geojson")
-tt_shp = gpd.read_file(
-    "sql_output/MappingDisplay_TribesAndTerritories.geojson")
+dac_shp = read_view("MappingDisplay_Data")
+tt_shp = read_view("MappingDisplay_TribesAndTerritories")
+
+timer.lap("Loaded inputs")
 
 dac_shp = dac_shp[[
     "GEOID", "city", "county_name", "population", "DAC_indicator", "geometry"
@@ -43,12 +107,14 @@ dac = dac_shp.merge(dac_pct, on="GEOID")
 
 # If 'DAC_indicator' is '1', then set 'DAC_status' to 'Disadvantaged'
 # If 'DAC_indicator' is '0', then set 'DAC_status' to 'Not Disadvantaged'
-dac["DAC_status"] = dac["DAC_indicator"].apply(
-    lambda x: "Disadvantaged" if x == 1 else "Not Disadvantaged")
+dac["DAC_status"] = np.where(dac["DAC_indicator"] == 1, "Disadvantaged",
+                             "Not Disadvantaged")
 
 # If QCT "GEOID" in dac "GEOID", add a column "QCT_status" to dac with value = "Eligible" otherwise "Not Eligible"
-dac["QCT_status"] = dac["GEOID"].apply(
-    lambda x: "Eligible" if x in qct["GEOID"].values else "Not Eligible")
+# isin builds a hash set of the QCT GEOIDs once instead of scanning them per tract
+dac["QCT_status"] = np.where(dac["GEOID"].isin(qct["GEOID"]), "Eligible",
+                             "Not Eligible")
+timer.lap("Joined percentiles and QCT status")
 
 dac = dac[[
     "GEOID",
@@ -112,15 +178,16 @@ non_floats = [
     "QCT_status",
     "geometry",
 ]
-for column in dac.columns:
-    if column not in non_floats:
-        dac[column] = dac[column].astype(float)
-        if column.endswith("_natl_pctile") or column.endswith("_percentile"):
-            # Convert to percentiles and round to 2 decimal places
-            dac[column] = dac[column].apply(lambda x: round(x * 100, 2))
-        if column.endswith("_sum"):
-            # Round to 2 decimal places
-            dac[column] = dac[column].apply(lambda x: round(x, 2))
+float_columns = [column for column in dac.columns if column not in non_floats]
+dac[float_columns] = dac[float_columns].astype(float)
+for column in float_columns:
+    if column.endswith("_natl_pctile") or column.endswith("_percentile"):
+        # Convert to percentiles and round to 2 decimal places
+        dac[column] = round2(dac[column].values * 100)
+    if column.endswith("_sum"):
+        # Round to 2 decimal places
+        dac[column] = round2(dac[column].values)
+timer.lap("Converted indicator columns")
 
 carto_dac = dac[[
     "GEOID",
@@ -162,19 +229,22 @@ for key in carto_names.keys():
 # Export to geojson file in CARTO
 # carto_dac.to_file("carto_data/carto_dac.shp", driver="ESRI Shapefile")
 
-# Change projection
-dac = dac.to_crs(pyproj.CRS.from_epsg(4269), inplace=False)
-dac = dac[~pd.isna(dac.geometry)]
-for i, row in dac.iterrows():
-    try:
-        dac.at[i, "geometry"] = make_valid(row["geometry"])
-    except:
-        pass
+# Change projection, drop missing geometries and repair invalid ones
+dac, stats = normalize_geometries(dac, crs=pyproj.CRS.from_epsg(4269))
+print(f"Tracts: repaired {stats['repaired']}, dropped {stats['dropped']} geometries")
+timer.lap("Reprojected and repaired tract geometries")
 # Export to geojson file in REPORT
 dac.to_file("report_data/dac.geojson", driver="GeoJSON")
 # Export to pickle file in REPORT
 dac.to_pickle("report_data/dac.pkl")
-print("DAC data exported to geojson and pickle files.")
+# Export compact columnar artifact in REPORT, sorted by GEOID so state and
+# county lookups only touch a few row groups, with the map viewport of each
+# tract
+dac = write_artifact(compact_tracts(add_viewports(dac)), "dac", sort_by="GEOID")
+# Simplified tract geometries for the report map, in the same row order
+write_geometry_tiers(dac, "dac")
+print("DAC data exported to geojson, pickle and parquet files.")
+timer.lap("Exported tracts")
 
 tt_shp["NAME"] = tt_shp["namelsad"]
 tt_shp["GEOID"] = tt_shp["geoid"]
@@ -185,18 +255,63 @@ tt_shp = tt_shp[["GEOID", "NAME", "geometry"]]
 tt_shp.to_file("carto_data/tt_shp.geojson", driver="GeoJSON")
 
 
-# Change projection
-tt_shp = tt_shp.to_crs(pyproj.CRS.from_epsg(4269), inplace=False)
-tt_shp = tt_shp[~pd.isna(tt_shp.geometry)]
-for i, row in tt_shp.iterrows():
-    try:
-        tt_shp.at[i, "geometry"] = make_valid(row["geometry"])
-    except:
-        pass
+# Change projection, drop missing geometries and repair invalid ones
+tt_shp, stats = normalize_geometries(tt_shp, crs=pyproj.CRS.from_epsg(4269))
+print(f"Tribes and territories: repaired {stats['repaired']}, dropped {stats['dropped']} geometries")
 
 # Export to Geojson in REPORT
 tt_shp.to_file("report_data/tt_shp.geojson", driver="GeoJSON")
 
 # Export to pickle file in REPORT
 tt_shp.to_pickle("report_data/tt_shp.pkl")
-print("Tribes and territories data exported to geojson and pickle files.")
+# Export columnar artifact in REPORT, with the map viewport of each area
+tt_shp = write_artifact(add_viewports(tt_shp), "tt_shp")
+print("Tribes and territories data exported to geojson, pickle and parquet files.")
+timer.lap("Exported tribes and territories")
+
+# MEMBERSHIP INDEX
+# Maps every city and tribal area to the row offsets of its tracts in
+# dac.parquet, so the report can slice the tract table instead of scanning
+# names or running a spatial join per search. Tracts, counties and states
+# need no index: dac.parquet is sorted by GEOID, so each is a contiguous
+# range of rows the app finds by binary search.
+rows = np.arange(len(dac), dtype=np.int32)
+# Cities are keyed the same way the Report page names them
+has_city = dac["city"].notna().values
+membership = pd.DataFrame({
+    "level": "city",
+    "key": (dac["city"].astype(object) + " (" +
+            dac["county_name"].astype(object) + ")")[has_city],
+    "row": rows[has_city],
+})
+membership["fraction"] = np.float32(1.0)
+
+# Tribes and territories also store the share of each tract's area that falls
+# inside the tribal area. Areas are measured in an equal-area projection.
+tribes = gpd.sjoin(dac[["geometry"]],
+                   tt_shp[["GEOID", "geometry"]],
+                   how="inner",
+                   predicate="intersects")
+tract_geoms = gpd.GeoSeries(dac.geometry.values[tribes.index.values],
+                            crs=dac.crs).to_crs(epsg=6933)
+tribe_geoms = gpd.GeoSeries(tt_shp.geometry.values[tribes["index_right"].values],
+                            crs=tt_shp.crs).to_crs(epsg=6933)
+tract_area = tract_geoms.area.values
+overlap_area = tract_geoms.intersection(tribe_geoms).area.values
+fraction = np.divide(overlap_area,
+                     tract_area,
+                     out=np.zeros_like(overlap_area),
+                     where=tract_area > 0)
+membership = pd.concat([
+    membership,
+    pd.DataFrame({
+        "level": "tribe",
+        "key": tribes["GEOID"].values,
+        "row": tribes.index.values.astype(np.int32),
+        "fraction": np.clip(fraction, 0, 1).astype(np.float32),
+    })
+], ignore_index=True)
+# Sorted by (level, key) so the app reads a single key's row groups
+write_artifact(membership, "dac_index", sort_by=["level", "key", "row"])
+print("Tract membership index exported.")
+timer.lap("Built membership index")
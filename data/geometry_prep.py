@@ -0,0 +1,190 @@
+# Geometry normalization shared by the data build scripts.
+# Reprojection, validity checks and repair are split into chunks of rows and
+# run across a process pool, so the national tract, tribal and county layers
+# use every core of the build box instead of one Python loop. The map
+# viewports and simplified geometry tiers the app draws are derived here too.
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.validation import make_valid
+
+from artifacts import write_artifact
+from equity_common.mapgeometry import (CLUSTER_ZOOMS, GEOMETRY_TIERS,
+                                       VIEWPORT_COLUMNS, cluster_cells,
+                                       cluster_column, quantize, viewports)
+
+CHUNK_SIZE = 2000
+
+# Frame being normalized. Workers are forked after it is set, so they read it
+# from copy-on-write memory instead of receiving pickled chunks.
+_frame = None
+
+
+def repair_geometries(geoms):
+    """Repairs invalid geometries in bulk.
+
+    Validity is checked over the whole GeoSeries at once and only the invalid
+    geometries are passed to make_valid, which returns valid geometries
+    unchanged anyway. Geometries that cannot be repaired are left as they
+    are. Returns the repaired GeoSeries and the number of repairs.
+    """
+    invalid = (~geoms.isna() & ~geoms.is_valid).values
+    if not invalid.any():
+        return geoms, 0
+    geoms = geoms.copy()
+    try:
+        if hasattr(geoms, "make_valid"):
+            geoms[invalid] = geoms[invalid].make_valid()
+        else:
+            geoms[invalid] = [make_valid(g) for g in geoms[invalid]]
+    except Exception:
+        for i in np.flatnonzero(invalid):
+            try:
+                geoms.iloc[i] = make_valid(geoms.iloc[i])
+            except Exception:
+                pass
+    return geoms, int(invalid.sum())
+
+
+def _normalize_chunk(bounds, crs, repair):
+    start, stop = bounds
+    geoms = _frame.geometry.iloc[start:stop].to_crs(crs)
+    if repair:
+        return repair_geometries(geoms)
+    return geoms, 0
+
+
+def normalize_geometries(frame,
+                         crs=4269,
+                         repair=True,
+                         drop_missing=True,
+                         workers=None,
+                         chunk_size=CHUNK_SIZE):
+    """Reprojects and repairs the geometries of a GeoDataFrame in parallel.
+
+    Parameters
+    --------
+    frame: GeoDataFrame with a CRS set
+    crs: target CRS, anything accepted by GeoSeries.to_crs
+    repair: bool, run make_valid on invalid geometries
+    drop_missing: bool, drop rows whose geometry is missing or empty
+    workers: int, optional, number of processes (defaults to every core)
+    chunk_size: int, rows per task
+
+    Returns
+    --------
+    frame: GeoDataFrame in the same row order
+    stats: dict with the number of 'repaired' and 'dropped' geometries
+    """
+    global _frame
+    chunks = [(start, min(start + chunk_size, len(frame)))
+              for start in range(0, len(frame), chunk_size)]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    _frame = frame
+    try:
+        # Forking is required because the scripts normalizing geometries
+        # (dac_join.py, states_counties.py) have no __main__ guard and a
+        # spawned worker would re-run them
+        if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+            with ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("fork")) as pool:
+                results = list(
+                    pool.map(_normalize_chunk, chunks, repeat(crs),
+                             repeat(repair)))
+        else:
+            results = [
+                _normalize_chunk(chunk, crs, repair) for chunk in chunks
+            ]
+    finally:
+        _frame = None
+
+    if results:
+        frame = frame.copy()
+        # Reassembled by position, not by index label, which may repeat
+        # after a concat or a spatial join. The chunks carry the target CRS.
+        frame["geometry"] = gpd.GeoSeries(
+            np.concatenate([geoms.to_numpy() for geoms, _ in results]),
+            crs=results[0][0].crs).values
+    else:
+        frame = frame.to_crs(crs)
+    stats = {"repaired": sum(n for _, n in results), "dropped": 0}
+    if drop_missing:
+        # Repairs can leave a geometry empty, which is as good as missing
+        missing = (frame.geometry.isna() | frame.geometry.is_empty).values
+        stats["dropped"] = int(missing.sum())
+        frame = frame[~missing]
+    return frame, stats
+
+
+def add_viewports(frame):
+    """Adds the map zoom and center of every geometry.
+
+    The app reads them from the artifact instead of walking the vertices of a
+    boundary every time it draws the report map.
+    """
+    zooms, centers = viewports(frame.geometry)
+    frame = frame.copy()
+    for column, values in zip(VIEWPORT_COLUMNS,
+                              [zooms, centers[:, 0], centers[:, 1]]):
+        frame[column] = values
+    return frame
+
+
+def add_cluster_cells(frame):
+    """Adds the marker cluster cell of every point at each clustering zoom.
+
+    The app groups the selected housing by these ids instead of clustering
+    the points itself every time it draws the report map.
+    """
+    frame = frame.copy()
+    for zoom in CLUSTER_ZOOMS:
+        frame[cluster_column(zoom)] = cluster_cells(frame.geometry.x,
+                                                    frame.geometry.y, zoom)
+    return frame
+
+
+def simplify_tier(geoms, tolerance, decimals):
+    """Simplifies a layer of polygons for one map tier.
+
+    The layer is simplified as a coverage, so edges shared by neighbouring
+    polygons are simplified once and no gaps or overlaps open between them.
+    coverage_simplify does not check its input, so layers that are not a
+    valid coverage are simplified geometry by geometry instead, preserving
+    topology, and so is any polygon the coverage simplification left
+    invalid. Coordinates are then snapped to a grid of the tier's decimals.
+    Polygons that collapse keep their full geometry. Returns a GeoSeries in
+    the same row order.
+    """
+    values = np.asarray(geoms.values, dtype=object)
+    simplified = values.copy()
+    present = ~(shapely.is_missing(values) | shapely.is_empty(values))
+    separate = present.copy()
+    if shapely.coverage_is_valid(values[present]):
+        simplified[present] = shapely.coverage_simplify(values[present],
+                                                        tolerance)
+        separate &= ~shapely.is_valid(simplified) & shapely.is_valid(values)
+    simplified[separate] = shapely.simplify(values[separate],
+                                            tolerance,
+                                            preserve_topology=True)
+    simplified = quantize(shapely.set_precision(simplified, 10**-decimals),
+                          decimals)
+    collapsed = shapely.is_missing(simplified) | shapely.is_empty(simplified)
+    simplified[collapsed] = values[collapsed]
+    return gpd.GeoSeries(simplified, index=geoms.index, crs=geoms.crs)
+
+
+def write_geometry_tiers(frame, name):
+    """Writes <name>_<tier> artifacts holding frame's geometry simplified for
+    every map tier, row for row in frame's order."""
+    for tier, _, tolerance, decimals in GEOMETRY_TIERS:
+        tiered = gpd.GeoDataFrame(
+            {"geometry": simplify_tier(frame.geometry, tolerance, decimals)})
+        write_artifact(tiered, f"{name}_{tier}")
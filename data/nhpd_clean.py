@@ -1,5 +1,11 @@
 # NHPD Carto -> Save as a CSV to reduce storage on Carto server
 # NHPD for Report -> Clean the lat lon and save as spatial file and pickle file for quick loading in app
+#
+# Properties are keyed to the tracts and tribal areas of the artifacts
+# dac_join.py writes (report_data/dac.parquet and tt_shp.parquet), so this
+# script runs after dac_join.py, never alongside it: joining against the raw
+# views instead could key a property to a tract the report table dropped or
+# to a geometry dac_join.py repaired differently.
 
 import pandas as pd
 import geopandas as gpd
@@ -12,10 +18,11 @@ from os import mkdir
 from os.path import exists, sep
 import pickle
 import pyproj
+from pandas.api.types import union_categoricals
+from artifacts import write_artifact
+from geometry_prep import add_cluster_cells
 
-nhpd = pd.read_csv("raw/nhpd.csv")
-
-nhpd = nhpd[[
+NHPD_COLUMNS = [
     "Property Name",
     "Street Address",
     "City",
@@ -40,73 +47,204 @@ nhpd = nhpd[[
     "Inactive Status Description",
     "Latitude",
     "Longitude",
-]]
-
-carto_nhpd = nhpd[[]]
-
-# Rename columns in Carto NHPD
-carto_nhpd.rename(
-    columns={
-        "Property Name": "name",
-        "Street Address": "add",
-        "City": "city",
-        "State": "state",
-        "Zip Code": "zip",
-        "Subsidy Status": "status",
-        "Subsidy Name": "subsidy",
-        "Subsidy Subname": "subnm",
-        "Start Date": "start",
-        "End Date": "end",
-        "Assisted Units": "units",
-        "Owner Name": "owner",
-        "Owner Type": "otype",
-        "0-1 Bedroom Units": "0-1",
-        "Two Bedroom Units": "2-4",
-        "Three+ Bedroom Units": "5-+",
-        "Target Population": "pop",
-        "Earliest Construction Date": "econ",
-        "Latest Construction Date": "lcon",
-        "Rent to FMR Ratio": "rtfmr",
-        "Known Total Units": "totun",
-        "Inactive Status Description": "inact",
-        "Latitude": "latitude",
-        "Longitude": "longitude",
-    },
-    inplace=True,
-)
-
-
-def str_to_float(x):
-    try:
-        x = float(x)
-    except:
-        x = np.nan
-    return x
-
-
-# Drop rows where Subsidy Status != "Active" or "Inconclusive"
-nhpd = nhpd.loc[((nhpd['Subsidy Status'] == "Active") |
-                 (nhpd['Subsidy Status'] == "Inconclusive")), :]
-# Change coordinates to float
-nhpd["lat"] = nhpd["Latitude"].apply(str_to_float)
-nhpd["lon"] = nhpd["Longitude"].apply(str_to_float)
-# Drop rows with NaN
-nhpd = nhpd.dropna(subset=["lat", "lon"])
-nhpd = gpd.GeoDataFrame(nhpd, geometry=gpd.points_from_xy(nhpd.lon, nhpd.lat))
-# Set CRS to EPSG:4326
-nhpd = nhpd.set_crs(4326, allow_override=True)
-nhpd = nhpd.to_crs(pyproj.CRS.from_epsg(4269), inplace=False)
-
-print("Cleaned data, beginning to export")
-# Export carto_nhpd to CARTO
-# carto_nhpd.to_csv("carto_data/carto_nhpd.csv", index=False)
-print("Done exporting Carto NHPD")
-
-# Export nhpd to REPORT as a geojson
-nhpd.to_file("report_data/nhpd.geojson", driver="GeoJSON")
-print("Done exporting Report NHPD Geojson")
-
-# Export nhpd to REPORT as a pickle file
-with open("report_data/nhpd.pkl", "wb") as f:
-    pickle.dump(nhpd, f)
-print("Done exporting Report NHPD Pickle File")
+]
+# Low-cardinality text columns, stored as categoricals
+NHPD_CATEGORIES = [
+    "State",
+    "Subsidy Status",
+    "Subsidy Name",
+    "Subsidy Subname",
+    "Owner Type",
+    "Target Population",
+    "Inactive Status Description",
+]
+NHPD_NUMBERS = [
+    "Assisted Units",
+    "0-1 Bedroom Units",
+    "Two Bedroom Units",
+    "Three+ Bedroom Units",
+    "Rent to FMR Ratio",
+    "Known Total Units",
+]
+NHPD_DATES = [
+    "Start Date",
+    "End Date",
+    "Earliest Construction Date",
+    "Latest Construction Date",
+]
+# Dates in the export are not all written the same way, so every value is
+# parsed on its own rather than in a format guessed from the first rows
+NHPD_DATE_FORMAT = "mixed"
+# Type of every column, applied by the CSV parser as it reads
+NHPD_DTYPES = {
+    **{column: str for column in NHPD_COLUMNS if column not in NHPD_DATES},
+    **{column: "category" for column in NHPD_CATEGORIES},
+    **{column: "float32" for column in NHPD_NUMBERS},
+    "Latitude": "float64",
+    "Longitude": "float64",
+}
+NHPD_CHUNK_ROWS = 50000
+
+
+def read_nhpd(path, chunksize=NHPD_CHUNK_ROWS):
+    """Streams the NHPD export into a GeoDataFrame of active properties.
+
+    Columns are typed by the CSV parser from NHPD_DTYPES and the dates are
+    parsed as they are read, with the same format for every chunk. Dates
+    that cannot be parsed become NaT and are counted in the log. Inactive
+    subsidies and rows without coordinates are dropped as each chunk
+    arrives, so only the rows that are kept are ever held in memory
+    together.
+    """
+    chunks = []
+    coerced = dict.fromkeys(NHPD_DATES, 0)
+    for chunk in pd.read_csv(path,
+                             usecols=NHPD_COLUMNS,
+                             dtype=NHPD_DTYPES,
+                             parse_dates=NHPD_DATES,
+                             date_format=NHPD_DATE_FORMAT,
+                             chunksize=chunksize):
+        # Keep rows where Subsidy Status is "Active" or "Inconclusive"
+        chunk = chunk.loc[chunk["Subsidy Status"].isin(
+            ["Active", "Inconclusive"]), NHPD_COLUMNS]
+        chunk["lat"] = chunk["Latitude"]
+        chunk["lon"] = chunk["Longitude"]
+        chunk = chunk.dropna(subset=["lat", "lon"])
+        if chunk.empty:
+            continue
+        for column in NHPD_DATES:
+            # The parser leaves a column as text when any of its dates fails
+            if not pd.api.types.is_datetime64_any_dtype(chunk[column]):
+                dates = pd.to_datetime(chunk[column],
+                                       format=NHPD_DATE_FORMAT,
+                                       errors="coerce")
+                coerced[column] += int(
+                    (chunk[column].notna() & dates.isna()).sum())
+                chunk[column] = dates
+        for column in NHPD_CATEGORIES:
+            # A column without any value in a chunk gets categories of another
+            # dtype, which could not be merged with the other chunks' below
+            chunk[column] = chunk[column].cat.set_categories(
+                chunk[column].cat.categories.astype(str))
+        chunks.append(
+            gpd.GeoDataFrame(chunk,
+                             geometry=gpd.points_from_xy(chunk.lon, chunk.lat),
+                             crs=4326))
+    for column, count in coerced.items():
+        if count:
+            print(f"{count} unreadable {column} values set to missing")
+    if not chunks:
+        raise ValueError(f"{path} has no active properties with coordinates")
+    # Chunks have their own categories, so align them before concatenating or
+    # pandas would fall back to object columns
+    for column in NHPD_CATEGORIES:
+        categories = union_categoricals([chunk[column] for chunk in chunks
+                                         ]).categories
+        for chunk in chunks:
+            chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+# Assigns each property the GEOID of the first polygon in boundaries that
+# contains it (properties on a shared edge go to the first match)
+def assign_key(points, boundaries):
+    joined = gpd.sjoin(points[["geometry"]],
+                       boundaries[["GEOID", "geometry"]],
+                       how="left",
+                       predicate="intersects")
+    return joined[~joined.index.duplicated(keep="first")]["GEOID"]
+
+
+if __name__ == "__main__":
+    nhpd = read_nhpd("raw/nhpd.csv")
+
+    carto_nhpd = nhpd[[]]
+
+    # Rename columns in Carto NHPD
+    carto_nhpd.rename(
+        columns={
+            "Property Name": "name",
+            "Street Address": "add",
+            "City": "city",
+            "State": "state",
+            "Zip Code": "zip",
+            "Subsidy Status": "status",
+            "Subsidy Name": "subsidy",
+            "Subsidy Subname": "subnm",
+            "Start Date": "start",
+            "End Date": "end",
+            "Assisted Units": "units",
+            "Owner Name": "owner",
+            "Owner Type": "otype",
+            "0-1 Bedroom Units": "0-1",
+            "Two Bedroom Units": "2-4",
+            "Three+ Bedroom Units": "5-+",
+            "Target Population": "pop",
+            "Earliest Construction Date": "econ",
+            "Latest Construction Date": "lcon",
+            "Rent to FMR Ratio": "rtfmr",
+            "Known Total Units": "totun",
+            "Inactive Status Description": "inact",
+            "Latitude": "latitude",
+            "Longitude": "longitude",
+        },
+        inplace=True,
+    )
+
+    # Change projection
+    nhpd = nhpd.to_crs(pyproj.CRS.from_epsg(4269), inplace=False)
+
+
+    # Assign every property to its tract, county and state once, so the report
+    # can select housing by key instead of a point-in-polygon join. Needs the
+    # tract and tribal artifacts from dac_join.py (see the top of this file).
+    tracts = gpd.read_parquet("report_data/dac.parquet", columns=["GEOID", "geometry"])
+    tt_shp = gpd.read_parquet("report_data/tt_shp.parquet", columns=["GEOID", "geometry"])
+    nhpd = nhpd.reset_index(drop=True)
+    # Tract GEOIDs are int64 codes in the tract artifact, so the county and state
+    # keys are arithmetic prefixes. They are null for properties outside every
+    # tract (coordinates off the coast or outside the US), which therefore are in
+    # no tract, county or state report: state and county reports select the same
+    # tract GEOID range of properties that their tracts do.
+    nhpd["tract_geoid"] = assign_key(nhpd, tracts.to_crs(nhpd.crs)).astype("Int64")
+    nhpd["county_fips"] = nhpd["tract_geoid"] // 10**6
+    nhpd["state_fips"] = nhpd["tract_geoid"] // 10**9
+    print(f"Assigned {nhpd['tract_geoid'].notna().sum()} of {len(nhpd)} properties to tracts")
+
+    print("Cleaned data, beginning to export")
+    # Export carto_nhpd to CARTO
+    # carto_nhpd.to_csv("carto_data/carto_nhpd.csv", index=False)
+    print("Done exporting Carto NHPD")
+
+    # Export nhpd to REPORT as a geojson
+    # (fiona cannot write categorical columns, so they go out as plain text)
+    nhpd.astype({column: object for column in NHPD_CATEGORIES}).to_file(
+        "report_data/nhpd.geojson", driver="GeoJSON")
+    print("Done exporting Report NHPD Geojson")
+
+    # Export nhpd to REPORT as a pickle file
+    with open("report_data/nhpd.pkl", "wb") as f:
+        pickle.dump(nhpd, f)
+    print("Done exporting Report NHPD Pickle File")
+
+    # Export nhpd to REPORT as a columnar artifact, with the map marker cluster
+    # of every property. Sorted by tract GEOID (properties outside every tract
+    # last) so the properties of a tract, county or state are one range of rows.
+    nhpd = write_artifact(add_cluster_cells(nhpd), "nhpd", sort_by="tract_geoid")
+    print("Done exporting Report NHPD Parquet File")
+
+    # Tribal areas overlap, so a property can be in several. Like the tract
+    # membership index of dac_join.py, every (tribal area, property row) pair is
+    # a row of the index, by position in the sorted artifact written above.
+    tribes = gpd.sjoin(nhpd[["geometry"]],
+                       tt_shp.to_crs(nhpd.crs)[["GEOID", "geometry"]],
+                       how="inner",
+                       predicate="intersects")
+    membership = pd.DataFrame({
+        "level": "tribe",
+        "key": tribes["GEOID"].values,
+        "row": tribes.index.values.astype(np.int32),
+    })
+    write_artifact(membership, "nhpd_index", sort_by=["level", "key", "row"])
+    print(f"Done exporting NHPD membership index of {len(membership)} "
+          "property tribal areas")
@@ -0,0 +1,291 @@
+# Runs the data/ build scripts as a DAG of stages with declared inputs and
+# outputs. Content hashes of every input are recorded in a manifest, so a
+# stage is skipped when nothing it reads has changed since its last
+# successful run, and stages that do not depend on each other run at the
+# same time.
+#
+# Usage (from the data/ directory):
+#   python pipeline.py                  # build everything that is stale
+#   python pipeline.py dac_join         # only the named stages
+#   python pipeline.py --force          # ignore the manifest
+#   python pipeline.py --dry-run        # show what would run
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+MANIFEST = "pipeline_manifest.json"
+OUTPUT_DIRS = ["sql_output", "report_data", "carto_data"]
+
+
+class Stage:
+
+    def __init__(self, name, script, inputs, outputs, modules=()):
+        self.name = name
+        self.script = script
+        # Code is an input too: editing a script or a helper module it
+        # imports makes the stage stale
+        self.inputs = [script, *modules, *inputs]
+        self.outputs = list(outputs)
+
+
+STAGES = [
+    Stage(
+        "sqlite_extract",
+        "sqlite_extract.py",
+        inputs=["raw/gis_data.sqlite"],
+        outputs=[
+            "sql_output/MappingDisplay_Data.parquet",
+            "sql_output/MappingDisplay_TribesAndTerritories.parquet",
+            "sql_output/dac_pct.csv",
+        ],
+    ),
+    Stage(
+        "dac_join",
+        "dac_join.py",
+        modules=[
+            "artifacts.py", "geometry_prep.py", "../equity_common/mapgeometry.py"
+        ],
+        inputs=[
+            "raw/qct.csv",
+            "sql_output/MappingDisplay_Data.parquet",
+            "sql_output/MappingDisplay_TribesAndTerritories.parquet",
+            "sql_output/dac_pct.csv",
+        ],
+        outputs=[
+            "report_data/dac.parquet",
+            "report_data/dac.pkl",
+            "report_data/tt_shp.parquet",
+            "report_data/tt_shp.pkl",
+            "report_data/dac_index.parquet",
+            "report_data/dac_low.parquet",
+            "report_data/dac_mid.parquet",
+            "report_data/dac_high.parquet",
+        ],
+    ),
+    # Keys properties to the tracts and tribal areas dac_join writes, so it
+    # waits for dac_join instead of running alongside it. states_counties
+    # still runs in parallel with both.
+    Stage(
+        "nhpd_clean",
+        "nhpd_clean.py",
+        modules=[
+            "artifacts.py", "geometry_prep.py", "../equity_common/mapgeometry.py"
+        ],
+        inputs=[
+            "raw/nhpd.csv",
+            "report_data/dac.parquet",
+            "report_data/tt_shp.parquet",
+        ],
+        outputs=[
+            "report_data/nhpd.parquet",
+            "report_data/nhpd.pkl",
+            "report_data/nhpd_index.parquet",
+        ],
+    ),
+    Stage(
+        "states_counties",
+        "states_counties.py",
+        modules=[
+            "artifacts.py", "geometry_prep.py", "../equity_common/mapgeometry.py"
+        ],
+        inputs=["raw/counties_500k_2021.zip", "raw/states_500k_2021.zip"],
+        outputs=[
+            "report_data/counties.parquet",
+            "report_data/counties.pkl",
+            "report_data/states.parquet",
+            "report_data/states.pkl",
+        ],
+    ),
+    Stage(
+        "search_index",
+        "search_index.py",
+        modules=["artifacts.py", "../equity_common/searchkeys.py"],
+        inputs=[
+            "report_data/dac.parquet",
+            "report_data/counties.parquet",
+            "report_data/states.parquet",
+            "report_data/tt_shp.parquet",
+        ],
+        outputs=["report_data/search_index.parquet"],
+    ),
+    Stage(
+        "aggregates",
+        "aggregates.py",
+        modules=["artifacts.py"],
+        inputs=[
+            "report_data/dac.parquet",
+            "report_data/dac_index.parquet",
+            "report_data/nhpd.parquet",
+            "report_data/nhpd_index.parquet",
+            "report_data/counties.parquet",
+            "report_data/states.parquet",
+            "report_data/tt_shp.parquet",
+        ],
+        outputs=["report_data/aggregates.parquet"],
+    ),
+]
+
+
+def load_manifest():
+    if not os.path.exists(MANIFEST):
+        return {"files": {}, "stages": {}}
+    with open(MANIFEST) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest):
+    with open(MANIFEST + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(MANIFEST + ".tmp", MANIFEST)
+
+
+def file_hash(path, manifest):
+    # Hashing the multi-gigabyte inputs is slow, so reuse the recorded hash
+    # while the file's size and modification time are unchanged
+    stat = os.stat(path)
+    cached = manifest["files"].get(path)
+    if cached and cached["size"] == stat.st_size and cached[
+            "mtime_ns"] == stat.st_mtime_ns:
+        return cached["sha256"]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    manifest["files"][path] = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": digest.hexdigest(),
+    }
+    return digest.hexdigest()
+
+
+def input_hashes(stage, manifest):
+    missing = [path for path in stage.inputs if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(
+            f"Stage {stage.name} is missing inputs: {', '.join(missing)}")
+    return {path: file_hash(path, manifest) for path in stage.inputs}
+
+
+def is_stale(stage, manifest):
+    record = manifest["stages"].get(stage.name)
+    if record is None:
+        return True
+    if not all(os.path.exists(path) for path in stage.outputs):
+        return True
+    return record["inputs"] != input_hashes(stage, manifest)
+
+
+def dependencies(stages):
+    # A stage depends on every stage that produces one of its inputs
+    producers = {
+        path: stage.name
+        for stage in STAGES for path in stage.outputs
+    }
+    return {
+        stage.name: {
+            producers[path]
+            for path in stage.inputs if path in producers
+        } & {other.name
+             for other in stages}
+        for stage in stages
+    }
+
+
+def run_stage(stage):
+    start = time.perf_counter()
+    print(f"[{stage.name}] running {stage.script}")
+    result = subprocess.run([sys.executable, stage.script])
+    return result.returncode, time.perf_counter() - start
+
+
+def run(selected, force=False, dry_run=False, jobs=None):
+    manifest = load_manifest()
+    deps = dependencies(selected)
+    pending = {stage.name: stage for stage in selected}
+    done, failed, rebuilt = set(), set(), set()
+    running = {}
+    for directory in OUTPUT_DIRS:
+        os.makedirs(directory, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=jobs or len(selected)) as pool:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if deps[name] & failed:
+                    print(f"[{name}] skipped, an upstream stage failed")
+                    failed.add(name)
+                    del pending[name]
+                elif deps[name] <= done:
+                    del pending[name]
+                    # Inputs are final once every upstream stage has finished.
+                    # In a dry run an upstream stage that would run makes
+                    # this one stale without looking at its inputs.
+                    try:
+                        stale = (force or (dry_run and deps[name] & rebuilt)
+                                 or is_stale(stage, manifest))
+                    except FileNotFoundError as e:
+                        print(f"[{name}] {e}")
+                        failed.add(name)
+                        continue
+                    if not stale:
+                        print(f"[{name}] up to date")
+                        done.add(name)
+                    elif dry_run:
+                        print(f"[{name}] would run")
+                        done.add(name)
+                        rebuilt.add(name)
+                    else:
+                        running[pool.submit(run_stage, stage)] = stage
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                returncode, seconds = future.result()
+                if returncode != 0:
+                    print(f"[{stage.name}] failed with exit code "
+                          f"{returncode} after {seconds:.1f}s")
+                    failed.add(stage.name)
+                    continue
+                print(f"[{stage.name}] finished in {seconds:.1f}s")
+                manifest["stages"][stage.name] = {
+                    "inputs": input_hashes(stage, manifest),
+                    "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                }
+                save_manifest(manifest)
+                done.add(stage.name)
+    return not failed
+
+
+if __name__ == "__main__":
+    names = [stage.name for stage in STAGES]
+    parser = argparse.ArgumentParser(
+        description="Build the report data, skipping unchanged stages.")
+    parser.add_argument("stages",
+                        nargs="*",
+                        help=f"Stages to run (default: all of {', '.join(names)})")
+    parser.add_argument("--force",
+                        action="store_true",
+                        help="Run stages even if their inputs are unchanged")
+    parser.add_argument("--dry-run",
+                        action="store_true",
+                        help="Only print which stages would run")
+    parser.add_argument("--jobs",
+                        type=int,
+                        default=None,
+                        help="Maximum number of stages to run at once")
+    args = parser.parse_args()
+    unknown = set(args.stages) - set(names)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    selected = [
+        stage for stage in STAGES
+        if not args.stages or stage.name in args.stages
+    ]
+    sys.exit(0 if run(selected, args.force, args.dry_run, args.jobs) else 1)
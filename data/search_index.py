@@ -0,0 +1,38 @@
+# Builds the location search index of the Report page: every tract ID, city,
+# county, state and tribal area name, under a normalized key for the start of
+# each of its words, sorted so the app finds every name starting with a query
+# with two binary searches (see streamlit/search.py). Keys are normalized
+# by equity_common/searchkeys.py, which the app uses for queries too.
+#
+# Names are spelled exactly as the Report page shows them, which is how a
+# report looks its boundary up.
+
+import pandas as pd
+
+from artifacts import write_artifact
+from equity_common.searchkeys import index_entries
+
+dac = pd.read_parquet("report_data/dac.parquet",
+                      columns=["GEOID", "city", "county_name"])
+# Tracts are named by their zero-padded GEOID, cities as "city (county)"
+tracts = dac["GEOID"].astype("int64").astype(str).str.zfill(11)
+has_city = dac["city"].notna()
+cities = (dac["city"].astype(object) + " (" +
+          dac["county_name"].astype(object) + ")")[has_city]
+
+entries = pd.concat([
+    index_entries(tracts, "Census Tract ID"),
+    index_entries(cities, "City"),
+    index_entries(
+        pd.read_parquet("report_data/counties.parquet", columns=["NAME"])["NAME"],
+        "County"),
+    index_entries(
+        pd.read_parquet("report_data/states.parquet", columns=["NAME"])["NAME"],
+        "State"),
+    index_entries(
+        pd.read_parquet("report_data/tt_shp.parquet", columns=["NAME"])["NAME"],
+        "Tribe or Territory"),
+],
+                    ignore_index=True)
+write_artifact(entries, "search_index", sort_by=["level", "key"])
+print(f"Search index exported with {len(entries)} keys.")
@@ -1,6 +1,17 @@
-# You must have GDAL installed to use this script
-# Only need to run once to create the geojson and csv files
+# Exports the mapping views and the DAC percentiles from the GIS SQLite
+# database into sql_output/.
+#
+# By default the views are streamed straight into GeoParquet: rows are read in
+# bounded chunks, geometry blobs are converted to WKB without being parsed
+# into Python objects, and each chunk is appended to the output file, so
+# memory stays flat however large the database is. dac_join.py decodes the
+# WKB in bulk when it reads the file.
+#
+# The old path (ogr2ogr to GeoJSON, needs GDAL installed) is still available:
+#   python sqlite_extract.py --mode ogr2ogr
 
+import argparse
+import json
 import pandas as pd
 import geopandas as gpd
 import sqlite3 as sql
@@ -8,35 +19,270 @@ import subprocess
 import sys
 import os
 from os import mkdir
-from os.path import exists, sep
+from os.path import exists, getmtime, sep
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyproj
 
+CHUNK_ROWS = 20000
 
-# Runs a command on the shell and pipes its output to STDOUT
-def run_command(cmd):
+
+# Runs a command on the shell and pipes its output to STDOUT. With check, a
+# non-zero exit status raises CalledProcessError.
+def run_command(cmd, check=False):
     process = subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True)
-    for c in iter(lambda: process.stdout.read(1), b""):
-        sys.stdout.write(c)
+    for line in process.stdout:
+        sys.stdout.buffer.write(line)
+    sys.stdout.flush()
+    returncode = process.wait()
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return returncode
+
+
+def load_spatialite(con):
+    # SpatiaLite's AsBinary() turns its internal blobs into standard WKB
+    con.enable_load_extension(True)
+    for name in ("mod_spatialite", "mod_spatialite.so", "libspatialite"):
+        try:
+            con.load_extension(name)
+            return True
+        except sql.OperationalError:
+            continue
+    return False
+
+
+def geometry_column(con, view):
+    # Registered geometry columns first, then the usual column names
+    queries = [
+        ("SELECT view_geometry FROM views_geometry_columns "
+         "WHERE lower(view_name) = lower(?)"),
+        ("SELECT f_geometry_column FROM geometry_columns "
+         "WHERE lower(f_table_name) = lower(?)"),
+    ]
+    candidates = ["geometry", "geom", "the_geom", "shape"]
+    for query in queries:
+        try:
+            row = con.execute(query, (view, )).fetchone()
+        except sql.OperationalError:
+            continue
+        if row is not None:
+            candidates.insert(0, row[0].lower())
+            break
+    # SpatiaLite stores registered names in lower case
+    columns = [row[1] for row in con.execute(f"PRAGMA table_info({view})")]
+    for candidate in candidates:
+        for column in columns:
+            if column.lower() == candidate:
+                return column
+    raise ValueError(f"Could not find a geometry column in {view}")
+
+
+def geometry_srid(con, view):
+    for query in [
+            "SELECT g.srid FROM views_geometry_columns v JOIN geometry_columns g "
+            "ON lower(v.f_table_name) = lower(g.f_table_name) "
+            "AND lower(v.f_geometry_column) = lower(g.f_geometry_column) "
+            "WHERE lower(v.view_name) = lower(?)",
+            "SELECT srid FROM geometry_columns WHERE lower(f_table_name) = lower(?)",
+    ]:
+        try:
+            row = con.execute(query, (view, )).fetchone()
+        except sql.OperationalError:
+            continue
+        if row is not None and row[0] not in (None, 0, -1):
+            return row[0]
+    return None
+
+
+# Byte size of the envelope in a GeoPackage blob, by envelope indicator
+GPKG_ENVELOPE_SIZE = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+
+
+def gpkg_to_wkb(blob):
+    # GeoPackage blobs are a short header followed by standard WKB
+    if blob is None:
+        return None
+    flags = blob[3]
+    return bytes(blob[8 + GPKG_ENVELOPE_SIZE[(flags >> 1) & 0x07]:])
+
+
+# SpatiaLite blobs start with 0x00, an endianness byte, the SRID and the
+# bounding box, which ends with 0x7C at offset 38. Anything else that is not
+# a GeoPackage blob is taken to be the WKB OGR writes to plain SQLite.
+SPATIALITE_MBR_END = 38
+
+
+def is_spatialite(blob):
+    return (len(blob) > SPATIALITE_MBR_END + 1 and blob[0] == 0x00
+            and blob[1] in (0x00, 0x01)
+            and blob[SPATIALITE_MBR_END] == 0x7C and blob[-1] == 0xFE)
 
 
-views = ["MappingDisplay_Data", "MappingDisplay_TribesAndTerritories"]
+def to_wkb(blob):
+    """Standard WKB of a geometry blob read without mod_spatialite: the WKB
+    inside a GeoPackage blob, or the blob itself if it is already WKB.
+    Raises RuntimeError for SpatiaLite blobs, which need the extension."""
+    if blob is None:
+        return None
+    if blob[:2] == b"GP":
+        return gpkg_to_wkb(blob)
+    if is_spatialite(blob):
+        raise RuntimeError(
+            "Geometries are SpatiaLite blobs but the mod_spatialite extension "
+            "could not be loaded. Install it or use --mode ogr2ogr.")
+    return bytes(blob)
 
-SQLDATA = "raw/gis_data.sqlite"
-for view in views:
-    if exists(f"{view}.geojson"):
+
+# SQLite declared column types mapped to Arrow types, by SQLite's affinity rules
+def arrow_type(declared):
+    declared = (declared or "").upper()
+    if "INT" in declared:
+        return pa.int64()
+    if any(word in declared for word in ("CHAR", "CLOB", "TEXT", "DATE")):
+        return pa.string()
+    if any(word in declared for word in ("REAL", "FLOA", "DOUB", "NUM", "DEC")):
+        return pa.float64()
+    return None
+
+
+def column_types(con, view, columns, declared):
+    """Arrow type of each column, fixed before any row is written.
+
+    SQLite is dynamically typed, so a declared type is only a hint and a
+    column can hold integers in one row and reals or text in the next. One
+    pass over the view collects the storage classes every column actually
+    holds and each column gets the narrowest type that fits all of them: text
+    over real over integer. Columns that are NULL throughout fall back to
+    their declared type, or text.
+    """
+    if not columns:
+        return {}
+    select = ", ".join(f'group_concat(DISTINCT typeof("{name}"))'
+                       for name in columns)
+    classes = con.execute(f"SELECT {select} FROM {view}").fetchone()
+    types = {}
+    for name, found in zip(columns, classes):
+        found = set((found or "").split(",")) - {"", "null"}
+        if "blob" in found:
+            types[name] = pa.binary()
+        elif "text" in found:
+            types[name] = pa.string()
+        elif "real" in found:
+            types[name] = pa.float64()
+        elif "integer" in found:
+            types[name] = pa.int64()
+        else:
+            types[name] = arrow_type(declared[name]) or pa.string()
+    return types
+
+
+def to_arrow(values, type):
+    try:
+        return pa.array(values, type=type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+        # Text columns also hold the numbers stored in them
+        return pa.array([None if v is None else str(v) for v in values],
+                        type=type)
+
+
+def stream_view(con, view, out_path, spatialite):
+    geom = geometry_column(con, view)
+    info = list(con.execute(f"PRAGMA table_info({view})"))
+    names = [row[1] for row in info]
+    types = column_types(con, view, [name for name in names if name != geom],
+                         {row[1]: row[2] for row in info})
+    select = ", ".join(f'AsBinary("{name}")' if name == geom and spatialite
+                       else f'"{name}"' for name in names)
+    srid = geometry_srid(con, view)
+    geo = {
+        "version": "0.4.0",
+        "primary_column": "geometry",
+        "columns": {
+            "geometry": {
+                "encoding": "WKB",
+                "geometry_types": []
+            }
+        },
+    }
+    if srid is not None:
+        geo["columns"]["geometry"]["crs"] = pyproj.CRS.from_epsg(
+            srid).to_json_dict()
+
+    schema = pa.schema(
+        [("geometry", pa.binary()) if name == geom else (name, types[name])
+         for name in names],
+        metadata={b"geo": json.dumps(geo).encode()})
+    cursor = con.execute(f"SELECT {select} FROM {view}")
+    tmp_path = out_path + ".tmp"
+    writer, rows = None, 0
+    try:
+        for chunk in iter(lambda: cursor.fetchmany(CHUNK_ROWS), []):
+            columns = list(zip(*chunk))
+            arrays = []
+            for i, name in enumerate(names):
+                if name == geom:
+                    values = columns[i]
+                    if not spatialite:
+                        values = [to_wkb(v) for v in values]
+                    arrays.append(pa.array(values, type=pa.binary()))
+                else:
+                    arrays.append(to_arrow(columns[i], types[name]))
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, schema)
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            rows += len(chunk)
+            print(f"{view}: {rows} rows", end="\r")
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise RuntimeError(f"View {view} returned no rows")
+    os.replace(tmp_path, out_path)
+    print(f"{view}: exported {rows} rows to {out_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the GIS SQLite views to sql_output/.")
+    parser.add_argument("--mode",
+                        choices=["stream", "ogr2ogr"],
+                        default="stream",
+                        help="stream to GeoParquet (default) or use ogr2ogr to "
+                        "write GeoJSON")
+    args = parser.parse_args()
+
+    views = ["MappingDisplay_Data", "MappingDisplay_TribesAndTerritories"]
+
+    SQLDATA = "raw/gis_data.sqlite"
+    con = sql.connect(SQLDATA)
+    spatialite = args.mode == "stream" and load_spatialite(con)
+    for view in views:
+        extension = "parquet" if args.mode == "stream" else "geojson"
+        out_path = f"sql_output/{view}.{extension}"
+        # Only skip views exported from this version of the database
+        if exists(out_path) and getmtime(out_path) > getmtime(SQLDATA):
+            print(
+                f"Skipping exporting view {view} from database ({extension} already exists)."
+            )
+            continue
+        if args.mode == "stream":
+            print(f"Streaming view {view} from database to GeoParquet...")
+            stream_view(con, view, out_path, spatialite)
+            continue
         print(
-            f"Skipping exporting view {view} from database (geojson already exists)."
+            f"Exporting view {view} from database to GeoJSON (this will take a bit)..."
         )
-        continue
-    print(
-        f"Exporting view {view} from database to GeoJSON (this will take a bit)..."
-    )
-    # Export the results of the view to geojson so we can pass it to tippecanoe
-    run_command(
-        f'ogr2ogr -f GeoJson -sql "SELECT * from {view}" sql_output/{view}.geojson {SQLDATA}'
-    )
-
-con = sql.connect(SQLDATA)
-dac_pct = pd.read_sql_query("SELECT * from DAC_percentiles_data", con)
-con.close()
-# Save dac_pct to csv in SQL_OUTPUT
-dac_pct.to_csv(f"sql_output/dac_pct.csv")
+        # Export the results of the view to geojson so we can pass it to tippecanoe.
+        # Written under a temporary name, so a failed export leaves no partial
+        # file behind that a later run would take as done
+        tmp_path = out_path + ".tmp"
+        run_command(
+            f'ogr2ogr -f GeoJson -sql "SELECT * from {view}" {tmp_path} {SQLDATA}',
+            check=True)
+        os.replace(tmp_path, out_path)
+
+    dac_pct = pd.read_sql_query("SELECT * from DAC_percentiles_data", con)
+    con.close()
+    # Save dac_pct to csv in SQL_OUTPUT
+    dac_pct.to_csv(f"sql_output/dac_pct.csv")
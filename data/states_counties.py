@@ -9,6 +9,8 @@ from os import mkdir
 from os.path import exists, sep
 import pyproj
 from shapely.validation import explain_validity, make_valid
+from artifacts import write_artifact
+from geometry_prep import add_viewports, normalize_geometries
 
 
 # COUNTIES
@@ -26,12 +28,15 @@ counties = counties[[
 counties = counties.sort_values(by="NAME")
 # Save to geojson in CARTO and REPORT
 # counties.to_file("carto_data/counties.geojson", driver="GeoJSON")
-counties = counties.to_crs(pyproj.CRS.from_epsg(4269), inplace=False)
-for i, row in counties.iterrows():
-    counties.at[i, "geometry"] = make_valid(row["geometry"])
+counties, stats = normalize_geometries(counties,
+                                       crs=pyproj.CRS.from_epsg(4269),
+                                       drop_missing=False)
+print(f"Counties: repaired {stats['repaired']} geometries")
 counties.to_file("report_data/counties.geojson", driver="GeoJSON")
 # Save to pickle in REPORT
 counties.to_pickle("report_data/counties.pkl")
+# Save columnar artifact in REPORT, with the map viewport of each county
+counties = write_artifact(add_viewports(counties), "counties")
 print("Counties file exported")
 
 # STATES
@@ -41,9 +46,14 @@ states = states[["NAME", "STUSPS", "GEOID", "STATEFP", "geometry"]]
 states = states[~states["STATEFP"].isin(["60", "66", "69", "72", "78"])]
 # Sort alphabetically by name
 states = states.sort_values(by="NAME")
-states = states.to_crs(pyproj.CRS.from_epsg(4269), inplace=False)
+states, _ = normalize_geometries(states,
+                                 crs=pyproj.CRS.from_epsg(4269),
+                                 repair=False,
+                                 drop_missing=False)
 # Save to geojson in REPORT
 states.to_file("report_data/states.geojson", driver="GeoJSON")
 # Save to pickle in REPORT
 states.to_pickle("report_data/states.pkl")
+# Save columnar artifact in REPORT, with the map viewport of each state
+states = write_artifact(add_viewports(states), "states")
 print("States file exported")
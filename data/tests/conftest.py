@@ -0,0 +1,6 @@
+# The build scripts import each other by bare name, the way they run from
+# the data/ directory
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,105 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+import geometry_prep
+from geometry_prep import (normalize_geometries, repair_geometries,
+                           simplify_tier)
+
+# A bow tie, which make_valid splits into two triangles
+BOW_TIE = shapely.Polygon([(0, 0), (1, 1), (1, 0), (0, 1), (0, 0)])
+
+
+def boxes(count):
+    return [shapely.box(i, 0, i + 1, 1) for i in range(count)]
+
+
+def test_repair_geometries_only_touches_invalid_ones():
+    geoms = gpd.GeoSeries([*boxes(2), BOW_TIE, None])
+    repaired, count = repair_geometries(geoms)
+    assert count == 1
+    assert repaired.iloc[0] is geoms.iloc[0]
+    assert repaired.iloc[2].is_valid
+    assert repaired.iloc[2].area == pytest.approx(0.5)
+    assert repaired.iloc[3] is None
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_normalize_keeps_rows_in_place_with_repeated_labels(workers):
+    # Index labels repeat, as they do after a concat
+    frame = gpd.GeoDataFrame({"name": list("abcde")},
+                             geometry=[*boxes(3), BOW_TIE, None],
+                             index=[0, 1, 0, 1, 0],
+                             crs="EPSG:4326")
+    normalized, stats = normalize_geometries(frame,
+                                             crs="EPSG:4269",
+                                             workers=workers,
+                                             chunk_size=2)
+    assert stats == {"repaired": 1, "dropped": 1}
+    assert normalized.crs == "EPSG:4269"
+    assert normalized["name"].tolist() == list("abcd")
+    assert normalized.index.tolist() == [0, 1, 0, 1]
+    # Every geometry stays on its own row
+    for i in range(3):
+        assert normalized.geometry.iloc[i].equals(boxes(3)[i])
+    assert normalized.geometry.iloc[3].is_valid
+
+
+def test_normalize_reprojects_an_empty_frame():
+    frame = gpd.GeoDataFrame({"name": []}, geometry=[], crs="EPSG:4326")
+    normalized, stats = normalize_geometries(frame, crs="EPSG:4269")
+    assert normalized.empty
+    assert normalized.crs == "EPSG:4269"
+    assert stats == {"repaired": 0, "dropped": 0}
+
+
+def neighbours():
+    # Two squares sharing a wiggly edge: a valid coverage with vertices to
+    # remove
+    ys = np.linspace(0, 1, 101)
+    edge = [(0.5 + 0.001 * np.sin(y * 300), y) for y in ys]
+    west = shapely.Polygon([(0, 0), *edge, (0, 1)])
+    east = shapely.Polygon([(1, 0), (1, 1), *edge[::-1]])
+    return [west, east]
+
+
+def test_simplify_tier_keeps_a_coverage_free_of_gaps_and_overlaps():
+    geoms = gpd.GeoSeries([*neighbours(), None, shapely.Polygon()],
+                          index=[10, 11, 12, 13])
+    simplified = simplify_tier(geoms, 0.005, 3)
+    assert simplified.index.tolist() == [10, 11, 12, 13]
+    west, east = simplified.iloc[:2]
+    assert shapely.get_num_coordinates(west) < shapely.get_num_coordinates(
+        geoms.iloc[0])
+    # The shared edge was simplified once, for both polygons
+    assert shapely.coverage_is_valid(np.array([west, east]))
+    assert west.intersection(east).area == pytest.approx(0, abs=1e-12)
+    assert west.union(east).area == pytest.approx(1, rel=1e-3)
+    assert simplified.iloc[2] is None
+    assert simplified.iloc[3].is_empty
+
+
+def test_simplify_tier_falls_back_per_geometry_for_an_invalid_coverage(
+        monkeypatch):
+    west, east = neighbours()
+    # Overlapping polygons are not a coverage and must never reach
+    # coverage_simplify, which does not check its input
+    overlapping = shapely.box(0.4, 0, 1, 1)
+
+    def coverage_simplify(*args, **kwargs):
+        raise AssertionError("coverage_simplify called on an invalid coverage")
+
+    monkeypatch.setattr(geometry_prep.shapely, "coverage_simplify",
+                        coverage_simplify)
+    simplified = simplify_tier(gpd.GeoSeries([west, overlapping]), 0.005, 3)
+    assert simplified.is_valid.all()
+    assert shapely.get_num_coordinates(
+        simplified.iloc[0]) < shapely.get_num_coordinates(west)
+    assert simplified.iloc[1].equals(overlapping)
+
+
+def test_simplify_tier_keeps_polygons_that_would_collapse():
+    speck = shapely.box(0, 0, 0.0001, 0.0001)
+    simplified = simplify_tier(gpd.GeoSeries([speck]), 0.005, 3)
+    assert simplified.iloc[0].equals(speck)
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+import shapely
+
+from equity_common.mapgeometry import (CLUSTER_ZOOMS, GEOMETRY_TIERS,
+                                       cluster_cells, cluster_zoom,
+                                       geometry_tier, quantize,
+                                       simplify_for_zoom, viewports,
+                                       zoom_centers)
+
+
+def test_zoom_centers_of_many_extents_at_once():
+    bounds = np.array([
+        [-72.0, 42.0, -71.0, 43.0],
+        [-125.0, 24.0, -66.0, 50.0],
+        [-71.06, 42.36, -71.05, 42.37],
+    ])
+    zooms, centers = zoom_centers(bounds)
+    assert centers.tolist() == [[-71.5, 42.5], [-95.5, 37.0],
+                                pytest.approx([-71.055, 42.365])]
+    # Smaller extents get closer zooms, all within the map's range
+    assert zooms[1] < zooms[0] < zooms[2]
+    assert ((zooms >= 1) & (zooms <= 20)).all()
+    # One extent gives the same answer as in a batch
+    zoom, center = zoom_centers(bounds[0])
+    assert zoom[0] == zooms[0]
+    assert center[0].tolist() == centers[0].tolist()
+
+
+def test_viewports_fit_multipolygons_one_level_out():
+    box = shapely.box(-72, 42, -71, 43)
+    islands = shapely.MultiPolygon([box, shapely.box(-60, 42, -59.9, 42.1)])
+    zooms, centers = viewports([box, islands, None, shapely.Polygon()])
+    # Fitted to the largest part, then one level further out
+    assert zooms[1] == zooms[0] - 1
+    assert centers[1].tolist() == centers[0].tolist() == [-71.5, 42.5]
+    assert np.isnan(zooms[2:]).all() and np.isnan(centers[2:]).all()
+
+
+def test_cluster_cells_group_nearby_points():
+    lons = np.array([-71.06, -71.0601, -122.42, np.nan])
+    lats = np.array([42.36, 42.3601, 37.77, 42.36])
+    for zoom in CLUSTER_ZOOMS:
+        cells = cluster_cells(lons, lats, zoom)
+        assert cells[0] == cells[1]
+        assert cells[0] != cells[2]
+        assert cells[3] == -1
+    # Cells are finer at closer zooms
+    assert len(np.unique(cluster_cells(lons[:3], lats[:3], 2))) <= len(
+        np.unique(cluster_cells(lons[:3], lats[:3], 12)))
+
+
+def test_zoom_levels_map_to_clusters_and_tiers():
+    assert cluster_zoom(0) == CLUSTER_ZOOMS[0]
+    assert cluster_zoom(7.5) == 6
+    assert cluster_zoom(20) == CLUSTER_ZOOMS[-1]
+    assert [geometry_tier(zoom) for zoom in (0, 5.9, 6, 8.9, 9, 15)] == [
+        "low", "low", "mid", "mid", "high", "high"
+    ]
+
+
+def test_simplify_for_zoom_quantizes_to_the_tier():
+    # A wiggly line, so simplification has vertices to remove
+    xs = np.linspace(-72, -71, 200)
+    wiggle = shapely.Polygon(
+        [*zip(xs, 42 + 0.0001 * np.sin(xs * 500)), (-71, 43), (-72, 43)])
+    for zoom in (3, 7, 12):
+        _, _, _, decimals = [
+            tier for tier in GEOMETRY_TIERS if tier[0] == geometry_tier(zoom)
+        ][0]
+        simplified = simplify_for_zoom([wiggle], zoom)[0]
+        coords = shapely.get_coordinates(simplified)
+        assert np.array_equal(coords, np.round(coords, decimals))
+        assert len(coords) <= len(shapely.get_coordinates(wiggle))
+    assert shapely.get_num_coordinates(simplify_for_zoom([wiggle], 3)[0]) < 10
+    assert quantize(np.array([shapely.Point(1.23456, 2.34567)]),
+                    2)[0].equals(shapely.Point(1.23, 2.35))
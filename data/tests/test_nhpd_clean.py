@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from nhpd_clean import NHPD_COLUMNS, read_nhpd
+
+
+def property_row(name, **values):
+    row = dict.fromkeys(NHPD_COLUMNS, "")
+    row.update({
+        "Property Name": name,
+        "Zip Code": "02108",
+        "Subsidy Status": "Active",
+        "Latitude": "42.36",
+        "Longitude": "-71.06",
+    })
+    row.update(values)
+    return row
+
+
+def test_read_nhpd_types_and_filters_every_chunk(tmp_path, capsys):
+    rows = [
+        property_row("A", **{"State": "MA", "Subsidy Name": "Section 8",
+                             "Assisted Units": "12",
+                             "Start Date": "1/2/2000"}),
+        property_row("Inactive", **{"Subsidy Status": "Inactive"}),
+        # Later chunks write dates another way and bring new categories
+        property_row("B", **{"State": "RI", "Subsidy Name": "LIHTC",
+                             "Subsidy Status": "Inconclusive",
+                             "Start Date": "2001-03-04"}),
+        property_row("No coordinates", Latitude=""),
+        property_row("C", **{"State": "MA", "Start Date": "not a date",
+                             "Assisted Units": "7"}),
+    ]
+    path = tmp_path / "nhpd.csv"
+    pd.DataFrame(rows).to_csv(path, index=False)
+
+    nhpd = read_nhpd(path, chunksize=2)
+    assert nhpd["Property Name"].tolist() == ["A", "B", "C"]
+    # Zip codes keep their leading zero
+    assert nhpd["Zip Code"].tolist() == ["02108"] * 3
+    assert nhpd["Assisted Units"].dtype == np.float32
+    assert np.isnan(nhpd["Assisted Units"].iloc[1])
+    assert pd.api.types.is_datetime64_any_dtype(nhpd["Start Date"])
+    assert nhpd["Start Date"].iloc[:2].tolist() == [
+        pd.Timestamp("2000-01-02"), pd.Timestamp("2001-03-04")
+    ]
+    assert pd.isna(nhpd["Start Date"].iloc[2])
+    assert "1 unreadable Start Date values" in capsys.readouterr().out
+    # Categories of every chunk are merged instead of falling back to text
+    assert isinstance(nhpd["State"].dtype, pd.CategoricalDtype)
+    assert set(nhpd["State"].cat.categories) == {"MA", "RI"}
+    assert nhpd.crs == "EPSG:4326"
+    assert nhpd.geometry.iloc[0].x == -71.06
+
+
+def test_read_nhpd_without_active_properties_is_an_error(tmp_path):
+    path = tmp_path / "nhpd.csv"
+    pd.DataFrame([property_row("Inactive", **{"Subsidy Status": "Inactive"})
+                  ]).to_csv(path, index=False)
+    with pytest.raises(ValueError, match="no active properties"):
+        read_nhpd(path)
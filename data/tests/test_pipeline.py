@@ -0,0 +1,99 @@
+import pytest
+
+import pipeline
+from pipeline import Stage
+
+# Each script logs its runs; "upper" copies its input upper-cased, so its
+# output only changes when the letters do, and "count" counts the letters
+UPPER = """
+with open("runs.log", "a") as log:
+    log.write("upper\\n")
+with open("raw/words.txt") as f:
+    words = f.read().strip()
+with open("report_data/upper.txt", "w") as f:
+    f.write(words.upper())
+"""
+COUNT = """
+with open("runs.log", "a") as log:
+    log.write("count\\n")
+with open("report_data/upper.txt") as f:
+    text = f.read()
+with open("report_data/count.txt", "w") as f:
+    f.write(str(len(text)))
+"""
+FAIL = "raise SystemExit(3)"
+
+
+@pytest.fixture
+def build(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "raw").mkdir()
+    (tmp_path / "raw" / "words.txt").write_text("abc")
+    (tmp_path / "upper.py").write_text(UPPER)
+    (tmp_path / "count.py").write_text(COUNT)
+    stages = [
+        Stage("upper", "upper.py", inputs=["raw/words.txt"],
+              outputs=["report_data/upper.txt"]),
+        Stage("count", "count.py", inputs=["report_data/upper.txt"],
+              outputs=["report_data/count.txt"]),
+    ]
+    monkeypatch.setattr(pipeline, "STAGES", stages)
+    return tmp_path, stages
+
+
+def runs(path):
+    log = path / "runs.log"
+    runs = log.read_text().split() if log.exists() else []
+    log.unlink(missing_ok=True)
+    return runs
+
+
+def test_only_stale_stages_run_again(build):
+    path, stages = build
+    assert pipeline.run(stages)
+    assert runs(path) == ["upper", "count"]
+    assert (path / "report_data" / "count.txt").read_text() == "3"
+
+    # Nothing changed
+    assert pipeline.run(stages)
+    assert runs(path) == []
+
+    # A changed input reruns its stage; the next one only reruns if the
+    # content of what it reads changed, not merely its modification time
+    (path / "raw" / "words.txt").write_text("ABC\n")
+    assert pipeline.run(stages)
+    assert runs(path) == ["upper"]
+    (path / "raw" / "words.txt").write_text("abcd")
+    assert pipeline.run(stages)
+    assert runs(path) == ["upper", "count"]
+    assert (path / "report_data" / "count.txt").read_text() == "4"
+
+
+def test_edited_script_and_missing_output_rerun_the_stage(build):
+    path, stages = build
+    assert pipeline.run(stages)
+    runs(path)
+    (path / "count.py").write_text(COUNT + "\n# edited\n")
+    assert pipeline.run(stages)
+    assert runs(path) == ["count"]
+    (path / "report_data" / "upper.txt").unlink()
+    assert pipeline.run(stages)
+    assert runs(path) == ["upper"]
+
+
+def test_dry_run_and_force(build):
+    path, stages = build
+    assert pipeline.run(stages, dry_run=True)
+    assert runs(path) == []
+    assert pipeline.run(stages)
+    runs(path)
+    assert pipeline.run(stages, force=True)
+    assert runs(path) == ["upper", "count"]
+
+
+def test_a_failed_stage_skips_the_stages_after_it(build):
+    path, stages = build
+    (path / "upper.py").write_text(FAIL)
+    assert not pipeline.run(stages)
+    assert runs(path) == []
+    assert "upper" not in pipeline.load_manifest()["stages"]
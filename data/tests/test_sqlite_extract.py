@@ -0,0 +1,91 @@
+import sqlite3
+import struct
+
+import geopandas as gpd
+import pyarrow.parquet as pq
+import pytest
+import shapely
+
+import sqlite_extract
+from sqlite_extract import is_spatialite, stream_view, to_wkb
+
+POINT = shapely.Point(-71.06, 42.36)
+
+
+def gpkg_blob(geometry, envelope=True):
+    # Magic, version, flags (little endian, envelope indicator 1) and SRID,
+    # then the xy envelope and the WKB
+    flags = 0x01 | (0x02 if envelope else 0)
+    header = b"GP" + bytes([0, flags]) + struct.pack("<i", 4269)
+    if envelope:
+        header += struct.pack("<4d", *shapely.bounds(geometry))
+    return header + shapely.to_wkb(geometry)
+
+
+def spatialite_blob(geometry):
+    wkb = shapely.to_wkb(geometry, byte_order=1)
+    minx, miny, maxx, maxy = shapely.bounds(geometry)
+    # Start, endianness, SRID, MBR, MBR end, then the WKB body and the end
+    return (bytes([0x00, 0x01]) + struct.pack("<i", 4269) +
+            struct.pack("<4d", minx, miny, maxx, maxy) + b"\x7c" + wkb[1:] +
+            b"\xfe")
+
+
+def test_to_wkb_decodes_geopackage_blobs():
+    for envelope in (True, False):
+        wkb = to_wkb(gpkg_blob(POINT, envelope))
+        assert shapely.from_wkb(wkb).equals(POINT)
+
+
+def test_to_wkb_passes_plain_wkb_through():
+    for byte_order in (0, 1):
+        wkb = shapely.to_wkb(POINT, byte_order=byte_order)
+        assert not is_spatialite(wkb)
+        assert to_wkb(wkb) == wkb
+    assert to_wkb(None) is None
+
+
+def test_to_wkb_rejects_spatialite_blobs():
+    blob = spatialite_blob(POINT)
+    assert is_spatialite(blob)
+    with pytest.raises(RuntimeError, match="mod_spatialite"):
+        to_wkb(blob)
+
+
+@pytest.fixture
+def database():
+    con = sqlite3.connect(":memory:")
+    # Views have no declared types for computed columns, and SQLite lets a
+    # column hold integers in some rows and reals or text in others
+    con.execute("CREATE TABLE tracts (GEOID TEXT, score, label, empty INT, "
+                "geometry BLOB)")
+    rows = [
+        ("25025000100", 1, 7, None, shapely.to_wkb(POINT)),
+        ("25025000200", 2, 8, None, None),
+        ("25025000300", 2.5, "eight", None, shapely.to_wkb(POINT)),
+        ("25025000400", None, 9, None, shapely.to_wkb(POINT)),
+    ]
+    con.executemany("INSERT INTO tracts VALUES (?, ?, ?, ?, ?)", rows)
+    con.execute("CREATE VIEW tract_view AS SELECT GEOID, score * 1 AS score, "
+                "label, empty, geometry FROM tracts")
+    yield con
+    con.close()
+
+
+def test_stream_view_keeps_rows_whose_types_differ_between_chunks(
+        database, tmp_path, monkeypatch):
+    # The first chunk only holds integers, the second reals and text
+    monkeypatch.setattr(sqlite_extract, "CHUNK_ROWS", 2)
+    out_path = str(tmp_path / "tract_view.parquet")
+    stream_view(database, "tract_view", out_path, spatialite=False)
+
+    table = pq.read_table(out_path)
+    assert str(table.schema.field("score").type) == "double"
+    assert str(table.schema.field("label").type) == "string"
+    assert str(table.schema.field("empty").type) == "int64"
+    assert table.column("score").to_pylist() == [1.0, 2.0, 2.5, None]
+    assert table.column("label").to_pylist() == ["7", "8", "eight", "9"]
+
+    frame = gpd.read_parquet(out_path)
+    assert frame.geometry.isna().tolist() == [False, True, False, False]
+    assert frame.geometry.iloc[0].equals(POINT)
@@ -0,0 +1,2 @@
+# Code shared by the data/ build scripts and the streamlit/ app, installed
+# with `python -m pip install -e .` from the repository root.
@@ -0,0 +1,161 @@
+# Map geometry math shared by the data/ build and the app: viewports fitted
+# to boundary extents, the housing cluster grid and the simplified geometry
+# tiers. The build precomputes these for every boundary and the app applies
+# the same functions to the few shapes it draws, so both must agree.
+
+import numpy as np
+import shapely
+
+# longitudinal range by zoom level (20 to 1)
+# in degrees, if centered at equator
+LON_ZOOM_RANGE = np.array([
+    0.0007,
+    0.0014,
+    0.003,
+    0.006,
+    0.012,
+    0.024,
+    0.048,
+    0.096,
+    0.192,
+    0.3712,
+    0.768,
+    1.536,
+    3.072,
+    6.144,
+    11.8784,
+    23.7568,
+    47.5136,
+    98.304,
+    190.0544,
+    360.0,
+])
+# Columns holding a precomputed viewport in the boundary artifacts
+VIEWPORT_COLUMNS = ["zoom", "center_lon", "center_lat"]
+# Simplified geometry tiers drawn on the report map: name, smallest map zoom
+# the tier is used at, simplification tolerance and decimals kept. The
+# build's coverage simplification (Visvalingam-Whyatt) reads the tolerance
+# as roughly the square root of the area of the triangles it removes, and
+# simplify_for_zoom (Douglas-Peucker) as a distance, both in degrees. Either
+# way it is about a tenth of a pixel's width at zoom 5, 8 and 12, the most
+# the low and mid tiers are drawn at and where most boundaries are framed.
+GEOMETRY_TIERS = [
+    ("low", 0, 0.005, 3),
+    ("mid", 6, 0.0005, 4),
+    ("high", 9, 0.00005, 5),
+]
+
+
+def zoom_centers(
+    bounds,
+    projection: str = "mercator",
+    width_to_height: float = 2.0,
+):
+    """Vectorized zoom_center for many extents at once.
+
+    Parameters
+    --------
+    bounds: array-like of shape (n, 4) or (4,), (minlon, minlat, maxlon,
+        maxlat) of each extent, e.g. GeoSeries.bounds or shapely.bounds
+    projection: str, only accepting 'mercator' at the moment
+    width_to_height: float, expected ratio of final graph's with to height
+
+    Returns
+    --------
+    zooms: array of shape (n,), from 1 to 20
+    centers: array of shape (n, 2), longitude and latitude of each center
+    """
+    if projection != "mercator":
+        raise NotImplementedError(
+            f"{projection} projection is not implemented")
+    minlon, minlat, maxlon, maxlat = np.asarray(bounds,
+                                                dtype=np.float64).reshape(
+                                                    -1, 4).T
+    centers = np.column_stack([(maxlon + minlon) / 2, (maxlat + minlat) / 2])
+    margin = 1.2
+    height = (maxlat - minlat) * margin * width_to_height
+    width = (maxlon - minlon) * margin
+    lon_zoom = np.interp(width, LON_ZOOM_RANGE, range(20, 0, -1))
+    lat_zoom = np.interp(height, LON_ZOOM_RANGE, range(20, 0, -1))
+    return np.round(np.minimum(lon_zoom, lat_zoom), 2), centers
+
+
+def viewports(geoms, width_to_height: float = 2.0):
+    """Zoom and center of every geometry of a GeoSeries in one pass.
+
+    Uses only the bounds of each polygon, never its vertices. A multipolygon
+    (a boundary with islands) is fitted to the polygon needing the smallest
+    zoom, one level further out, like the report map has always done.
+
+    Returns
+    --------
+    zooms: array of shape (n,), NaN for missing or empty geometries
+    centers: array of shape (n, 2), longitude and latitude of each center
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    parts, index = shapely.get_parts(geoms, return_index=True)
+    part_zooms, part_centers = zoom_centers(shapely.bounds(parts),
+                                            width_to_height=width_to_height)
+    zooms = np.full(len(geoms), np.nan)
+    centers = np.full((len(geoms), 2), np.nan)
+    if len(parts):
+        # Smallest zoom of each geometry, the first part wins ties
+        order = np.lexsort((part_zooms, index))
+        first = order[np.unique(index[order], return_index=True)[1]]
+        zooms[index[first]] = part_zooms[first]
+        centers[index[first]] = part_centers[first]
+    zooms -= shapely.get_type_id(geoms) == shapely.GeometryType.MULTIPOLYGON
+    return zooms, centers
+
+
+# Map zooms the housing markers are clustered at (build time cell ids are
+# stored for each) and the size of a cluster cell on screen
+CLUSTER_ZOOMS = [2, 4, 6, 8, 10, 12]
+CLUSTER_CELL_PIXELS = 80
+
+
+def cluster_column(zoom):
+    return f"cell_{zoom}"
+
+
+def cluster_cells(lons, lats, zoom):
+    """Ids of the square web mercator cells, CLUSTER_CELL_PIXELS wide on
+    screen at zoom, holding each point. -1 for points without coordinates."""
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.radians(np.clip(np.asarray(lats, dtype=np.float64), -85.0511,
+                              85.0511))
+    cells = int(np.ceil(256 * 2**zoom / CLUSTER_CELL_PIXELS))
+    x = (lons + 180) / 360
+    y = (1 - np.log(np.tan(lats) + 1 / np.cos(lats)) / np.pi) / 2
+    ids = np.floor(np.clip(x, 0, 1 - 1e-12) * cells) * cells + np.floor(
+        np.clip(y, 0, 1 - 1e-12) * cells)
+    return np.where(np.isnan(ids), -1, ids).astype(np.int32)
+
+
+def cluster_zoom(zoom):
+    """Clustering zoom to group housing markers by on a map at zoom."""
+    return max([level for level in CLUSTER_ZOOMS if level <= zoom],
+               default=CLUSTER_ZOOMS[0])
+
+
+def geometry_tier(zoom):
+    """Name of the simplified geometry tier to draw at a map zoom."""
+    return [name for name, min_zoom, _, _ in GEOMETRY_TIERS
+            if zoom >= min_zoom][-1]
+
+
+def quantize(geoms, decimals):
+    """Rounds every coordinate of an array of geometries, which also keeps
+    their GeoJSON short."""
+    return shapely.transform(geoms, lambda coords: np.round(coords, decimals))
+
+
+def simplify_for_zoom(geoms, zoom):
+    """Simplifies and quantizes a few geometries, e.g. a boundary outline,
+    to the tier drawn at zoom."""
+    _, _, tolerance, decimals = [
+        tier for tier in GEOMETRY_TIERS if tier[0] == geometry_tier(zoom)
+    ][0]
+    geoms = np.asarray(geoms, dtype=object)
+    return quantize(
+        shapely.simplify(geoms, tolerance, preserve_topology=True), decimals)
@@ -0,0 +1,45 @@
+# Search keys of the Report page's location search, shared by the data/
+# build, which writes them for every boundary name (search_index.parquet),
+# and the app, which normalizes queries the same way (streamlit/search.py).
+
+import re
+import unicodedata
+
+import pandas as pd
+
+# Levels the index covers, as named by the Report page
+SEARCH_LEVELS = ("Census Tract ID", "City", "County", "State",
+                 "Tribe or Territory")
+
+
+def normalize(text):
+    """Lower case ASCII letters and digits separated by single spaces.
+
+    Text is decomposed with NFKD before anything outside ASCII is dropped,
+    so accents and compatibility forms are transliterated: "Doña Ana
+    County" becomes "dona ana county" and "Mayagüez" "mayaguez". Letters
+    with no ASCII decomposition, such as "ø", are dropped, from names and
+    queries alike.
+    """
+    text = unicodedata.normalize("NFKD", str(text))
+    text = text.encode("ascii", "ignore").decode().lower()
+    return " ".join(re.findall(r"[a-z0-9]+", text))
+
+
+def search_keys(name):
+    """Keys a name is found under: its normalized text from the start of
+    each word, so "Suffolk County, MA" also matches "county" and "ma"."""
+    text = normalize(name)
+    if not text:
+        return []
+    starts = [0] + [match.end() for match in re.finditer(" ", text)]
+    return [text[start:] for start in starts]
+
+
+def index_entries(names, level):
+    """Search index rows (level, key, name, word) for the names of a level.
+    word is 0 for the key spelling the whole name and 1 for a later word."""
+    names = pd.unique(pd.Series(names).dropna().astype(str))
+    rows = [(level, key, name, int(position > 0)) for name in names
+            for position, key in enumerate(search_keys(name))]
+    return pd.DataFrame(rows, columns=["level", "key", "name", "word"])
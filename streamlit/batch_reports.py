@@ -0,0 +1,202 @@
+# Generates the report PDF and map image of every county, state and tribal
+# area without going through the Report page.
+#
+# The national datasets are loaded (and pinned in memory) once in the parent
+# process and the workers are forked from it, so they share the loaded frames
+# copy-on-write instead of each reading them again. Reports already in the
+# output directory, and boundaries marked as having no tracts, are skipped, so
+# an interrupted run picks up where it stopped.
+#
+# Usage (from the streamlit/ directory):
+#   python batch_reports.py --out reports
+#   python batch_reports.py --out reports --levels county --workers 8
+
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import reportcache
+from datastore import registry
+from reportdata import dac_selector, load_boundary, nhpd_selector
+from reportjobs import is_summary, report_map, report_pdf
+from reportmap import map_image
+
+LEVELS = {
+    "county": "County",
+    "state": "State",
+    "tribe": "Tribe or Territory",
+}
+
+# Boundaries of the level being generated, in each worker process
+_boundary = None
+
+
+def set_boundary(boundary):
+    # Pool initializer. Forked workers receive the parent's frame as is; on
+    # platforms without fork it is pickled once per worker, not per report.
+    global _boundary
+    _boundary = boundary
+
+
+def output_path(out_dir, level, row, extension):
+    name = re.sub(r"[^\w.-]+", "_", row["NAME"]).strip("_")
+    return os.path.join(out_dir, level, f"{row['GEOID']}_{name}.{extension}")
+
+
+def write_atomic(path, data):
+    # A report interrupted half way must not look finished on resume
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def generate(position, level, out_dir, options):
+    start = time.perf_counter()
+    shape = _boundary.iloc[[position]]
+    row = shape.iloc[0]
+    label = LEVELS[level]
+    dac_select = dac_selector(shape, label)
+    if dac_select.empty:
+        # Zero-byte marker, so a resumed run does not select it again
+        write_atomic(output_path(out_dir, level, row, "empty"), b"")
+        return row["NAME"], "empty", time.perf_counter() - start
+    nhpd_select = nhpd_selector(registry.get("nhpd"), shape, label,
+                                dac_select)
+    summary = is_summary(dac_select, options.full_detail)
+    fig = report_map(shape, dac_select, nhpd_select, summary)
+    png = map_image(fig)
+    pdf = report_pdf(label, shape, png, dac_select, nhpd_select, options.eb,
+                     options.dac_filter, options.qct_filter,
+                     options.cover_page, options.include_nhpd,
+                     options.detailed, summary)
+    write_atomic(output_path(out_dir, level, row, "png"), png)
+    write_atomic(output_path(out_dir, level, row, "pdf"), pdf)
+    if options.fill_cache:
+        # The same key the Report page looks up, so the app serves these
+        # reports without generating them again
+        reportcache.put(
+            reportcache.cache_key(
+                (label, row["NAME"], options.eb, options.dac_filter,
+                 options.qct_filter, options.cover_page,
+                 options.include_nhpd, options.detailed,
+                 options.full_detail)), fig, png, pdf)
+    return row["NAME"], "done", time.perf_counter() - start
+
+
+def is_finished(out_dir, level, row):
+    # A report was written, or the boundary was found to have no tracts
+    return any(
+        os.path.exists(output_path(out_dir, level, row, extension))
+        for extension in ("pdf", "empty"))
+
+
+def run_level(level, options):
+    os.makedirs(os.path.join(options.out, level), exist_ok=True)
+    boundary = load_boundary(LEVELS[level]).reset_index(drop=True)
+    todo = [
+        position for position, row in boundary.iterrows()
+        if not is_finished(options.out, level, row)
+    ]
+    print(f"[{level}] {len(boundary) - len(todo)} of {len(boundary)} "
+          f"boundaries already done, generating {len(todo)}")
+    timings, failed = [], []
+    start = time.perf_counter()
+    # Forking shares the loaded datasets with the workers. Elsewhere each
+    # worker loads the datasets it uses on first use.
+    context = multiprocessing.get_context(
+        "fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+    with ProcessPoolExecutor(max_workers=options.workers,
+                             mp_context=context,
+                             initializer=set_boundary,
+                             initargs=(boundary,)) as pool:
+        futures = {
+            pool.submit(generate, position, level, options.out, options):
+            position
+            for position in todo
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            name = boundary.loc[futures[future], "NAME"]
+            try:
+                name, status, seconds = future.result()
+            except Exception as e:
+                print(f"[{level}] {name} failed: {e}")
+                failed.append(name)
+                continue
+            if status == "done":
+                timings.append((seconds, name))
+            elapsed = time.perf_counter() - start
+            # Only generated reports count towards the rate; empty
+            # boundaries and failures take next to no time
+            print(f"[{level}] {done}/{len(todo)} "
+                  f"{60 * len(timings) / elapsed:.1f} reports/minute",
+                  end="\r")
+    elapsed = time.perf_counter() - start
+    print(f"\n[{level}] generated {len(timings)} reports in {elapsed:.0f}s "
+          f"({60 * len(timings) / max(elapsed, 1e-9):.1f} reports/minute), "
+          f"{len(failed)} failed")
+    for seconds, name in sorted(timings, reverse=True)[:options.slowest]:
+        print(f"[{level}]   {seconds:6.1f}s  {name}")
+    return not failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate reports for every boundary of a level.")
+    parser.add_argument("--out", required=True, help="Output directory")
+    parser.add_argument("--levels",
+                        nargs="+",
+                        choices=list(LEVELS),
+                        default=list(LEVELS),
+                        help="Levels to generate (default: all)")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument("--eb",
+                        type=int,
+                        nargs=2,
+                        default=(30, 100),
+                        help="Energy burden percentile range")
+    parser.add_argument("--all-tracts",
+                        dest="dac_filter",
+                        action="store_false",
+                        help="Include tracts that are not disadvantaged")
+    parser.add_argument("--qct-only",
+                        dest="qct_filter",
+                        action="store_true",
+                        help="Only include tax credit eligible tracts")
+    parser.add_argument("--cover-page",
+                        action="store_true",
+                        help="Only include the cover page")
+    parser.add_argument("--include-nhpd",
+                        action="store_true",
+                        help="Include the affordable housing list")
+    parser.add_argument("--detailed",
+                        action="store_true",
+                        help="Include a section per tract with its indicators")
+    parser.add_argument("--full-detail",
+                        action="store_true",
+                        help="Map and list every tract of large selections "
+                        "instead of county totals")
+    parser.add_argument("--fill-cache",
+                        action="store_true",
+                        help="Also store the reports in the app's report cache")
+    parser.add_argument("--slowest",
+                        type=int,
+                        default=10,
+                        help="Number of slowest boundaries to list")
+    options = parser.parse_args()
+    # Same form as the Report page's slider value so cache keys match
+    options.eb = tuple(options.eb)
+    # Load the national data once, before any worker is forked. Pinned, so
+    # the memory budget cannot evict one and have every worker reload it.
+    for name in ("dac", "dac_index", "dac_ranges", "nhpd", "nhpd_index",
+                 "nhpd_ranges", "dac_low", "dac_mid", "dac_high", "counties",
+                 "aggregates"):
+        registry.pin(name)
+    ok = all([run_level(level, options) for level in options.levels])
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,451 @@
+# Reads the columnar report artifacts written by the data/ build scripts.
+# Loaders ask for only the columns (and, through Parquet filters, only the row
+# groups) they need instead of unpickling whole national frames, and the
+# registry at the bottom shares the loaded datasets across every session of
+# the process.
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from mapbounds import VIEWPORT_COLUMNS
+from search import SearchIndex
+from spatial import SpatialIndex
+
+REPORT_DATA = os.path.join("..", "data", "report_data")
+# Must match SCHEMA_VERSION in data/artifacts.py
+SCHEMA_VERSION = 5
+
+
+def artifact_path(name):
+    return os.path.join(REPORT_DATA, f"{name}.parquet")
+
+
+def read_meta(name):
+    with open(os.path.join(REPORT_DATA, f"{name}.meta.json")) as f:
+        meta = json.load(f)
+    if meta["schema_version"] != SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Artifact {name} has schema version {meta['schema_version']}, "
+            f"expected {SCHEMA_VERSION}. Rebuild the report data.")
+    return meta
+
+
+# Every artifact a report is drawn or written from
+ARTIFACTS = ("dac", "dac_index", "dac_low", "dac_mid", "dac_high", "nhpd",
+             "nhpd_index", "counties", "states", "tt_shp", "aggregates",
+             "search_index")
+
+
+def data_version(names=ARTIFACTS):
+    # Changes whenever any of the artifacts is rebuilt with different content
+    digest = hashlib.sha256()
+    for name in names:
+        digest.update(read_meta(name)["sha256"].encode())
+    return digest.hexdigest()
+
+
+def read_artifact(name, columns=None, filters=None, geometry=True):
+    """Reads a report artifact, optionally projecting columns and rows.
+
+    filters uses the pyarrow syntax, e.g. [("GEOID", ">=", "06")], and lets
+    Parquet skip row groups whose statistics rule them out. Pass
+    geometry=False to read attribute columns into a plain DataFrame.
+    """
+    read_meta(name)
+    if geometry:
+        return gpd.read_parquet(artifact_path(name),
+                                columns=columns,
+                                filters=filters)
+    return pd.read_parquet(artifact_path(name),
+                           columns=columns,
+                           filters=filters)
+
+
+# Report levels resolved by the membership index and their level in it.
+# Tracts, counties and states are GEOID ranges (GeoidRangeIndex below).
+MEMBERSHIP_LEVELS = {
+    "City": "city",
+    "Tribe or Territory": "tribe",
+}
+
+
+class MembershipIndex:
+    """Row offsets of the tracts (or properties) that belong to each boundary.
+
+    Entries are kept sorted by "level\0key", so a lookup is two binary
+    searches followed by a slice of the row and fraction arrays. Indexes
+    without a fraction column count every row whole.
+    """
+
+    def __init__(self, index):
+        keys = (index["level"] + "\0" + index["key"]).values.astype(object)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.rows = index["row"].values[order]
+        if "fraction" in index.columns:
+            self.fractions = index["fraction"].values[order]
+        else:
+            self.fractions = np.ones(len(index), dtype=np.float32)
+
+    def lookup(self, level, key):
+        # Returns (rows, fractions); fractions are the share of each tract's
+        # area inside the boundary (1.0 except for tribes and territories)
+        needle = f"{MEMBERSHIP_LEVELS[level]}\0{key}"
+        start = np.searchsorted(self.keys, needle, side="left")
+        stop = np.searchsorted(self.keys, needle, side="right")
+        return self.rows[start:stop], self.fractions[start:stop]
+
+    @property
+    def nbytes(self):
+        return (sum(sys.getsizeof(key) for key in self.keys) +
+                self.keys.nbytes + self.rows.nbytes + self.fractions.nbytes)
+
+
+# Leading GEOID digits that name the boundary of each hierarchical level:
+# state (2) + county (3) + tract (6)
+GEOID_DIGITS = {
+    "Census Tract ID": 11,
+    "County": 5,
+    "State": 2,
+}
+
+
+class GeoidRangeIndex:
+    """Row ranges of a table stored sorted by its int64 tract GEOID.
+
+    A state or county is every GEOID between two multiples of a power of
+    ten, so its rows are one contiguous range found with two binary
+    searches and selected as a slice, at a cost that depends on the size of
+    the result rather than of the nation.
+    """
+
+    def __init__(self, geoids):
+        # Rows without a tract sort last, so dropping them keeps positions
+        self.geoids = pd.Series(geoids).dropna().to_numpy(np.int64)
+
+    def span(self, level, key):
+        """Slice of the rows of the boundary with GEOID key at level."""
+        scale = 10**(11 - GEOID_DIGITS[level])
+        code = int(key) * scale
+        start, stop = np.searchsorted(self.geoids, [code, code + scale])
+        return slice(int(start), int(stop))
+
+    def rows(self, tracts):
+        """Positions of the rows of the given tract GEOID codes."""
+        tracts = np.asarray(tracts, dtype=np.int64)
+        starts = np.searchsorted(self.geoids, tracts, side="left")
+        counts = np.searchsorted(self.geoids, tracts, side="right") - starts
+        offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        return np.repeat(starts, counts) + offsets
+
+    @property
+    def nbytes(self):
+        return self.geoids.nbytes
+
+
+def format_geoid(codes, digits=11):
+    # GEOIDs are stored as int64 codes; the leading zeros are part of the ID
+    return pd.Series(codes).astype(np.int64).astype(str).str.zfill(digits)
+
+
+def format_tracts(tracts):
+    """Formats rows of the compact tract table the way they are displayed.
+
+    Map viewports are dropped, GEOIDs become zero-padded strings, categoricals become plain strings and
+    float32 indicators become float64 rounded to the two decimals they were
+    built with. Nullable integers (the DAC indicator) become float64, with
+    NaN rather than pd.NA for missing values. Only call this on the selected
+    rows, never on the national table.
+    """
+    tracts = tracts.drop(columns=VIEWPORT_COLUMNS, errors="ignore")
+    tracts["GEOID"] = format_geoid(tracts["GEOID"]).values
+    for column in tracts.columns:
+        dtype = tracts[column].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            tracts[column] = tracts[column].astype(object)
+        elif dtype == np.float32:
+            tracts[column] = tracts[column].astype(np.float64).round(2)
+        elif isinstance(dtype, pd.api.extensions.ExtensionDtype) and (
+                pd.api.types.is_integer_dtype(dtype)):
+            tracts[column] = tracts[column].astype(np.float64)
+    return tracts
+
+
+# NHPD unit counts, stored as float32 so that missing counts stay NaN
+HOUSING_COUNTS = [
+    "Assisted Units",
+    "0-1 Bedroom Units",
+    "Two Bedroom Units",
+    "Three+ Bedroom Units",
+    "Known Total Units",
+]
+
+
+def format_housing(housing):
+    """Formats rows of the compact housing table the way they are displayed.
+
+    Unit counts become nullable integers, other float32 columns float64
+    rounded to two decimals, dates ISO strings and categoricals plain
+    strings. Only call this on the selected rows, never on the national
+    table.
+    """
+    housing = housing.copy()
+    for column in housing.columns:
+        dtype = housing[column].dtype
+        if column in HOUSING_COUNTS:
+            housing[column] = housing[column].round().astype("Int64")
+        elif isinstance(dtype, pd.CategoricalDtype):
+            housing[column] = housing[column].astype(object)
+        elif dtype == np.float32:
+            housing[column] = housing[column].astype(np.float64).round(2)
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            housing[column] = housing[column].dt.strftime("%Y-%m-%d")
+    return housing
+
+
+def _load_tract_boundaries():
+    boundary = registry.get("dac")[["GEOID", *VIEWPORT_COLUMNS, "geometry"]]
+    boundary["NAME"] = format_geoid(boundary["GEOID"]).values
+    return boundary[["NAME", *VIEWPORT_COLUMNS, "geometry"]]
+
+
+def _load_city_boundaries():
+    boundary = registry.get("dac")[["city", "county_name", "geometry"]]
+    # Drop tracts where there is no city name
+    boundary = boundary[boundary["city"].notna()]
+    boundary["city"] = boundary["city"].astype(object)
+    boundary["county_name"] = boundary["county_name"].astype(object)
+    boundary["NAME"] = boundary["city"] + " (" + boundary["county_name"] + ")"
+    # A city is all of its tracts, so its map is fitted to their combined
+    # bounds when it is drawn rather than to a precomputed viewport
+    return boundary[["city", "county_name", "NAME", "geometry"]]
+
+
+# Datasets held by the registry and how to build each one from the artifacts
+LOADERS = {
+    "dac": lambda: read_artifact("dac"),
+    "dac_index": lambda: MembershipIndex(
+        read_artifact("dac_index", geometry=False)),
+    # Properties of each tribal area, which may overlap
+    "nhpd_index": lambda: MembershipIndex(
+        read_artifact("nhpd_index", geometry=False)),
+    # Both artifacts are stored sorted by tract GEOID
+    "dac_ranges": lambda: GeoidRangeIndex(
+        read_artifact("dac", columns=["GEOID"], geometry=False)["GEOID"]),
+    "nhpd_ranges": lambda: GeoidRangeIndex(
+        read_artifact("nhpd", columns=["tract_geoid"],
+                      geometry=False)["tract_geoid"]),
+    "nhpd": lambda: read_artifact("nhpd"),
+    "counties": lambda: read_artifact("counties"),
+    "states": lambda: read_artifact("states"),
+    "tt_shp": lambda: read_artifact("tt_shp"),
+    # Simplified tract geometries for the map, row for row with "dac". Their
+    # coordinates are their own, not a copy of the national ones.
+    "dac_low": lambda: read_artifact("dac_low"),
+    "dac_mid": lambda: read_artifact("dac_mid"),
+    "dac_high": lambda: read_artifact("dac_high"),
+    # Summary figures of every state, county, city and tribal area, looked
+    # up by (level, key)
+    "aggregates": lambda: read_artifact("aggregates", geometry=False).set_index(
+        ["level", "key"]).sort_index(),
+    # Spatial indexes for areas without a precomputed key, row for row with
+    # "dac" and "nhpd"
+    "tract_tree": lambda: SpatialIndex(registry.get("dac")),
+    "nhpd_tree": lambda: SpatialIndex(registry.get("nhpd")),
+    "search_index": lambda: SearchIndex(
+        read_artifact("search_index", geometry=False)),
+    "tract_boundaries": _load_tract_boundaries,
+    "city_boundaries": _load_city_boundaries,
+}
+# Datasets built on the geometry objects of another dataset instead of
+# reading their own copy. Their coordinates are counted once, with the
+# dataset they come from, and they are evicted along with it, since they
+# would keep its geometry alive anyway.
+SHARED_GEOMETRY = {
+    "tract_tree": "dac",
+    "tract_boundaries": "dac",
+    "city_boundaries": "dac",
+    "nhpd_tree": "nhpd",
+}
+
+
+class DataRegistry:
+    """Process-wide store of the read-only report datasets.
+
+    Every Streamlit session (and every rerun) shares the same objects:
+    datasets are loaded on first use, kept while they fit in budget_bytes and
+    evicted least recently used first when they do not. Frames handed out
+    are shared, so callers must treat them as read-only and derive new
+    frames (iloc, boolean selection, copy) instead of modifying them.
+    """
+
+    def __init__(self, loaders, budget_bytes, shared=None):
+        self.loaders = loaders
+        self.budget_bytes = budget_bytes
+        # Dataset each dataset shares its geometry with, if any
+        self.shared = shared or {}
+        # Datasets never evicted, whatever the budget
+        self._pinned = set()
+        self._datasets = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        # One lock per dataset so concurrent sessions asking for the same
+        # dataset wait for a single load instead of each loading it
+        self._load_locks = {name: threading.Lock() for name in loaders}
+        # Digest of the artifact sidecars, read again only after a load
+        self._data_version = None
+        self._stats = {
+            name: {
+                "loads": 0,
+                "hits": 0,
+                "evictions": 0,
+                "load_seconds": 0.0,
+                "last_load_seconds": 0.0,
+            }
+            for name in loaders
+        }
+
+    def get(self, name):
+        with self._lock:
+            if name in self._datasets:
+                self._datasets.move_to_end(name)
+                self._stats[name]["hits"] += 1
+                return self._datasets[name]
+        with self._load_locks[name]:
+            with self._lock:
+                if name in self._datasets:
+                    self._datasets.move_to_end(name)
+                    self._stats[name]["hits"] += 1
+                    return self._datasets[name]
+            start = time.perf_counter()
+            dataset = self.loaders[name]()
+            seconds = time.perf_counter() - start
+            size = dataset_size(name, dataset)
+            with self._lock:
+                self._datasets[name] = dataset
+                self._sizes[name] = size
+                self._stats[name]["loads"] += 1
+                self._stats[name]["load_seconds"] += seconds
+                self._stats[name]["last_load_seconds"] = seconds
+                # A load may have picked up a rebuilt artifact
+                self._data_version = None
+                self._evict(keep=name)
+            return dataset
+
+    def _evict(self, keep):
+        # Least recently used first, never a pinned dataset, the dataset that
+        # was just asked for nor the one it shares its geometry with
+        while sum(self._sizes.values()) > self.budget_bytes:
+            victim = next((name for name in self._datasets
+                           if name not in (keep, self.shared.get(keep))
+                           and name not in self._pinned), None)
+            if victim is None:
+                break
+            dependents = [
+                name for name in self._datasets
+                if self.shared.get(name) == victim
+            ]
+            for name in [victim, *dependents]:
+                del self._datasets[name]
+                del self._sizes[name]
+                self._stats[name]["evictions"] += 1
+
+    def pin(self, name):
+        """Loads a dataset and keeps it loaded for the life of the process.
+
+        For batch runs, which load every national dataset before forking
+        their workers: a dataset evicted in the parent would be loaded again
+        by every worker.
+        """
+        dataset = self.get(name)
+        with self._lock:
+            self._pinned.add(name)
+        return dataset
+
+    def peek(self, name):
+        """The dataset if it is loaded, else None. Never loads it."""
+        with self._lock:
+            if name not in self._datasets:
+                return None
+            self._datasets.move_to_end(name)
+            self._stats[name]["hits"] += 1
+            return self._datasets[name]
+
+    def data_version(self):
+        """Digest of the artifacts, cached until the next dataset load."""
+        with self._lock:
+            version = self._data_version
+        if version is None:
+            version = data_version()
+            with self._lock:
+                self._data_version = version
+        return version
+
+    def stats(self):
+        with self._lock:
+            stats = pd.DataFrame.from_dict(self._stats, orient="index")
+            stats["loaded"] = [name in self._datasets for name in stats.index]
+            stats["megabytes"] = [
+                round(self._sizes.get(name, 0) / 2**20, 1)
+                for name in stats.index
+            ]
+        return stats
+
+
+def dataset_size(name, dataset):
+    # pandas cannot see the coordinates held by geometry objects, so count
+    # the size of the artifact's (WKB) file for frames that carry geometry,
+    # unless they share the geometry of another dataset
+    if isinstance(dataset, SpatialIndex):
+        if name in SHARED_GEOMETRY:
+            return dataset.tree_nbytes
+        return dataset.nbytes
+    if not isinstance(dataset, pd.DataFrame):
+        return dataset.nbytes
+    size = int(dataset.memory_usage(deep=True).sum())
+    if isinstance(dataset, gpd.GeoDataFrame) and name not in SHARED_GEOMETRY:
+        size += os.path.getsize(artifact_path(name))
+    return size
+
+
+registry = DataRegistry(
+    LOADERS,
+    budget_bytes=int(os.environ.get("EQUITY_TOOL_MEMORY_BUDGET_MB", 4096)) *
+    2**20,
+    shared=SHARED_GEOMETRY)
+
+
+def read_tract_rows(rows):
+    """Rows of the tract artifact at positions rows (an array or a slice).
+
+    Served from the national table when the registry already holds it, as
+    batch runs do. Otherwise only the row groups of the GEOID range the rows
+    span are read: the artifact is sorted by GEOID, so Parquet skips the
+    others. Either way the frame is indexed by row position.
+    """
+    national = registry.peek("dac")
+    if national is not None:
+        return national.iloc[rows]
+    geoids = registry.get("dac_ranges").geoids
+    if isinstance(rows, slice):
+        rows = np.arange(len(geoids))[rows]
+    rows = np.asarray(rows, dtype=np.int64)
+    if not len(rows):
+        return read_artifact("dac", filters=[("GEOID", "<", 0)])
+    first = int(geoids[rows].min())
+    last = int(geoids[rows].max())
+    tracts = read_artifact("dac",
+                           filters=[("GEOID", ">=", first),
+                                    ("GEOID", "<=", last)])
+    start = np.searchsorted(geoids, first, side="left")
+    return tracts.iloc[rows - start].set_axis(rows)
@@ -1,9 +1,19 @@
 import pandas as pd
 from datetime import datetime
 import base64
-import pdfkit
 import numpy as np
 
+# The viewport, cluster grid and geometry tier math is shared with the data/
+# build; it is re-exported here for the app's map code
+from equity_common.mapgeometry import (CLUSTER_CELL_PIXELS, CLUSTER_ZOOMS,
+                                       GEOMETRY_TIERS, LON_ZOOM_RANGE,
+                                       VIEWPORT_COLUMNS, cluster_cells,
+                                       cluster_column, cluster_zoom,
+                                       geometry_tier, quantize,
+                                       simplify_for_zoom, viewports,
+                                       zoom_centers)
+
+
 def zoom_center(
     lons: tuple = None,
     lats: tuple = None,
@@ -11,23 +21,27 @@ def zoom_center(
     format: str = "lonlat",
     projection: str = "mercator",
     width_to_height: float = 2.0,
+    bounds=None,
+    geoms=None,
 ):
     """Finds optimal zoom and centering for a plotly mapbox.
-    Must be passed (lons & lats) or lonlats.
+    Must be passed (lons & lats), lonlats, bounds or geoms.
     Temporary solution awaiting official implementation, see:
     https://github.com/plotly/plotly.js/issues/3434
 
     Parameters
     --------
-    lons: tuple, optional, longitude component of each location
-    lats: tuple, optional, latitude component of each location
-    lonlats: tuple, optional, gps locations
+    lons: array-like, optional, longitude component of each location
+    lats: array-like, optional, latitude component of each location
+    lonlats: array-like, optional, gps locations
     format: str, specifying the order of longitud and latitude dimensions,
         expected values: 'lonlat' or 'latlon', only used if passed lonlats
     projection: str, only accepting 'mercator' at the moment,
         raises `NotImplementedError` if other is passed
     width_to_height: float, expected ratio of final graph's with to height,
         used to select the constrained axis.
+    bounds: array-like, optional, (minlon, minlat, maxlon, maxlat)
+    geoms: GeoSeries or shapely geometry, optional, fits all of them
 
     Returns
     --------
@@ -38,56 +52,25 @@ def zoom_center(
     ...     (25.587101, 31.784620)))
     (5.75, {'lon': -106.208423, 'lat': 28.685861})
     """
-    if lons is None and lats is None:
-        if isinstance(lonlats, tuple):
-            lons, lats = zip(*lonlats)
-        else:
-            raise ValueError("Must pass lons & lats or lonlats")
-
-    maxlon, minlon = max(lons), min(lons)
-    maxlat, minlat = max(lats), min(lats)
-    center = {
-        "lon": round((maxlon + minlon) / 2, 6),
-        "lat": round((maxlat + minlat) / 2, 6),
+    if geoms is not None:
+        bounds = getattr(geoms, "total_bounds", None)
+        if bounds is None:
+            bounds = geoms.bounds
+    if bounds is None:
+        if lons is None and lats is None:
+            if lonlats is None:
+                raise ValueError("Must pass lons & lats, lonlats, bounds or geoms")
+            lonlats = np.asarray(lonlats, dtype=np.float64).reshape(-1, 2)
+            lons, lats = lonlats.T if format == "lonlat" else lonlats.T[::-1]
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        bounds = (lons.min(), lats.min(), lons.max(), lats.max())
+    zooms, centers = zoom_centers(bounds, projection, width_to_height)
+    return float(zooms[0]), {
+        "lon": round(float(centers[0, 0]), 6),
+        "lat": round(float(centers[0, 1]), 6)
     }
 
-    # longitudinal range by zoom level (20 to 1)
-    # in degrees, if centered at equator
-    lon_zoom_range = np.array([
-        0.0007,
-        0.0014,
-        0.003,
-        0.006,
-        0.012,
-        0.024,
-        0.048,
-        0.096,
-        0.192,
-        0.3712,
-        0.768,
-        1.536,
-        3.072,
-        6.144,
-        11.8784,
-        23.7568,
-        47.5136,
-        98.304,
-        190.0544,
-        360.0,
-    ])
-
-    if projection == "mercator":
-        margin = 1.2
-        height = (maxlat - minlat) * margin * width_to_height
-        width = (maxlon - minlon) * margin
-        lon_zoom = np.interp(width, lon_zoom_range, range(20, 0, -1))
-        lat_zoom = np.interp(height, lon_zoom_range, range(20, 0, -1))
-        zoom = round(min(lon_zoom, lat_zoom), 2)
-    else:
-        raise NotImplementedError(
-            f"{projection} projection is not implemented")
-
-    return zoom, center
 
 ## OLD PDF GENERATION FUNCTIONS (need pdfkit, wkhtmltopdf, and simple-styles.css to run)
 
@@ -121,6 +104,9 @@ def generate_from_data(shape,
                        nhpd_select,
                        detailed,
                        out_path="out.pdf"):
+    # Only this legacy renderer needs pdfkit (and wkhtmltopdf)
+    import pdfkit
+
     if detailed:
         tracts_html = "\n".join([
             f"""
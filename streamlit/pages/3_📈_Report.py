@@ -1,17 +1,19 @@
 import streamlit as st
 import pandas as pd
-import pickle
 import numpy as np
 import geopandas as gpd
 import plotly.express as px
 import plotly.graph_objects as go
-import json
 import os
-from datetime import datetime
 import base64
-import pyproj
-from mapbounds import generate_from_data, zoom_center
-from pdfreport import generate_pdf
+from datetime import datetime
+import reportdata
+from datastore import registry
+from mapbounds import CLUSTER_ZOOMS, cluster_column
+from reportdata import DETAIL_THRESHOLD, NHPD_KEYS
+from reportjobs import queue
+from reportmap import add_housing, legend_base64
+from spatial import CUSTOM_AREA, area_name, geojson_area, point_area
 
 st.set_page_config(
     page_title="Report",
@@ -26,12 +28,34 @@ st.set_page_config(
     })
 st.title("Generate a Report for Your Location")
 
+# Rows per page of the data tables of large selections
+PAGE_ROWS = 500
+# Locations offered for a search
+SEARCH_RESULTS = 50
+# Locations per page of the full list offered before anything is searched
+BROWSE_RESULTS = 1000
+# Accepted names of the coordinate columns of a building CSV
+LAT_COLUMNS = ("lat", "latitude")
+LON_COLUMNS = ("lon", "lng", "long", "longitude")
+# Figures the national rankings can be sorted by
+RANKING_COLUMNS = {
+    "Avg. Energy Burden Percentile": "avg_energy_burden_natl_pctile",
+    "Population-Weighted Energy Burden Percentile":
+    "pop_energy_burden_natl_pctile",
+    "Disadvantaged Census Tracts": "dac_tracts",
+    "Population in Disadvantaged Tracts": "dac_population",
+    "Housing Tax Credit Eligible Tracts": "qct_tracts",
+    "Affordable Housing Units": "assisted_units",
+    "Avg. Nonwhite Percentile": "avg_nonwhite_pct_natl_pctile",
+    "Population-Weighted Nonwhite Percentile": "pop_nonwhite_pct_natl_pctile",
+}
+
 
 def select_level():
     with st.form("Select Level"):
         level = st.radio(
             options=("Census Tract ID", "City", "County", "State",
-                     "Tribe or Territory"),
+                     "Tribe or Territory", CUSTOM_AREA),
             label="Search By",
             index=2,
         )
@@ -42,11 +66,76 @@ def select_level():
         return st.session_state["previous_level"]
 
 
-def select_location(boundary, level):
+def search_locations(level):
+    # Matches come from the search index on the server, so only a page of
+    # names is sent to the browser instead of every boundary of the level
+    query = st.text_input(
+        label=f"Search for a {level}",
+        key=f"search_{level}",
+        help="Type part of a name or ID and press Enter. Close spellings are matched too.")
+    index = registry.get("search_index")
+    if query.strip():
+        return index.search(query, level, limit=SEARCH_RESULTS)
+    # Without a query every location of the level is offered, a page at a
+    # time for the levels with thousands of them
+    pages = max(1, -(-index.count_of(level) // BROWSE_RESULTS))
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page of locations (of {pages})",
+                               min_value=1,
+                               max_value=pages,
+                               value=1,
+                               key=f"search_page_{level}")
+    return index.names_of(level,
+                          BROWSE_RESULTS,
+                          start=(page - 1) * BROWSE_RESULTS)
+
+
+def custom_area():
+    # A circle around a point or the polygons of an uploaded GeoJSON file,
+    # as the location of a custom area report
+    kind = st.radio(label="Define the area by",
+                    options=("Point and radius", "GeoJSON file"),
+                    horizontal=True)
+    if kind == "Point and radius":
+        col1, col2, col3 = st.columns([1, 1, 1])
+        lat = col1.number_input("Latitude",
+                                min_value=-90.0,
+                                max_value=90.0,
+                                value=42.3601,
+                                format="%.4f")
+        lon = col2.number_input("Longitude",
+                                min_value=-180.0,
+                                max_value=180.0,
+                                value=-71.0589,
+                                format="%.4f")
+        radius = col3.number_input("Radius (miles)",
+                                   min_value=0.1,
+                                   max_value=100.0,
+                                   value=2.0,
+                                   step=0.5)
+        return [point_area(lon, lat, radius)]
+    upload = st.file_uploader(
+        "GeoJSON file",
+        type=["geojson", "json"],
+        help="A polygon, or a feature collection of polygons, in longitude and latitude.")
+    if upload is None:
+        return []
+    try:
+        return [geojson_area(upload.getvalue().decode("utf-8"),
+                             os.path.splitext(upload.name)[0])]
+    except (ValueError, KeyError, AttributeError) as e:
+        st.error(f"The GeoJSON file could not be read: {e}")
+        return []
+
+
+def select_location(options, level):
     with st.form("Select a Location"):
-        shape = st.selectbox(options=boundary["NAME"].unique(),
-                             label=f"Select a {level}",
-                             index=1)
+        shape = st.selectbox(
+            options=options,
+            label=f"Select a {level}",
+            index=0,
+            format_func=area_name if level == CUSTOM_AREA else str)
         with st.expander("Additional Report Parameters"):
             col1, col2, col3 = st.columns([1, 1, 1])
             eb = col1.slider(
@@ -70,7 +159,7 @@ def select_location(boundary, level):
                 help=
                 "Check this box to only include Housing Tax Credit Eligible Census Tracts in the report."
             )
-            col4, col5 = st.columns([1, 1])
+            col4, col5, col6, col7 = st.columns([1, 1, 1, 1])
 
             cover_page = col4.checkbox(
                 label="Include Cover Page Only",
@@ -83,274 +172,261 @@ def select_location(boundary, level):
                 value=False,
                 help="Check this box to include a full list of every affordable housing property in the report. You can download the housing data separately under the Housing Data tab below."
             )
+            detailed = col6.checkbox(
+                label="Include Detailed Tract Pages",
+                value=False,
+                help="Check this box to add a section per census tract with its indicator percentiles to the report."
+            )
+            full_detail = col7.checkbox(
+                label="Show Full Detail",
+                value=False,
+                help=
+                f"Locations with more than {DETAIL_THRESHOLD} census tracts are mapped and reported as county totals. Check this box to map and list every census tract instead, which can be slow."
+            )
         submitted = st.form_submit_button(
             "Search",
             help=
             "Select a location by typing in a location name or selecting from the dropdown. Expand the Additional Report Parameters section to change what data will be included in the report."
         )
         if submitted:
-            return (shape, eb, dac_filter, qct_filter, cover_page, include_nhpd)
+            return (shape, eb, dac_filter, qct_filter, cover_page, include_nhpd,
+                    detailed, full_detail)
 
     return None
 
 
-def load_dac():
-    with st.spinner("Loading census tract data..."):
-        with open('../data/report_data/dac.pkl', "rb") as f:
-            dac = pickle.load(f)
-    return dac
+def show_table(frame, key, paginate):
+    # Large selections are shown a page at a time, the download has every row
+    pages = -(-len(frame) // PAGE_ROWS)
+    if not paginate or pages <= 1:
+        st.dataframe(frame)
+        return
+    page = st.number_input(f"Page (of {pages})",
+                           min_value=1,
+                           max_value=pages,
+                           value=1,
+                           key=key)
+    st.dataframe(frame.iloc[(page - 1) * PAGE_ROWS:page * PAGE_ROWS])
 
 
-def load_nhpd():
-    with st.spinner("Loading NHPD data..."):
-        with open('../data/report_data/nhpd.pkl', "rb") as f:
-            nhpd = pickle.load(f)
-    return nhpd
+def pdf_base64(result):
+    # Encoded once per report and kept with the job's result, which every
+    # rerun and every session showing the same report shares
+    if result.get("pdf_base64") is None:
+        result["pdf_base64"] = base64.b64encode(result["pdf"]).decode("utf-8")
+    return result["pdf_base64"]
 
 
-def load_boundary(level):
-    with st.spinner(f"Loading {level} boundaries..."):
-        if level == "Census Tract ID":
-            with open('../data/report_data/dac.pkl', "rb") as f:
-                dac_boundary = pickle.load(f)
-            dac_boundary["NAME"] = dac_boundary["GEOID"]
-            return dac_boundary[["NAME", "geometry"]]
-        elif level == "City":
-            with open('../data/report_data/dac.pkl', "rb") as f:
-                dac_boundary = pickle.load(f)
-            # Drop columns where there is no city name
-            dac_boundary = dac_boundary[dac_boundary["city"].notna()]
-            dac_boundary["NAME"] = dac_boundary["city"] + " (" + dac_boundary["county_name"] + ")"
-            return dac_boundary[["city", "county_name", "NAME", "geometry"]]
-        elif level == "County":
-            with open('../data/report_data/counties.pkl', "rb") as f:
-                return pickle.load(f)
-        elif level == "State":
-            with open('../data/report_data/states.pkl', "rb") as f:
-                return pickle.load(f)
-        else:
-            with open('../data/report_data/tt_shp.pkl', "rb") as f:
-                return pickle.load(f)
+def show_map(shape, fig, png, nhpd_select, summary):
+    with st.expander("Map", expanded=True):
+        # Housing markers go on the interactive map only, the report image
+        # was rendered without them. County maps of large selections show
+        # housing as county totals instead.
+        fig = go.Figure(fig)
+        if not summary:
+            fig = add_housing(fig, nhpd_select)
+        # Plot map on Streamlit page
+        st.plotly_chart(fig, use_container_width=True)
+        st.components.v1.html(html=f'<img src="data:image/png;base64,{legend_base64()}" alt="0" style="width: 35%; display: block; margin-left: 20px; margin-right: auto; margin-top: 0px;" align="left">', height=50)        # Create button to download map image
+        btn = st.download_button(
+            label="Download Map",
+            data=png,
+            file_name=f"{shape.iloc[0]['NAME']}.png",
+            mime="image/png",
+        )
 
 
-def dac_selector(dac, shape, level):
-    if level == "Census Tract ID":
-        return dac.drop(dac[dac["GEOID"].str[:].ne(
-            shape["NAME"].values[0])].index)
-    if level == "City":
-        dac = dac.drop(dac[dac["city"].str[:].ne(
-            shape["city"].values[0])].index)
-        return dac.drop(dac[dac["county_name"].str[:].ne(
-            shape["county_name"].values[0])].index)
-    if level == "County":
-        return dac.drop(dac[dac["GEOID"].str[:5].ne(
-            shape["GEOID"].values[0])].index)
-    if level == "State":
-        return dac.drop(dac[dac["GEOID"].str[:2].ne(
-            shape["GEOID"].values[0])].index)
-    else:
+def locate_buildings():
+    # Tract, DAC and QCT status of every building in an uploaded CSV of
+    # coordinates, looked up in bulk without a report
+    with st.expander("Look Up Census Tracts for Building Coordinates"):
+        upload = st.file_uploader(
+            "CSV file of building coordinates",
+            type=["csv"],
+            help="One row per building, with latitude and longitude columns (named lat/latitude and lon/lng/longitude).")
+        if upload is None:
+            return
         try:
-            dac_select = gpd.sjoin(dac,
-                                   shape,
-                                   how="inner",
-                                   predicate="intersects")
-            dac_select.rename(columns={"GEOID_left": "GEOID"}, inplace=True)
-            return dac_select.loc[:, "GEOID":"geometry"].reset_index()
-        except:
-            # Exact match
-            return dac.drop(dac[dac["GEOID"].str[:].ne(
-                shape["GEOID"].values[0])].index)
+            buildings = pd.read_csv(upload)
+        except (pd.errors.ParserError, pd.errors.EmptyDataError,
+                UnicodeDecodeError):
+            st.error("The file could not be read as a CSV file.")
+            return
+        columns = {column.strip().lower(): column for column in buildings}
+        lat = next((columns[c] for c in LAT_COLUMNS if c in columns), None)
+        lon = next((columns[c] for c in LON_COLUMNS if c in columns), None)
+        if lat is None or lon is None:
+            st.error("The CSV file needs a latitude and a longitude column.")
+            return
+        tracts = reportdata.locate_tracts(
+            pd.to_numeric(buildings[lon], errors="coerce").values,
+            pd.to_numeric(buildings[lat], errors="coerce").values)
+        # Tract columns are prefixed to tell them from the building's own,
+        # unless they already are (tract_state_percentile)
+        tracts.columns = [
+            column if column.startswith("tract_") else f"tract_{column}"
+            for column in tracts.columns
+        ]
+        located = pd.concat(
+            [buildings.reset_index(drop=True), tracts], axis=1)
+        st.write(f"Found the census tract of {tracts['tract_GEOID'].notna().sum()} "
+                 f"of {len(buildings)} buildings.")
+        show_table(located, "located_page", True)
+        st.download_button(label="Download Census Tracts",
+                           data=located.to_csv(index=False),
+                           file_name="building_tracts.csv",
+                           mime="text/csv")
 
 
-def create_map(shape, dac_select, nhpd_select):
-    with st.expander("Map", expanded=True):
-        shape_geometry = json.loads(shape.geometry.to_json())
-        shape_coords = shape_geometry["features"][0]["geometry"]["coordinates"]
-        type = shape_geometry["features"][0]["geometry"]["type"]
-        if type == "Polygon":
-            zoom, center = zoom_center(lons=[i[0] for i in shape_coords[0]],
-                                       lats=[i[1] for i in shape_coords[0]])
-        else:  # For multipolygon - with islands
-            zooms_centers = []
-            for polygon in range(len(shape_coords)):
-                zoom, center = zoom_center(
-                    lons=[i[0] for i in shape_coords[polygon][0]],
-                    lats=[i[1] for i in shape_coords[polygon][0]])
-                zooms_centers.append((zoom, center))
-            # Choose smallest zoom as zoom level
-            zoom = min([i[0] for i in zooms_centers])
-            # Choose center of that zoom
-            center = [i[1] for i in zooms_centers if i[0] == zoom][0]
-            zoom = zoom - 1
-        with open("legend.png", "rb") as image_file:
-            encoded_string = base64.b64encode(
-                image_file.read()).decode('utf-8')
-        colors = [
-            "red" if row.DAC_status == "Disadvantaged" else "black"
-            for _, row in dac_select.iterrows()
-        ]
-        stroke_width = [
-            5 if row.DAC_status == "Disadvantaged" else 0
-            for _, row in dac_select.iterrows()
-        ]
+def show_rankings():
+    # Top boundaries of a level by one of their precomputed summary figures
+    with st.expander("National Rankings"):
+        col1, col2, col3 = st.columns([1, 2, 1])
+        level = col1.selectbox("Rank", ("County", "State", "City",
+                                        "Tribe or Territory"))
+        label = col2.selectbox("By", list(RANKING_COLUMNS))
+        count = col3.number_input("Top", min_value=1, max_value=500, value=10)
+        ranking = reportdata.top_boundaries(level, RANKING_COLUMNS[label],
+                                            n=count)
+        st.dataframe(ranking.reset_index(drop=True)[[
+            "NAME", *RANKING_COLUMNS.values()
+        ]].rename(columns={
+            "NAME": level,
+            **{column: name for name, column in RANKING_COLUMNS.items()}
+        }))
 
-        fig = px.choropleth_mapbox(
-            dac_select,
-            geojson=dac_select["geometry"],
-            locations=dac_select.index,
-            color="avg_energy_burden_natl_pctile",
-            color_continuous_scale="ylorbr",
-            mapbox_style="carto-positron",
-            zoom=0.8 * zoom,
-            center=center,
-            labels={
-                "avg_energy_burden_natl_pctile": "Energy Burden Percentile",
-                "GEOID": "Census Tract ID",
-                "QCT_status": "Housing Tax Credit Status"
-            },
-            hover_data={
-                "GEOID": True,
-                "avg_energy_burden_natl_pctile": True,
-                "QCT_status": True
-            },
-            hover_name="DAC_status",
-        )
-        fig.update_layout(margin=dict(l=20, r=20, t=0, b=0),
-            mapbox={
-                "style":
-                "carto-positron",
-                "layers": [
-                    {
-                        "source": json.loads(shape.geometry.to_json()),
-                        "type": "line",
-                        "color": "gray",
-                        "line": {
-                            "width": 3
-                        },
-                        "below": "traces",
-                    },
-                ],
-            })
 
-        fig.update_geos(fitbounds="geojson", visible=False)
-        fig.update_traces(
-            marker_line_color=colors,
-            marker_line_width=stroke_width,
-            marker_opacity=0.5,
-        )
-        # Save the map as an image before adding housing data to enable the report to display it
-        png = fig.write_image("fig.png")
-        # Add housing data to the map
-        if not nhpd_select.empty:
-            fig.add_scattermapbox(
-                lat=nhpd_select.lat,
-                lon=nhpd_select.lon,
-                mode="markers+text",
-                marker_size=10,
-                marker_color="black",
-                opacity=0.5,
-                text=[i for i in nhpd_select["Property Name"].values],
-            )
-        # Plot map on Streamlit page
-        st.plotly_chart(fig, use_container_width=True)
-        st.components.v1.html(html=f'<img src="data:image/png;base64,{encoded_string}" alt="0" style="width: 35%; display: block; margin-left: 20px; margin-right: auto; margin-top: 0px;" align="left">', height=50)        # Create button to download map image
-        with open("fig.png", "rb") as file:
-            btn = st.download_button(
-                label="Download Map",
-                data=file,
-                file_name=f"{shape.iloc[0]['NAME']}.png",
-            )
+# Reruns only its own widgets while the job runs. Falls back to the
+# experimental name on Streamlit releases from before it was stable.
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
 
 
-def report_data_filter(dac_select, eb, dac_filter, qct_filter):
-    # Filter dac_select by energy burden percentile
-    dac_select = dac_select.loc[
-        (dac_select["avg_energy_burden_natl_pctile"] >= eb[0])
-        & (dac_select["avg_energy_burden_natl_pctile"] <= eb[1])]
-    if dac_filter:
-        # Filter dac_select by DAC status
-        dac_select = dac_select.loc[dac_select["DAC_status"] ==
-                                    "Disadvantaged"]
-    if qct_filter:
-        # Filter dac_select by QCT status
-        dac_select = dac_select.loc[dac_select["QCT_status"] == "Eligible"]            # Create a new column called "DAC_check" with a checkmark if the row has "DAC_status" == "Disadvantaged" and a cross if it doesn't
-    dac_select["DAC_check"] = dac_select["DAC_status"].apply(lambda x: "Yes" if x == "Disadvantaged" else "No")
-    # Create a new column called "QCT_check" with a checkmark if the row has "QCT_status" == "Eligible" and a cross if it doesn't
-    dac_select["QCT_check"] = dac_select["QCT_status"].apply(lambda x: "Yes" if x == "Eligible" else "No")
-    return dac_select
+@fragment(run_every=0.5)
+def show_progress(job_id):
+    job = queue.get(job_id)
+    if job is None or job.finished:
+        # One full rerun draws the result below the rest of the page
+        rerun = getattr(st, "rerun", None) or st.experimental_rerun
+        rerun()
+    st.progress(job.progress)
+    st.write(f"{job.stage}...")
+
+
+def wait_for_report(request):
+    # Submit the request once per change and cancel the job of the previous
+    # request, then poll the job until it has finished. Only the progress
+    # fragment reruns while it does, not the rankings, search and uploads
+    # above it.
+    if st.session_state.get("report_request") != request:
+        if st.session_state.get("report_job") is not None:
+            queue.cancel(st.session_state["report_job"])
+        st.session_state["report_request"] = request
+        st.session_state["report_job"] = queue.submit(request).id
+    job = queue.get(st.session_state["report_job"])
+    if job is None:
+        # Finished long enough ago to have been dropped from the queue
+        job = queue.submit(request)
+        st.session_state["report_job"] = job.id
+    if not job.finished:
+        show_progress(job.id)
+        st.stop()
+    return job
 
 
 if __name__ == "__main__":
     if "previous_level" not in st.session_state:
         st.session_state["previous_level"] = None
+    with st.sidebar.expander("Data cache"):
+        # Shared across every session of this server process
+        st.dataframe(registry.stats())
+        st.write("Report jobs:", queue.stats())
+    locate_buildings()
+    show_rankings()
     level = select_level()
     if level == None:
         st.write("Click the Submit button to continue.")
         st.stop()
-    with st.spinner("Loading boundary data..."):
-        boundary = load_boundary(level)
-    output = select_location(boundary, level)
-    if output == None:
+    if level == CUSTOM_AREA:
+        options = custom_area()
+    else:
+        options = search_locations(level)
+    if not options:
+        st.write("Upload a GeoJSON file to continue." if level ==
+                 CUSTOM_AREA else f"No {level} matches your search.")
+        st.stop()
+    output = select_location(options, level)
+    if output is not None:
+        request = (level, *output)
+    elif (st.session_state.get("report_request") or (None, ))[0] == level:
+        # Keep showing (or waiting for) the last report across reruns
+        request = st.session_state["report_request"]
+    else:
         st.write("Click the Search button to continue.")
         st.stop()
-    location, eb, dac_filter, qct_filter, cover_page, include_nhpd = output
-    with st.spinner("Loading results (may take up to one minute)..."):
-        dac = load_dac()
-        nhpd = load_nhpd()
-        shape = boundary.loc[boundary["NAME"] == location]
-        nhpd_select = gpd.sjoin(shape,
-                                nhpd,
-                                how="inner",
-                                predicate="intersects")
-        dac_select = dac_selector(dac, shape, level)
-        if nhpd_select.empty:
-            st.write("No housing data found for this location.")
-        if dac_select.empty:
-            st.write("No census tracts found for this location.")
-        if not nhpd_select.empty:
-            with st.expander("Housing Data"):
-                nhpd_display = (pd.DataFrame(
-                    nhpd_select.drop(
-                        ["geometry"],
-                        axis=1).loc[:, 'Property Name':]).reset_index().drop(
-                            ["index", "lat", "lon"], axis=1))
-                st.dataframe(nhpd_display)
-                st.download_button(
-                    label="Download Housing Data",
-                    data=nhpd_display.to_csv(),
-                    help=
-                    "Download housing data as a CSV file and reset the search."
-                )
-        if not dac_select.empty:
-            with st.expander("Census Tract Data"):
-                dac_display = (pd.DataFrame(
-                    dac_select.drop(["geometry"],
-                                    axis=1)).reset_index().drop(["index"],
-                                                                axis=1))
-                st.dataframe(dac_display)
-                st.download_button(
-                    label="Download Census Tract Data",
-                    data=dac_display.to_csv(),
-                    help=
-                    "Download census tract data as a CSV file and reset the search."
-                )
-        if not nhpd_select.empty or not dac_select.empty:
-            create_map(shape, dac_select, nhpd_select)
-            if not dac_select.empty:
-                with st.spinner("Generating report..."):
-                    # Open the map image saved earlier and add it to the report
-                    dac_select = report_data_filter(dac_select, eb, dac_filter, qct_filter)
-                    generate_pdf(shape, "fig.png", dac_select, nhpd_select, cover_page, include_nhpd, out_path="report.pdf")
-                    # Save as a PDF
-                    with open("report.pdf", "rb") as file:
-                        with st.expander("Report"):
-                            encoded_string = base64.b64encode(file.read()).decode('utf-8')
-                            pdf_display = f'<embed src="data:application/pdf;base64,{encoded_string}" width="700" height="400" type="application/pdf">'
-                            st.markdown(pdf_display, unsafe_allow_html=True)
-                        btn = st.download_button(
-                            label="Download Report",
-                            data=file,
-                            file_name=f"{shape.iloc[0]['NAME']}.pdf",
-                            help=
-                            "Download the report as a PDF file and open in your browser or PDF viewer, or expand the Report section above."
-                        )
+    job = wait_for_report(request)
+    if job.status == "failed":
+        st.error(f"The report could not be generated: {job.error}")
+        st.stop()
+    if job.status == "cancelled":
+        st.write("The report was cancelled. Click the Search button to try again.")
+        st.stop()
+    result = job.result
+    shape = result["shape"]
+    dac_select = result["dac_select"]
+    nhpd_select = result["nhpd_select"]
+    if nhpd_select.empty:
+        st.write("No housing data found for this location.")
+    if dac_select.empty:
+        st.write("No census tracts found for this location.")
+    if result["summary"]:
+        st.info(
+            f"This location has {len(dac_select)} census tracts, so the map and report show county totals. Check Show Full Detail under Additional Report Parameters to see every census tract."
+        )
+    if not nhpd_select.empty:
+        with st.expander("Housing Data"):
+            nhpd_display = (pd.DataFrame(
+                nhpd_select.drop(
+                    ["geometry"],
+                    axis=1).loc[:, 'Property Name':]).reset_index().drop(
+                        ["index", "lat", "lon", "tract_geoid"] +
+                        list(NHPD_KEYS.values()),
+                        axis=1).drop(
+                            [cluster_column(z) for z in CLUSTER_ZOOMS],
+                            axis=1,
+                            errors="ignore"))
+            show_table(nhpd_display, "housing_page", result["summary"])
+            st.download_button(
+                label="Download Housing Data",
+                data=nhpd_display.to_csv(),
+                help=
+                "Download housing data as a CSV file and reset the search."
+            )
+    if not dac_select.empty:
+        with st.expander("Census Tract Data"):
+            dac_display = (pd.DataFrame(
+                dac_select.drop(["geometry"],
+                                axis=1)).reset_index().drop(["index"],
+                                                            axis=1))
+            show_table(dac_display, "tract_page", result["summary"])
+            st.download_button(
+                label="Download Census Tract Data",
+                data=dac_display.to_csv(),
+                help=
+                "Download census tract data as a CSV file and reset the search."
+            )
+    if result["fig"] is not None:
+        show_map(shape, result["fig"], result["png"], nhpd_select,
+                 result["summary"])
+    if result["pdf"] is not None:
+        # The preview and the download serve the same PDF bytes
+        with st.expander("Report"):
+            pdf_display = f'<embed src="data:application/pdf;base64,{pdf_base64(result)}" width="700" height="400" type="application/pdf">'
+            st.markdown(pdf_display, unsafe_allow_html=True)
+        btn = st.download_button(
+            label="Download Report",
+            data=result["pdf"],
+            file_name=f"{shape.iloc[0]['NAME']}.pdf",
+            mime="application/pdf",
+            help=
+            "Download the report as a PDF file and open in your browser or PDF viewer, or expand the Report section above."
+        )
@@ -2,9 +2,39 @@ from fpdf import FPDF
 from fpdf import YPos, XPos
 from PIL import Image
 from datetime import datetime
+from io import BytesIO
 import pandas as pd
 import numpy as np
 
+# Indicator bars of the detailed tract pages, in display order
+INDICATORS = [
+    ("Energy Burden", "avg_energy_burden_natl_pctile"),
+    ("Housing Burden", "avg_housing_burden_natl_pctile"),
+    ("Transport Burden", "avg_transport_burden_natl_pctile"),
+    ("Low Income (AMI)", "lowincome_ami_pct_natl_pctile"),
+    ("Nonwhite Population", "nonwhite_pct_natl_pctile"),
+    ("Incomplete Plumbing", "incomplete_plumbing_pct_natl_pctile"),
+    ("Lead Paint", "lead_paint_pct_natl_pctile"),
+    ("Non-Grid Heating", "nongrid_heat_pct_natl_pctile"),
+]
+# Postal abbreviation of each state and territory by FIPS code, the first two
+# digits of a tract GEOID
+STATE_ABBREVIATIONS = {
+    "01": "AL", "02": "AK", "04": "AZ", "05": "AR", "06": "CA", "08": "CO",
+    "09": "CT", "10": "DE", "11": "DC", "12": "FL", "13": "GA", "15": "HI",
+    "16": "ID", "17": "IL", "18": "IN", "19": "IA", "20": "KS", "21": "KY",
+    "22": "LA", "23": "ME", "24": "MD", "25": "MA", "26": "MI", "27": "MN",
+    "28": "MS", "29": "MO", "30": "MT", "31": "NE", "32": "NV", "33": "NH",
+    "34": "NJ", "35": "NM", "36": "NY", "37": "NC", "38": "ND", "39": "OH",
+    "40": "OK", "41": "OR", "42": "PA", "44": "RI", "45": "SC", "46": "SD",
+    "47": "TN", "48": "TX", "49": "UT", "50": "VT", "51": "VA", "53": "WA",
+    "54": "WV", "55": "WI", "56": "WY", "60": "AS", "66": "GU", "69": "MP",
+    "72": "PR", "78": "VI",
+}
+# Highlight colors for values above (bad) and at most (good) the 50th percentile
+BAD_COLOR = (227, 114, 34)
+GOOD_COLOR = (105, 190, 40)
+
 class PDF(FPDF):
 
     # def header(self):
@@ -31,8 +61,7 @@ class PDF(FPDF):
         # Printing page number:
         self.cell(0, 10, f"Page {self.page_no()}/{{nb}}", align="C")
 
-    # Creates table for census tracts
-    def tract_table(self, dac_select, headings=["Tract ID", "City", "County", "Population", "DAC", "HTC", "State %", "National %", "Energy Burden %"], col_widths=(22, 30, 45, 17, 10, 10, 15, 17, 27)):
+    def table_header(self, headings, col_widths, height=7):
         # Colors, line width and bold font:
         self.set_fill_color(15, 102, 54)
         self.set_text_color(255)
@@ -40,30 +69,161 @@ class PDF(FPDF):
         self.set_line_width(0.3)
         self.set_font(style="B", size=8)
         for col_width, heading in zip(col_widths, headings):
-            self.multi_cell(col_width, 7, heading, border=1, align="C", fill=True, new_y=YPos.TOP)
+            self.multi_cell(col_width, height, heading, border=1, align="C", fill=True, new_y=YPos.TOP)
         self.ln()
         # Color and font restoration:
         self.set_fill_color(224, 235, 255)
         self.set_text_color(0)
         self.set_font()
-        fill = False
-        for _, tract in dac_select.sort_values(by=["avg_energy_burden_natl_pctile"],ascending=False).iterrows():
-            self.cell(col_widths[0], 6, tract["GEOID"], border="LR", align="C", fill=fill, new_y=YPos.TOP)
-            try:
-                self.cell(col_widths[1], 6, tract["city"], border="LR", align="C", fill=fill, new_y=YPos.TOP)
-            except:
-                self.cell(col_widths[1], 6, "", border="LR", align="C", fill=fill, new_y=YPos.TOP)
-            self.cell(col_widths[2], 6, tract["county_name"], border="LR", align="C", fill=fill, new_y=YPos.TOP)
-            self.cell(col_widths[3], 6, str(tract['population']), border="LR", align="C", fill=fill, new_y=YPos.TOP)
-            self.cell(col_widths[4], 6, tract['DAC_check'], border="LR", align="C", fill=fill, new_y=YPos.TOP)
-            self.cell(col_widths[5], 6, tract['QCT_check'], border="LR", align="C", fill=fill, new_y=YPos.TOP)
-            self.cell(col_widths[6], 6, str(tract['tract_state_percentile']), border="LR", align="C", fill=fill, new_y=YPos.TOP)
-            self.cell(col_widths[7], 6, str(tract['tract_national_percentile']), border="LR", align="C", fill=fill, new_y=YPos.TOP)
-            self.cell(col_widths[8], 6, str(tract["avg_energy_burden_natl_pctile"]), border="LR", align="C", fill=fill, new_y=YPos.TOP)
-            self.ln()
-            # Alternate row colors
-            fill = not fill
-        self.cell(sum(col_widths), 0, "", "T")
+
+    def table_rows(self, columns, headings, col_widths, height=6):
+        # columns holds one array of preformatted strings per table column.
+        # Each page of rows is drawn in bulk: one rectangle per shaded row,
+        # one line per column border and bare text placed at precomputed
+        # offsets, instead of a full cell() call (and its layout work) for
+        # every cell. Headings are repeated at the top of every page.
+        widths = None
+        lefts = self.l_margin + np.concatenate(([0], np.cumsum(col_widths)))
+        rows = len(columns[0]) if columns else 0
+        start = 0
+        while True:
+            self.table_header(headings, col_widths)
+            if widths is None:
+                # Measured once per distinct string, in the body font the
+                # header leaves set
+                widths = {text: self.get_string_width(text) for values in columns for text in np.unique(values)}
+            top = self.y
+            stop = min(rows, start + max(int((self.page_break_trigger - top) // height), 1))
+            for i in range(1, stop - start, 2):
+                # Alternate row colors
+                self.rect(lefts[0], top + i * height, lefts[-1] - lefts[0], height, style="F")
+            baseline = top + .5 * height + .3 * self.font_size
+            for left, col_width, values in zip(lefts, col_widths, columns):
+                for i, text in enumerate(values[start:stop]):
+                    self.text(left + (col_width - widths[text]) / 2, baseline + i * height, text)
+            bottom = top + (stop - start) * height
+            for left in lefts:
+                self.line(left, top, left, bottom)
+            self.line(lefts[0], bottom, lefts[-1], bottom)
+            self.set_y(bottom)
+            start = stop
+            if start >= rows:
+                break
+            self.add_page()
+
+    def fit_text(self, values, col_width):
+        # Truncates the strings of a column that would overflow its cell,
+        # using the width of an average character instead of measuring each one
+        max_chars = max(int((col_width - 2 * self.c_margin) / self.get_string_width("n")), 4)
+        return np.where(values.str.len() > max_chars, values.str.slice(0, max_chars - 3) + "...", values)
+
+    # Creates table for census tracts
+    def tract_table(self, dac_select, headings=["Tract ID", "City", "County", "Population", "DAC", "HTC", "State %", "National %", "Energy Burden %"], col_widths=(22, 30, 45, 17, 10, 10, 15, 17, 27)):
+        columns = ["GEOID", "city", "county_name", "population", "DAC_check", "QCT_check", "tract_state_percentile", "tract_national_percentile", "avg_energy_burden_natl_pctile"]
+        tracts = dac_select.sort_values(by=["avg_energy_burden_natl_pctile"], ascending=False)
+        self.set_font(size=8)
+        self.table_rows([self.fit_text(pd.Series(table_column(tracts[column])), col_width) for column, col_width in zip(columns, col_widths)], headings, col_widths)
+
+    # Creates a table of county totals for selections too large to list tract by tract
+    def county_table(self, counties, headings=("County", "Tracts", "DAC", "HTC", "Population", "Energy Burden %", "Properties", "Assisted Units"), col_widths=(55, 15, 15, 15, 22, 27, 20, 26)):
+        self.set_font(size=8)
+        columns = [
+            self.fit_text(pd.Series(table_column(counties["NAME"])), col_widths[0]),
+            np.char.mod("%d", counties["tracts"].to_numpy(np.int64)).astype(object),
+            np.char.mod("%d", counties["dac_tracts"].to_numpy(np.int64)).astype(object),
+            np.char.mod("%d", counties["qct_tracts"].to_numpy(np.int64)).astype(object),
+            np.char.mod("%d", counties["population"].round().to_numpy(np.int64)).astype(object),
+            np.char.mod("%.2f", counties["avg_energy_burden_natl_pctile"].to_numpy(np.float64)).astype(object),
+            np.char.mod("%d", counties["properties"].to_numpy(np.int64)).astype(object),
+            np.char.mod("%d", counties["assisted_units"].round().to_numpy(np.int64)).astype(object),
+        ]
+        self.table_rows(columns, headings, col_widths)
+
+    # Creates a table with one row per housing property
+    def nhpd_compact_table(self, nhpd_select, headings=("Property Name", "Street Address", "City", "Zip Code", "Subsidy Name", "Assisted Units"), col_widths=(42, 42, 28, 16, 40, 27)):
+        columns = ["Property Name", "Street Address", "City", "Zip Code", "Subsidy Name", "Assisted Units"]
+        self.set_font(size=8)
+        self.table_rows([self.fit_text(pd.Series(table_column(nhpd_select[column])), col_width) for column, col_width in zip(columns, col_widths)], headings, col_widths)
+
+    # Creates a page section per census tract with its indicator bars
+    def tract_details(self, dac_select, label_width=45, row_height=6):
+        tracts = dac_select.sort_values(by=["avg_energy_burden_natl_pctile"], ascending=False)
+        table_width = self.w - self.l_margin - self.r_margin
+        bar_width = table_width - label_width - 14
+        # Every string, bar length and highlight of every tract is worked out
+        # column by column up front, the loop below only draws
+        values = tracts[[column for _, column in INDICATORS]].to_numpy(dtype=np.float64)
+        bars = np.nan_to_num(np.clip(values, 0, 100)) / 100 * bar_width
+        bad_bars = values > 50
+        labels = np.where(np.isnan(values), "N/A", np.char.mod("%.2f", np.nan_to_num(values))).astype(object)
+        geoids = table_column(tracts["GEOID"])
+        # The state is named by the GEOID's FIPS prefix, county names do not
+        # always end in one
+        fips = pd.Series(geoids, dtype=object).str[:2]
+        details = [
+            ("City", table_column(tracts["city"])),
+            ("County", table_column(tracts["county_name"])),
+            ("State", fips.map(STATE_ABBREVIATIONS).fillna(fips).values),
+            ("Population", table_column(tracts["population"])),
+        ]
+        rankings = [tracts["tract_state_percentile"], tracts["tract_national_percentile"]]
+        statuses = [
+            ("DAC Status", table_column(tracts["DAC_status"]), (tracts["DAC_status"] == "Disadvantaged").values),
+            ("QCT Status", table_column(tracts["QCT_status"]), (tracts["QCT_status"] == "Eligible").values),
+            ("State Ranking", table_column(rankings[0]), (rankings[0] > 50).values),
+            ("National Ranking", table_column(rankings[1]), (rankings[1] > 50).values),
+        ]
+        block_height = 12 + 4 * row_height + 4 + 7 + len(INDICATORS) * row_height + 8
+        half = table_width / 2
+        for i in range(len(tracts)):
+            if self.y + block_height > self.page_break_trigger:
+                self.add_page()
+            left, top = self.l_margin, self.y
+            # Title bar
+            self.set_fill_color(15, 102, 54)
+            self.set_text_color(255)
+            self.set_font(style="B", size=12)
+            self.rect(left, top, 80, 9, style="F")
+            self.text(left + 2, top + 6.2, f"Census Tract {geoids[i]}")
+            # Tract details and highlighted statuses
+            self.set_text_color(0)
+            self.set_font(style="", size=9)
+            y = top + 12 + .5 * row_height + .3 * self.font_size
+            for j, (label, column) in enumerate(details):
+                self.text(left, y + j * row_height, f"{label}: {column[i]}")
+            for j, (label, column, bad) in enumerate(statuses):
+                prefix = f"{label}: "
+                x = left + half + self.get_string_width(prefix)
+                self.set_fill_color(*(BAD_COLOR if bad[i] else GOOD_COLOR))
+                self.rect(x - .5, top + 12 + j * row_height + 1, self.get_string_width(column[i]) + 1, row_height - 2, style="F")
+                self.text(left + half, y + j * row_height, prefix)
+                self.text(x, y + j * row_height, column[i])
+            # Indicator table
+            top += 12 + 4 * row_height + 4
+            self.set_fill_color(15, 102, 54)
+            self.set_text_color(255)
+            self.set_font(style="B", size=8)
+            self.rect(left, top, table_width, 7, style="F")
+            self.text(left + 2, top + 4.8, "Indicator")
+            self.text(left + label_width + 2, top + 4.8, "National Percentile")
+            top += 7
+            self.set_text_color(0)
+            self.set_font(style="", size=8)
+            # Bars of one color are drawn together
+            for bad, color in ((True, BAD_COLOR), (False, GOOD_COLOR)):
+                self.set_fill_color(*color)
+                for j in np.flatnonzero(bad_bars[i] == bad):
+                    if bars[i, j] > 0:
+                        self.rect(left + label_width, top + j * row_height + 1, bars[i, j], row_height - 2, style="F")
+            baseline = top + .5 * row_height + .3 * self.font_size
+            for j, (label, _) in enumerate(INDICATORS):
+                self.text(left + 2, baseline + j * row_height, label)
+                self.text(left + label_width + bars[i, j] + 1.5, baseline + j * row_height, labels[i, j])
+            self.set_draw_color(15, 102, 54)
+            bottom = top + len(INDICATORS) * row_height
+            self.rect(left, top, table_width, bottom - top)
+            self.line(left + label_width, top, left + label_width, bottom)
+            self.set_y(bottom + 8)
 
     # Creates table for housing data
     def nhpd_table(self, name, row, headings=("City", "Zip Code", "Subsidy Name", "Assisted Units")):
@@ -77,32 +237,62 @@ class PDF(FPDF):
         self.ln()
         self.cell(w=(self.w - self.l_margin - self.r_margin), h=8, border=1, txt=name, align="C", fill=True)
         self.ln()
-        self.set_font(style="B", size=8)
-        for col_width, heading in zip(col_widths, headings):
-            self.multi_cell(col_width, 7, heading, border=1, align="C", fill=True, new_y=YPos.TOP)
-        self.ln()
-        # Color and font restoration:
-        self.set_fill_color(224, 235, 255)
-        self.set_text_color(0)
-        self.set_font()
-        fill = False
-        try:
-            self.cell(col_widths[0], 6, row["City"], border="LR", align="C", fill=fill, new_y=YPos.TOP)
-        except:
-            self.cell(col_widths[0], 6, "", border="LR", align="C", fill=fill, new_y=YPos.TOP)
-        self.cell(col_widths[1], 6, str(row["Zip Code"]), border="LR", align="C", fill=fill, new_y=YPos.TOP)
-        self.cell(col_widths[2], 6, row["Subsidy Name"], border="LR", align="C", fill=fill, new_y=YPos.TOP)
-        self.cell(col_widths[3], 6, str(row['Assisted Units']), border="LR", align="C", fill=fill, new_y=YPos.TOP)
+        self.table_header(headings, col_widths)
+        self.cell(col_widths[0], 6, row["City"], border="LR", align="C", fill=False, new_y=YPos.TOP)
+        self.cell(col_widths[1], 6, row["Zip Code"], border="LR", align="C", fill=False, new_y=YPos.TOP)
+        self.cell(col_widths[2], 6, row["Subsidy Name"], border="LR", align="C", fill=False, new_y=YPos.TOP)
+        self.cell(col_widths[3], 6, row["Assisted Units"], border="LR", align="C", fill=False, new_y=YPos.TOP)
         self.ln()
         self.cell(sum(col_widths), 0, "", "T")
 
+
+def table_column(values):
+    # Formats a whole column in one pass, missing values become empty cells
+    return np.where(values.isna().values, "", values.astype(str).values).astype(object)
+
+
+def table_strings(frame, columns):
+    # Rows of preformatted cell strings, built column by column
+    return list(zip(*[table_column(frame[column]) for column in columns]))
+
+
+def cover_totals(dac_select, nhpd_select):
+    # Cover page figures of a report, totalled from its rows. Same names as
+    # the columns of the aggregates artifact.
+    return {
+        "dac_tracts": (dac_select["DAC_status"].values == "Disadvantaged").sum(),
+        "qct_tracts": (dac_select["QCT_status"].values == "Eligible").sum(),
+        "properties": len(nhpd_select),
+        "assisted_units": nhpd_select["Assisted Units"].sum(),
+        "avg_energy_burden_natl_pctile":
+        dac_select["avg_energy_burden_natl_pctile"].mean(),
+        "avg_nonwhite_pct_natl_pctile":
+        dac_select["nonwhite_pct_natl_pctile"].mean(),
+    }
+
+
 def generate_pdf(shape,
                  map,
                  dac_select,
                  nhpd_select,
                  cover_page, include_nhpd,
-                 out_path="out.pdf"):
+                 out_path=None,
+                 nhpd_layout="compact",
+                 detailed=False,
+                 county_summary=None,
+                 totals=None):
+    # map is the map image as PNG bytes (or a path). Without out_path the PDF
+    # is returned as bytes instead of being written to disk. nhpd_layout is
+    # "compact" for one table row per property or "blocks" for a titled
+    # block per property. detailed adds a section per tract with its
+    # indicator percentiles after the tract table. county_summary, a frame from
+    # reportdata.county_summary, replaces the tract and housing lists of very
+    # large selections with a table of county totals. totals holds the cover
+    # page figures (see cover_totals), e.g. a row of the precomputed
+    # aggregates when the report covers a whole boundary unfiltered.
     # Add if dac_select.empty feature
+    if totals is None:
+        totals = cover_totals(dac_select, nhpd_select)
     pdf = PDF(format="letter")
     pdf.add_page()
     pdf.set_font('Helvetica', 'B', 16)
@@ -126,52 +316,68 @@ def generate_pdf(shape,
              fill=False,
              align='C')
     pdf.ln(10)
-    pdf.image(map, w=100, h=75, x=pdf.w / 4)
+    pdf.image(BytesIO(map) if isinstance(map, bytes) else map, w=100, h=75, x=pdf.w / 4)
     pdf.ln(10)
     pdf.set_x(0)
     pdf.multi_cell(
         w=70,
         h=10,
-        txt=f'{len(dac_select[dac_select["DAC_status"]=="Disadvantaged"])} \n Disadvantaged \n Census Tracts',
+        txt=f'{int(totals["dac_tracts"])} \n Disadvantaged \n Census Tracts',
         markdown=True, align='C', new_y=YPos.TOP)
     pdf.set_x(70)
-    pdf.multi_cell(w=70, h=10, txt=f'{len(nhpd_select)} \n Affordable \n Housing Properties', align='C', new_y=YPos.TOP)
+    pdf.multi_cell(w=70, h=10, txt=f'{int(totals["properties"])} \n Affordable \n Housing Properties', align='C', new_y=YPos.TOP)
     pdf.set_x(140)
-    if pd.isna(dac_select["avg_energy_burden_natl_pctile"].mean()):
+    if pd.isna(totals["avg_energy_burden_natl_pctile"]):
         pdf.multi_cell(w=70,
                 h=10,
                 txt=f'N/A \n Avg. Energy \n Burden %', align='C',new_y=YPos.TOP)
     else:
         pdf.multi_cell(w=70,
                 h=10,
-                txt=f'{dac_select["avg_energy_burden_natl_pctile"].mean():.2f} \n Avg. Energy \n Burden %', align='C',new_y=YPos.TOP)
+                txt=f'{totals["avg_energy_burden_natl_pctile"]:.2f} \n Avg. Energy \n Burden %', align='C',new_y=YPos.TOP)
     pdf.ln(40)
     pdf.set_x(0)
     pdf.multi_cell(w=70,
              h=10,
-             txt=f'{len(dac_select[dac_select["QCT_status"]=="Eligible"])} \n Housing Tax Credit \n Eligible Tracts', align='C', new_y=YPos.TOP)
+             txt=f'{int(totals["qct_tracts"])} \n Housing Tax Credit \n Eligible Tracts', align='C', new_y=YPos.TOP)
     pdf.set_x(70)
-    pdf.multi_cell(w=70, h=10, txt=f'{int(nhpd_select["Assisted Units"].sum())} \n Affordable \n Housing Units', align='C', new_y=YPos.TOP)
+    pdf.multi_cell(w=70, h=10, txt=f'{int(totals["assisted_units"])} \n Affordable \n Housing Units', align='C', new_y=YPos.TOP)
     pdf.set_x(140)
-    if pd.isna(dac_select["nonwhite_pct_natl_pctile"].mean()):
+    if pd.isna(totals["avg_nonwhite_pct_natl_pctile"]):
         pdf.multi_cell(w=70,
                 h=10,
                 txt=f'N/A \n Avg. Nonwhite \n Percentile', align='C',new_y=YPos.TOP)
     else:
         pdf.multi_cell(w=70,
                 h=10,
-                txt=f'{dac_select["nonwhite_pct_natl_pctile"].mean():.2f} \n Avg. Nonwhite \n Percentile', align='C', new_y=YPos.TOP)
+                txt=f'{totals["avg_nonwhite_pct_natl_pctile"]:.2f} \n Avg. Nonwhite \n Percentile', align='C', new_y=YPos.TOP)
     pdf.ln(40)
     pdf.set_text_color(255)
     pdf.set_x(70)
     pdf.cell(w=70, h=10, txt='Download Data Definitions', border=0, fill=True, align='C', link='https://docs.google.com/spreadsheets/d/1zigWKMy4_WLyaB46iqG4185vPi85wCZeDSc4fvQE5tI/edit?usp=sharing')
-    if not cover_page and not dac_select.empty:
+    if not cover_page and county_summary is not None:
+        pdf.add_page()
+        pdf.set_font('Helvetica', 'B', 12)
+        pdf.cell(w=0, h=10, txt=f'{len(dac_select)} census tracts in {len(county_summary)} counties, summarized by county', border=0, align='C')
+        pdf.ln(12)
+        pdf.county_table(county_summary)
+    elif not cover_page and not dac_select.empty:
         pdf.add_page()
         pdf.tract_table(dac_select)
+        if detailed:
+            pdf.add_page()
+            pdf.tract_details(dac_select)
         if include_nhpd:
             pdf.add_page()
-            for _, row in nhpd_select.iterrows():
-                pdf.nhpd_table(name=f'{row["Property Name"]}: {row["Street Address"]}', row=row)
+            if nhpd_layout == "compact":
+                pdf.nhpd_compact_table(nhpd_select)
+            else:
+                columns = ["Property Name", "Street Address", "City", "Zip Code", "Subsidy Name", "Assisted Units"]
+                for row in table_strings(nhpd_select, columns):
+                    row = dict(zip(columns, row))
+                    pdf.nhpd_table(name=f'{row["Property Name"]}: {row["Street Address"]}', row=row)
+    if out_path is None:
+        return bytes(pdf.output())
     pdf.output(out_path)
 
 
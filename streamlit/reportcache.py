@@ -0,0 +1,108 @@
+# Disk cache of generated report PDFs and map images, shared by every session,
+# process and replica on the host. Entries are addressed by a hash of the
+# data version and the report parameters, so a rebuilt dataset never serves a
+# stale report, and the least recently used entries are evicted once the
+# cache grows past its budget.
+
+import hashlib
+import json
+import os
+import struct
+import threading
+
+import plotly.io as pio
+
+from datastore import registry
+
+CACHE_DIR = os.environ.get("REPORT_CACHE_DIR",
+                           os.path.join("..", "data", "report_cache"))
+BUDGET_BYTES = int(os.environ.get("REPORT_CACHE_MB", 512)) * 2**20
+# Bump whenever the layout of the map image or the PDF changes
+REPORT_FORMAT = 3
+# Entries are raw bytes, never pickles, so a file dropped into the shared
+# directory cannot run code in the app: a header with the length of each
+# part, then the map figure as plotly JSON, the PNG and the PDF
+HEADER = struct.Struct(">QQQ")
+
+
+def cache_key(request):
+    """Key of the report for request, a (level, location, eb, dac_filter,
+    qct_filter, cover_page, include_nhpd, detailed, full_detail) tuple."""
+    payload = json.dumps([REPORT_FORMAT, registry.data_version(), *request])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def entry_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.report")
+
+
+def encode(fig, png, pdf):
+    figure = fig.to_json().encode()
+    return HEADER.pack(len(figure), len(png), len(pdf)) + figure + png + pdf
+
+
+def decode(data):
+    """{"fig", "png", "pdf"} of an entry, or None if it is malformed."""
+    if len(data) < HEADER.size:
+        return None
+    lengths = HEADER.unpack_from(data)
+    if HEADER.size + sum(lengths) != len(data):
+        return None
+    parts, offset = [], HEADER.size
+    for length in lengths:
+        parts.append(data[offset:offset + length])
+        offset += length
+    figure, png, pdf = parts
+    try:
+        fig = pio.from_json(figure.decode())
+    except ValueError:
+        return None
+    return {"fig": fig, "png": png, "pdf": pdf}
+
+
+def get(key):
+    """Returns {"fig": Figure, "png": bytes, "pdf": bytes} for key, or None
+    on a miss."""
+    path = entry_path(key)
+    try:
+        with open(path, "rb") as f:
+            entry = decode(f.read())
+        # The modification time doubles as the last use for eviction
+        os.utime(path)
+    except OSError:
+        return None
+    return entry
+
+
+def put(key, fig, png, pdf):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Write under a name unique to this process and thread, then rename, so
+    # readers in other processes only ever see complete entries
+    tmp_path = f"{entry_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encode(fig, png, pdf))
+    os.replace(tmp_path, entry_path(key))
+    evict()
+
+
+def evict(budget_bytes=BUDGET_BYTES):
+    entries = []
+    for entry in os.scandir(CACHE_DIR):
+        if not entry.name.endswith(".report"):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    # Least recently used first. Another process may be evicting the same
+    # entries, so a file that is already gone is not an error.
+    for _, size, path in sorted(entries):
+        if total <= budget_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
@@ -0,0 +1,217 @@
+# Selects the census tracts and housing for a report. Kept free of Streamlit
+# calls so the Report page, the background report jobs and batch runs all
+# share the same selection code.
+
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from datastore import (GEOID_DIGITS, format_geoid, format_housing,
+                       format_tracts, read_tract_rows, registry)
+from spatial import CUSTOM_AREA, custom_shape
+
+# Selections with more tracts than this are mapped and reported as county
+# totals unless the user asks for full detail
+DETAIL_THRESHOLD = int(os.environ.get("REPORT_DETAIL_THRESHOLD", 1000))
+
+# Registry dataset holding the boundaries of each level
+BOUNDARY_DATASETS = {
+    "Census Tract ID": "tract_boundaries",
+    "City": "city_boundaries",
+    "County": "counties",
+    "State": "states",
+    "Tribe or Territory": "tt_shp",
+}
+
+# Level of each report level in the aggregates artifact
+AGGREGATE_LEVELS = {
+    "City": "city",
+    "County": "county",
+    "State": "state",
+    "Tribe or Territory": "tribe",
+}
+# Tract totals county_summary takes from the aggregates
+COUNTY_TOTALS = [
+    "tracts", "population", "dac_tracts", "qct_tracts",
+    "avg_energy_burden_natl_pctile"
+]
+
+# NHPD columns holding the boundary keys assigned at build time. Properties
+# of tribal areas are in the nhpd_index membership index instead.
+NHPD_KEYS = {
+    "County": "county_fips",
+    "State": "state_fips",
+}
+
+
+# Tract attributes locate_tracts returns for each point
+LOCATE_COLUMNS = [
+    "GEOID",
+    "city",
+    "county_name",
+    "DAC_status",
+    "QCT_status",
+    "avg_energy_burden_natl_pctile",
+    "tract_state_percentile",
+    "tract_national_percentile",
+]
+
+
+def load_boundary(level):
+    return registry.get(BOUNDARY_DATASETS[level])
+
+
+def select_shape(level, location):
+    """One-row boundary frame of a report location."""
+    if level == CUSTOM_AREA:
+        return custom_shape(location)
+    boundary = load_boundary(level)
+    return boundary.loc[boundary["NAME"] == location]
+
+
+def dac_selector(shape, level):
+    # The tract table is sorted by GEOID, so a tract, county or state is a
+    # slice of it; cities and tribal areas go through the membership index
+    # and custom areas through the spatial index
+    if level in GEOID_DIGITS:
+        # Tracts are keyed by their display name, which is their GEOID
+        key = shape["NAME" if level == "Census Tract ID" else "GEOID"].values[0]
+        return format_tracts(
+            read_tract_rows(registry.get("dac_ranges").span(level, key)))
+    if level == CUSTOM_AREA:
+        rows, fractions = registry.get("tract_tree").overlap(
+            shape.geometry.values[0])
+    else:
+        key = shape["NAME" if level == "City" else "GEOID"].values[0]
+        rows, fractions = registry.get("dac_index").lookup(level, key)
+    tracts = format_tracts(read_tract_rows(rows))
+    if level != "City":
+        # Share of each tract's area inside a tribal or custom area, which
+        # may cover only part of it
+        tracts["area_fraction"] = np.asarray(fractions,
+                                             dtype=np.float64).round(3)
+    return tracts
+
+
+def nhpd_selector(nhpd, shape, level, dac_select):
+    # Properties are sorted by tract GEOID and indexed by tribal area, so
+    # only boundaries without a key fall back to a spatial join
+    ranges = registry.get("nhpd_ranges")
+    if level in ("Census Tract ID", "City"):
+        rows = ranges.rows(dac_select["GEOID"].astype(np.int64).values)
+    elif level in GEOID_DIGITS and "GEOID" in shape.columns:
+        rows = ranges.span(level, shape["GEOID"].values[0])
+    elif level == "Tribe or Territory" and "GEOID" in shape.columns:
+        rows, _ = registry.get("nhpd_index").lookup(level,
+                                                    shape["GEOID"].values[0])
+    else:
+        rows = registry.get("nhpd_tree").intersecting(shape.geometry.values[0])
+    return format_housing(nhpd.iloc[rows])
+
+
+def locate_tracts(lons, lats):
+    """Tract of each point, as a frame of LOCATE_COLUMNS in the order of the
+    points, with empty rows for points outside every tract."""
+    rows = registry.get("tract_tree").locate(lons, lats)
+    found = np.flatnonzero(rows >= 0)
+    tracts = format_tracts(read_tract_rows(rows[found])[LOCATE_COLUMNS])
+    return tracts.set_axis(found).reindex(np.arange(len(rows)))
+
+
+def report_data_filter(dac_select, eb, dac_filter, qct_filter):
+    # Filter dac_select by energy burden percentile
+    dac_select = dac_select.loc[
+        (dac_select["avg_energy_burden_natl_pctile"] >= eb[0])
+        & (dac_select["avg_energy_burden_natl_pctile"] <= eb[1])]
+    if dac_filter:
+        # Filter dac_select by DAC status
+        dac_select = dac_select.loc[dac_select["DAC_status"] ==
+                                    "Disadvantaged"]
+    if qct_filter:
+        # Filter dac_select by QCT status
+        dac_select = dac_select.loc[dac_select["QCT_status"] == "Eligible"]
+    dac_select = dac_select.copy()
+    # Create a new column called "DAC_check" with a checkmark if the row has "DAC_status" == "Disadvantaged" and a cross if it doesn't
+    dac_select["DAC_check"] = np.where(
+        dac_select["DAC_status"] == "Disadvantaged", "Yes", "No")
+    # Create a new column called "QCT_check" with a checkmark if the row has "QCT_status" == "Eligible" and a cross if it doesn't
+    dac_select["QCT_check"] = np.where(dac_select["QCT_status"] == "Eligible",
+                                       "Yes", "No")
+    return dac_select
+
+
+def boundary_totals(level, shape):
+    """Precomputed summary figures of a whole boundary, as a row of the
+    aggregates artifact, or None for levels without them."""
+    if level not in AGGREGATE_LEVELS:
+        return None
+    key = shape["NAME" if level == "City" else "GEOID"].values[0]
+    try:
+        return registry.get("aggregates").loc[(AGGREGATE_LEVELS[level],
+                                               str(key))]
+    except KeyError:
+        return None
+
+
+def top_boundaries(level, column, n=10, ascending=False):
+    """The n boundaries of a level ranked by a column of the aggregates."""
+    boundaries = registry.get("aggregates").loc[AGGREGATE_LEVELS[level]]
+    return boundaries.sort_values(by=column,
+                                  ascending=ascending,
+                                  na_position="last").head(n)
+
+
+def aggregate_by_county(tracts):
+    # Same totals as the county rows of the aggregates artifact built by
+    # data/aggregates.py
+    return pd.DataFrame({
+        "county_fips": tracts["GEOID"].astype(np.int64).values // 10**6,
+        "population": tracts["population"].astype(np.float64).values,
+        "dac": (tracts["DAC_status"] == "Disadvantaged").values.astype(np.int32),
+        "qct": (tracts["QCT_status"] == "Eligible").values.astype(np.int32),
+        "energy_burden": tracts["avg_energy_burden_natl_pctile"].astype(
+            np.float64).values,
+    }).groupby("county_fips").agg(
+        tracts=("dac", "size"),
+        population=("population", "sum"),
+        dac_tracts=("dac", "sum"),
+        qct_tracts=("qct", "sum"),
+        avg_energy_burden_natl_pctile=("energy_burden", "mean"),
+    ).reset_index()
+
+
+def county_summary(dac_select, nhpd_select):
+    """Per-county totals of the selected tracts and housing, with the county
+    boundaries, as a GeoDataFrame."""
+    fips = np.unique(dac_select["GEOID"].astype(np.int64).values // 10**6)
+    aggregates = registry.get("aggregates").loc["county"]
+    totals = aggregates.reindex(format_geoid(fips, digits=5).values).dropna(
+        subset=["tracts"])
+    totals = pd.DataFrame({
+        "county_fips": totals.index.astype(np.int64),
+        **{column: totals[column].values for column in COUNTY_TOTALS},
+    }).astype({"tracts": np.int64, "dac_tracts": np.int64,
+               "qct_tracts": np.int64})
+    # The precomputed totals only describe selections made of whole counties
+    # (a state, say); anything else is totalled from its own tracts
+    if totals["tracts"].sum() != len(dac_select):
+        totals = aggregate_by_county(dac_select)
+    counties = registry.get("counties")
+    summary = pd.DataFrame({
+        "county_fips": counties["GEOID"].astype(np.int64).values,
+        "NAME": counties["NAME"].values,
+        "geometry": counties.geometry.values,
+    }).merge(totals, on="county_fips")
+    housing = nhpd_select.dropna(subset=["county_fips"])
+    housing = housing.groupby(housing["county_fips"].astype(np.int64)).agg(
+        properties=("Property Name", "size"),
+        assisted_units=("Assisted Units", "sum"))
+    summary = summary.join(housing, on="county_fips")
+    summary[["properties", "assisted_units"]] = summary[[
+        "properties", "assisted_units"
+    ]].fillna(0)
+    summary = summary.sort_values(by="avg_energy_burden_natl_pctile",
+                                  ascending=False).reset_index(drop=True)
+    return gpd.GeoDataFrame(summary, geometry="geometry", crs=counties.crs)
@@ -0,0 +1,232 @@
+# Runs report generation (selection, map image, PDF) on a bounded pool of
+# background workers instead of inside the Streamlit script, so a long
+# state-level report neither blocks its session's script thread nor holds more
+# than one worker. Identical requests share one job, jobs report the stage
+# they are in so the page can poll them, and a job is cancelled once no
+# session is waiting for it any more.
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import reportcache
+from pdfreport import generate_pdf
+from reportdata import (DETAIL_THRESHOLD, boundary_totals, county_summary,
+                        dac_selector, nhpd_selector, report_data_filter,
+                        select_shape)
+from reportmap import build_county_map, build_map, map_image
+from datastore import registry
+
+# Finished jobs are kept this long so reruns and other sessions asking for the
+# same report get the result without generating it again
+RETENTION_SECONDS = 600
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class ReportJob:
+
+    def __init__(self, request):
+        self.request = request
+        self.id = hashlib.sha1(repr(request).encode()).hexdigest()[:16]
+        self.status = "queued"
+        self.stage = "Waiting for a free worker"
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        # Number of sessions waiting for this job
+        self.subscribers = 0
+        self.cancelled = threading.Event()
+        self.future = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def set_stage(self, stage, progress):
+        # Called by the worker between steps, which are the points where a
+        # cancelled job stops
+        if self.cancelled.is_set():
+            raise JobCancelled()
+        self.stage = stage
+        self.progress = progress
+
+
+def select_report(level, location):
+    """Boundary, tracts and housing of a report."""
+    shape = select_shape(level, location)
+    dac_select = dac_selector(shape, level)
+    nhpd_select = nhpd_selector(registry.get("nhpd"), shape, level,
+                                dac_select)
+    return shape, dac_select, nhpd_select
+
+
+def is_summary(dac_select, full_detail):
+    # Very large selections are mapped and reported as county totals
+    return not full_detail and len(dac_select) > DETAIL_THRESHOLD
+
+
+def report_map(shape, dac_select, nhpd_select, summary):
+    if summary:
+        return build_county_map(shape, county_summary(dac_select, nhpd_select))
+    return build_map(shape, dac_select)
+
+
+def report_pdf(level, shape, png, dac_select, nhpd_select, eb, dac_filter,
+               qct_filter, cover_page, include_nhpd, detailed, summary):
+    report_select = report_data_filter(dac_select, eb, dac_filter,
+                                       qct_filter)
+    counties = None
+    if summary:
+        counties = county_summary(report_select, nhpd_select)
+    totals = None
+    if tuple(eb) == (0, 100) and not dac_filter and not qct_filter:
+        # Unfiltered, the report covers the whole boundary, whose cover page
+        # figures were totalled at build time. The energy burden range still
+        # drops tracts without the indicator, so only use them when every
+        # tract of the boundary is in the report.
+        totals = boundary_totals(level, shape)
+        if totals is not None and len(report_select) != totals["tracts"]:
+            totals = None
+    return generate_pdf(shape,
+                        png,
+                        report_select,
+                        nhpd_select,
+                        cover_page,
+                        include_nhpd,
+                        detailed=detailed,
+                        county_summary=counties,
+                        totals=totals)
+
+
+def build_report(job, level, location, eb, dac_filter, qct_filter, cover_page,
+                 include_nhpd, detailed, full_detail):
+    job.set_stage("Selecting census tracts and housing", 0.1)
+    shape, dac_select, nhpd_select = select_report(level, location)
+    summary = is_summary(dac_select, full_detail)
+    result = {
+        "shape": shape,
+        "dac_select": dac_select,
+        "nhpd_select": nhpd_select,
+        "summary": summary,
+        "fig": None,
+        "png": None,
+        "pdf": None,
+    }
+    if dac_select.empty and nhpd_select.empty:
+        return result
+    key = reportcache.cache_key(job.request)
+    if not dac_select.empty:
+        # Looked up before any drawing: a hit carries the map figure too
+        cached = reportcache.get(key)
+        if cached is not None:
+            result.update(cached)
+            return result
+    job.set_stage("Rendering map", 0.4)
+    result["fig"] = report_map(shape, dac_select, nhpd_select, summary)
+    result["png"] = map_image(result["fig"])
+    if dac_select.empty:
+        return result
+    job.set_stage("Building report", 0.7)
+    result["pdf"] = report_pdf(level, shape, result["png"], dac_select,
+                               nhpd_select, eb, dac_filter, qct_filter,
+                               cover_page, include_nhpd, detailed, summary)
+    reportcache.put(key, result["fig"], result["png"], result["pdf"])
+    return result
+
+
+class ReportJobQueue:
+    """Bounded pool of report workers shared by every session.
+
+    submit() returns the job for a request, reusing a queued, running or
+    recently finished job for the same request. Each submit() subscribes the
+    caller to the job and cancel() unsubscribes it; the job is only cancelled
+    when its last subscriber leaves.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers,
+                                        thread_name_prefix="report")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, request):
+        with self._lock:
+            self._prune()
+            job = ReportJob(request)
+            existing = self._jobs.get(job.id)
+            # A job being cancelled still reads "running" until its worker
+            # reaches the next stage, so it is replaced rather than joined
+            if (existing is not None
+                    and existing.status not in ("failed", "cancelled")
+                    and not existing.cancelled.is_set()):
+                existing.subscribers += 1
+                return existing
+            job.subscribers = 1
+            self._jobs[job.id] = job
+            job.future = self._pool.submit(self._run, job)
+            return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return
+            job.subscribers -= 1
+            if job.subscribers > 0:
+                return
+            job.cancelled.set()
+            # A job that has not started yet never takes a worker
+            if job.future.cancel():
+                self._finish(job, "cancelled")
+
+    def _run(self, job):
+        try:
+            if job.cancelled.is_set():
+                raise JobCancelled()
+            job.status = "running"
+            job.result = build_report(job, *job.request)
+            job.set_stage("Done", 1.0)
+            status = "done"
+        except JobCancelled:
+            job.result = None
+            status = "cancelled"
+        except Exception as e:
+            logging.exception("Report job %s for %r failed", job.id,
+                              job.request[:2])
+            job.error = e
+            status = "failed"
+        with self._lock:
+            self._finish(job, status)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.monotonic()
+
+    def _prune(self):
+        now = time.monotonic()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished_at > RETENTION_SECONDS:
+                del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            status: statuses.count(status)
+            for status in ("queued", "running", "done", "failed", "cancelled")
+        }
+
+
+queue = ReportJobQueue(workers=int(os.environ.get("REPORT_WORKERS", 2)))
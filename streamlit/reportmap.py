@@ -0,0 +1,209 @@
+# Builds the report map figure and renders it to PNG. Kept free of Streamlit
+# calls so the figure can be built inside a background report job; the page
+# only draws the finished figure.
+
+import base64
+from functools import lru_cache
+
+import geopandas as gpd
+import numpy as np
+import plotly.express as px
+
+from datastore import registry
+from mapbounds import (VIEWPORT_COLUMNS, cluster_column, cluster_zoom,
+                       geometry_tier, simplify_for_zoom, viewports,
+                       zoom_center)
+
+# Housing is drawn one labelled marker per property up to this many
+# properties, or from this map zoom on, and as clusters otherwise
+MAX_MARKERS = 200
+INDIVIDUAL_ZOOM = 13
+
+
+@lru_cache(maxsize=1)
+def legend_base64():
+    with open("legend.png", "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8')
+
+
+def shape_viewport(shape):
+    # Boundaries carry a viewport precomputed at build time; anything else
+    # (or a selection of several rows) is fitted from geometry bounds only
+    if len(shape) == 1 and set(VIEWPORT_COLUMNS) <= set(shape.columns):
+        zoom, lon, lat = shape[VIEWPORT_COLUMNS].to_numpy(np.float64)[0]
+        if not np.isnan(zoom):
+            return float(zoom), {"lon": float(lon), "lat": float(lat)}
+    if len(shape) == 1:
+        zooms, centers = viewports(shape.geometry)
+        if not np.isnan(zooms[0]):
+            return float(zooms[0]), {
+                "lon": float(centers[0, 0]),
+                "lat": float(centers[0, 1])
+            }
+    return zoom_center(geoms=shape.geometry)
+
+
+def tract_geometry(dac_select, zoom):
+    # The index of dac_select holds row positions in the national tract
+    # table, which every simplified tier shares
+    tier = registry.get(f"dac_{geometry_tier(zoom)}")
+    return gpd.GeoSeries(tier.geometry.values[dac_select.index.values],
+                         index=dac_select.index,
+                         crs=tier.crs)
+
+
+def style_map(fig, outline):
+    fig.update_layout(margin=dict(l=20, r=20, t=0, b=0),
+                      mapbox={
+                          "style":
+                          "carto-positron",
+                          "layers": [
+                              {
+                                  "source": outline.__geo_interface__,
+                                  "type": "line",
+                                  "color": "gray",
+                                  "line": {
+                                      "width": 3
+                                  },
+                                  "below": "traces",
+                              },
+                          ],
+                      })
+
+    fig.update_geos(fitbounds="geojson", visible=False)
+
+
+def build_map(shape, dac_select):
+    zoom, center = shape_viewport(shape)
+    zoom = 0.8 * zoom
+    # Only as much detail as the zoom can show goes to the browser
+    outline = gpd.GeoSeries(simplify_for_zoom(shape.geometry, zoom),
+                            crs=shape.crs)
+    disadvantaged = (dac_select["DAC_status"] == "Disadvantaged").values
+    colors = ["red" if d else "black" for d in disadvantaged]
+    stroke_width = [5 if d else 0 for d in disadvantaged]
+
+    fig = px.choropleth_mapbox(
+        dac_select,
+        geojson=tract_geometry(dac_select, zoom),
+        locations=dac_select.index,
+        color="avg_energy_burden_natl_pctile",
+        color_continuous_scale="ylorbr",
+        mapbox_style="carto-positron",
+        zoom=zoom,
+        center=center,
+        labels={
+            "avg_energy_burden_natl_pctile": "Energy Burden Percentile",
+            "GEOID": "Census Tract ID",
+            "QCT_status": "Housing Tax Credit Status"
+        },
+        hover_data={
+            "GEOID": True,
+            "avg_energy_burden_natl_pctile": True,
+            "QCT_status": True
+        },
+        hover_name="DAC_status",
+    )
+    style_map(fig, outline)
+    fig.update_traces(
+        marker_line_color=colors,
+        marker_line_width=stroke_width,
+        marker_opacity=0.5,
+    )
+    return fig
+
+
+def build_county_map(shape, counties):
+    # Map of a very large selection: one shape per county, from the totals of
+    # reportdata.county_summary, instead of every tract
+    zoom, center = shape_viewport(shape)
+    zoom = 0.8 * zoom
+    outline = gpd.GeoSeries(simplify_for_zoom(shape.geometry, zoom),
+                            crs=shape.crs)
+    geometry = gpd.GeoSeries(simplify_for_zoom(counties.geometry, zoom),
+                             index=counties.index,
+                             crs=counties.crs)
+    fig = px.choropleth_mapbox(
+        counties,
+        geojson=geometry,
+        locations=counties.index,
+        color="avg_energy_burden_natl_pctile",
+        color_continuous_scale="ylorbr",
+        mapbox_style="carto-positron",
+        zoom=zoom,
+        center=center,
+        labels={
+            "avg_energy_burden_natl_pctile": "Avg. Energy Burden Percentile",
+            "tracts": "Census Tracts",
+            "dac_tracts": "Disadvantaged Tracts",
+            "qct_tracts": "Housing Tax Credit Eligible Tracts",
+            "properties": "Affordable Housing Properties",
+        },
+        hover_data={
+            "avg_energy_burden_natl_pctile": ":.2f",
+            "tracts": True,
+            "dac_tracts": True,
+            "qct_tracts": True,
+            "properties": True,
+        },
+        hover_name="NAME",
+    )
+    style_map(fig, outline)
+    fig.update_traces(marker_line_color="gray",
+                      marker_line_width=1,
+                      marker_opacity=0.5)
+    return fig
+
+
+def map_image(fig):
+    # PNG bytes for the report. Kept in memory so concurrent sessions never
+    # share a file.
+    return fig.to_image(format="png")
+
+
+def add_housing(fig, nhpd_select):
+    # Housing markers are only drawn on the interactive map, not the report.
+    # Few properties, or a map zoomed in past the last clustering zoom, get a
+    # labelled marker each; otherwise properties are grouped by the cluster
+    # cells assigned at build time into one marker per cell.
+    if nhpd_select.empty:
+        return fig
+    zoom = fig.layout.mapbox.zoom or 0
+    column = cluster_column(cluster_zoom(zoom))
+    if (len(nhpd_select) <= MAX_MARKERS or zoom >= INDIVIDUAL_ZOOM
+            or column not in nhpd_select.columns):
+        fig.add_scattermapbox(
+            lat=nhpd_select.lat,
+            lon=nhpd_select.lon,
+            mode="markers+text",
+            marker_size=10,
+            marker_color="black",
+            opacity=0.5,
+            text=[i for i in nhpd_select["Property Name"].values],
+        )
+        return fig
+    clusters = nhpd_select.groupby(column).agg(
+        properties=("lat", "size"),
+        assisted_units=("Assisted Units", "sum"),
+        lat=("lat", "mean"),
+        lon=("lon", "mean"),
+        name=("Property Name", "first"))
+    properties = clusters["properties"].values
+    # A cell holding a single property is hovered like an individual marker
+    hovertext = (clusters["properties"].astype(str) + " properties, " +
+                 clusters["assisted_units"].round().astype(np.int64).astype(str)
+                 + " assisted units").where(properties > 1,
+                                            clusters["name"].astype(str))
+    fig.add_scattermapbox(
+        lat=clusters["lat"],
+        lon=clusters["lon"],
+        mode="markers+text",
+        marker_size=np.minimum(10 + 4 * np.sqrt(properties - 1), 40),
+        marker_color="black",
+        opacity=0.5,
+        text=np.where(properties > 1, properties.astype(str), ""),
+        textfont_color="white",
+        hovertext=hovertext.values,
+        hoverinfo="text",
+    )
+    return fig
@@ -0,0 +1,142 @@
+# Location search for the Report page. The data/ build writes every tract ID,
+# city, county, state and tribal area name as a sorted array of normalized
+# search keys (search_index.parquet); a query is a handful of binary searches
+# for the keys starting with it, so the page can suggest matches as the user
+# types instead of sending every boundary name to the browser.
+#
+# Names are normalized into keys by equity_common.searchkeys, which the
+# data/ build uses too.
+
+import sys
+
+import numpy as np
+
+from equity_common.searchkeys import SEARCH_LEVELS, normalize
+
+# Characters normalized keys are made of, used to spell typo variants
+ALPHABET = "abcdefghijklmnopqrstuvwxyz0123456789 "
+# Queries shorter than this only match exactly, one character off is too
+# loose for them
+MIN_TYPO_LENGTH = 3
+# Entries read from each matching range. Ranges are in key order, so this
+# keeps a one-letter query from walking every name that starts with it
+RANGE_ENTRIES = 50
+# Sorts after every character a key can hold
+KEY_END = b"\x7f"
+# Bytes of a stored key: the level digit, a separator and the first 30
+# characters of the normalized key. Queries are compared on their first 29
+# characters (the range end needs one more byte), which is longer than
+# nearly every county, city and tribal area name. A longer query matches
+# every name sharing those characters, and later words of long names have
+# their own keys. Raising it costs len(keys) bytes of memory per byte.
+KEY_LENGTH = 32
+
+
+def typo_variants(text):
+    """Every spelling one deletion, transposition, substitution or insertion
+    away from text."""
+    splits = [(text[:i], text[i:]) for i in range(len(text) + 1)]
+    variants = {left + right[1:] for left, right in splits if right}
+    variants |= {
+        left + right[1] + right[0] + right[2:]
+        for left, right in splits if len(right) > 1
+    }
+    variants |= {
+        left + c + right[1:]
+        for left, right in splits if right for c in ALPHABET
+    }
+    variants |= {left + c + right for left, right in splits for c in ALPHABET}
+    return list({variant.strip() for variant in variants} - {"", text})
+
+
+class SearchIndex:
+    """Sorted "level\\0key" array of every searchable name.
+
+    All keys starting with a prefix form one contiguous range, found with
+    two binary searches. Looking up a query and every spelling one typo
+    away is a single vectorized searchsorted over the variants.
+    """
+
+    def __init__(self, entries):
+        # Levels are stored as one digit, their position in SEARCH_LEVELS,
+        # and keys as fixed width bytes, which numpy compares much faster
+        # than Python strings
+        codes = entries["level"].map(
+            {level: str(code) for code, level in enumerate(SEARCH_LEVELS)})
+        keys = (codes + "\0" + entries["key"].astype(str)).values.astype(
+            f"S{KEY_LENGTH}")
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.names = entries["name"].astype(str).values.astype(object)[order]
+        self.words = entries["word"].values.astype(np.int8)[order]
+
+    def _ranges(self, prefixes, levels):
+        # Needles are cut one byte short of the key width so the range end
+        # still fits it; comparing arrays of different widths would copy
+        # the whole key array
+        needles = [
+            f"{SEARCH_LEVELS.index(level)}\0{prefix}".encode()[:KEY_LENGTH - 1]
+            for level in levels for prefix in prefixes
+        ]
+        dtype = self.keys.dtype
+        starts = np.searchsorted(self.keys,
+                                 np.array(needles, dtype=dtype),
+                                 side="left")
+        stops = np.searchsorted(self.keys,
+                                np.array([n + KEY_END for n in needles],
+                                         dtype=dtype),
+                                side="left")
+        counts = np.minimum(stops - starts, RANGE_ENTRIES)
+        # Positions of the first entries of every range, in needle order
+        offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        return np.repeat(starts, counts) + offsets
+
+    def search(self, query, level=None, limit=10):
+        """Names of up to limit boundaries matching query, best first.
+
+        Names starting with the query come first, then names with a later
+        word starting with it, then names that match with one typo.
+        """
+        text = normalize(query)
+        if not text:
+            return []
+        levels = [level] if level is not None else SEARCH_LEVELS
+        positions = self._ranges([text], levels)
+        # Whole-name matches before later-word matches, in key order
+        positions = positions[np.argsort(self.words[positions], kind="stable")]
+        matches = list(dict.fromkeys(self.names[positions]))
+        if len(matches) < limit and len(text) >= MIN_TYPO_LENGTH:
+            # Longer variants first: dropping a letter leaves a shorter
+            # prefix that matches far more names than the one meant
+            variants = sorted(sorted(typo_variants(text[:KEY_LENGTH - 2])),
+                              key=len,
+                              reverse=True)
+            positions = self._ranges(variants, levels)
+            positions = positions[np.argsort(self.words[positions],
+                                             kind="stable")]
+            matches = list(dict.fromkeys([*matches, *self.names[positions]]))
+        return matches[:limit]
+
+    def _whole_names(self, level):
+        # Positions of the keys spelling a whole name of level, in key order
+        needle = f"{SEARCH_LEVELS.index(level)}\0".encode()
+        start, stop = np.searchsorted(
+            self.keys, np.array([needle, needle + KEY_END],
+                                dtype=self.keys.dtype))
+        return start + np.flatnonzero(self.words[start:stop] == 0)
+
+    def names_of(self, level, limit, start=0):
+        """limit names of a level in key order from the start-th on, to page
+        through every name when there is no query."""
+        positions = self._whole_names(level)[start:start + limit]
+        return list(dict.fromkeys(self.names[positions]))
+
+    def count_of(self, level):
+        """Number of names of a level."""
+        return len(self._whole_names(level))
+
+    @property
+    def nbytes(self):
+        return (sum(sys.getsizeof(name) for name in set(self.names)) +
+                self.keys.nbytes + self.names.nbytes + self.words.nbytes)
@@ -0,0 +1,141 @@
+# Spatial queries against the national tract and housing layers for areas
+# that have no precomputed key (a user's GeoJSON polygon or a radius around a
+# point) and for the tract of bulk building coordinates. The STRtree of each
+# layer is built once per process and shared through the data registry, so a
+# query only tests the exact geometry of the few candidates whose bounding
+# boxes overlap the area.
+
+import json
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.geometry import Point, shape as geojson_shape
+
+# Report level of areas defined by the user
+CUSTOM_AREA = "Custom Area"
+# Geographic CRS of the report artifacts
+CRS = "EPSG:4269"
+# Equal-area projection the overlap fractions are measured in
+AREA_CRS = "EPSG:6933"
+METERS_PER_MILE = 1609.344
+
+
+class SpatialIndex:
+    """STRtree over the geometries of one layer, by row position.
+
+    Queries prepare the area once and let the tree prefilter candidates by
+    bounding box before the exact predicate runs.
+    """
+
+    def __init__(self, frame):
+        self.crs = frame.crs
+        self.geometries = frame.geometry.values.to_numpy()
+        self.tree = shapely.STRtree(self.geometries)
+
+    def intersecting(self, area):
+        """Sorted row positions of the geometries intersecting area."""
+        shapely.prepare(area)
+        return np.sort(self.tree.query(area, predicate="intersects"))
+
+    def overlap(self, area):
+        """(rows, fractions) of the polygons sharing area with area, where
+        fractions is the share of each polygon's own area inside it."""
+        rows = self.intersecting(area)
+        # Only the candidates are projected, never the whole layer
+        polygons = gpd.GeoSeries(self.geometries[rows],
+                                 crs=self.crs).to_crs(AREA_CRS)
+        inside = gpd.GeoSeries([area], crs=self.crs).to_crs(AREA_CRS).iloc[0]
+        shapely.prepare(inside)
+        total = polygons.area.values
+        shared = polygons.intersection(inside).area.values
+        fractions = np.divide(shared,
+                              total,
+                              out=np.zeros_like(shared),
+                              where=total > 0)
+        # Polygons that only touch the edge of the area are not in it
+        keep = fractions > 0
+        return rows[keep], np.clip(fractions[keep], 0, 1)
+
+    def locate(self, lons, lats):
+        """Row position of the polygon holding each point, -1 for points in
+        none, for whole arrays of coordinates at once."""
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        # Bounding box candidates from the tree, then one vectorized exact
+        # test of every (point, candidate) pair
+        points, rows = self.tree.query(shapely.points(lons, lats))
+        inside = shapely.intersects_xy(self.geometries[rows], lons[points],
+                                       lats[points])
+        points, rows = points[inside], rows[inside]
+        # A point on a shared edge is in both polygons; the first row wins
+        order = np.lexsort((rows, points))
+        points, rows = points[order], rows[order]
+        first = np.ones(len(points), dtype=bool)
+        first[1:] = points[1:] != points[:-1]
+        located = np.full(len(lons), -1, dtype=np.int64)
+        located[points[first]] = rows[first]
+        return located
+
+    @property
+    def tree_nbytes(self):
+        # A box per geometry; the geometries may be shared with a frame
+        return len(self.geometries) * 48
+
+    @property
+    def nbytes(self):
+        # Coordinates dominate
+        return int(shapely.get_num_coordinates(self.geometries).sum() * 16 +
+                   self.tree_nbytes)
+
+
+def point_area(lon, lat, radius_miles):
+    """Custom area location of a circle of radius_miles around a point."""
+    # Buffered in an azimuthal equidistant projection centred on the point,
+    # so the radius is a true ground distance at any latitude
+    local = f"+proj=aeqd +lat_0={lat} +lon_0={lon} +units=m"
+    circle = gpd.GeoSeries([Point(lon, lat)], crs=CRS).to_crs(local).buffer(
+        radius_miles * METERS_PER_MILE, quad_segs=16).to_crs(CRS).iloc[0]
+    name = f"{radius_miles:g} miles around {lat:.4f}, {lon:.4f}"
+    return area_location(name, circle)
+
+
+def geojson_area(text, name):
+    """Custom area location of the polygons of a GeoJSON document (a
+    geometry, a feature or a feature collection). Raises ValueError when it
+    holds no polygon."""
+    document = json.loads(text)
+    if document.get("type") == "FeatureCollection":
+        geometries = [feature["geometry"] for feature in document["features"]]
+    elif document.get("type") == "Feature":
+        geometries = [document["geometry"]]
+    else:
+        geometries = [document]
+    polygons = [
+        shapely.make_valid(geojson_shape(geometry)) for geometry in geometries
+        if geometry and geometry.get("type") in ("Polygon", "MultiPolygon")
+    ]
+    if not polygons:
+        raise ValueError("The GeoJSON file has no polygons.")
+    return area_location(name, shapely.union_all(polygons))
+
+
+def area_location(name, geometry):
+    # A custom area travels in the report request as text, which keeps
+    # requests hashable and gives each area its own report cache key
+    return json.dumps({
+        "name": name,
+        "geometry": shapely.to_geojson(shapely.set_precision(geometry, 1e-6)),
+    })
+
+
+def area_name(location):
+    return json.loads(location)["name"]
+
+
+def custom_shape(location):
+    """One-row boundary frame of a custom area location."""
+    area = json.loads(location)
+    return gpd.GeoDataFrame({"NAME": [area["name"]]},
+                            geometry=[shapely.from_geojson(area["geometry"])],
+                            crs=CRS)
@@ -0,0 +1,6 @@
+# The app modules import each other by bare name, the way Streamlit runs them
+# from the streamlit/ directory
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,112 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from datastore import format_housing, format_tracts
+from pdfreport import cover_totals
+from reportdata import report_data_filter
+
+BUILD_SCRIPT = os.path.join(os.path.dirname(__file__), "..", "..", "data",
+                            "aggregates.py")
+
+# Two counties of state 01 and one of state 02. The last tract of 01001 has
+# no energy burden.
+TRACTS = pd.DataFrame({
+    "GEOID": np.array([1001020100, 1001020200, 1001020300, 1003010100,
+                       2001000100], dtype=np.int64),
+    "city": ["Alpha", "Alpha", None, "Beta", None],
+    "county_name": ["Autauga County", "Autauga County", "Autauga County",
+                    "Baldwin County", "Aleutians County"],
+    "population": [1000, 3000, 2000, 500, 800],
+    "DAC_status": ["Disadvantaged", "Not Disadvantaged", "Disadvantaged",
+                   "Disadvantaged", "Not Disadvantaged"],
+    "QCT_status": ["Eligible", "Eligible", "Not Eligible", "Not Eligible",
+                   "Eligible"],
+    "avg_energy_burden_natl_pctile": np.array([12.345, 80.0, np.nan, 55.5,
+                                               40.0], dtype=np.float32),
+    "nonwhite_pct_natl_pctile": np.array([10.0, 20.0, 30.0, 40.5, 50.0],
+                                         dtype=np.float32),
+})
+# Tribal area 0100 covers half of one tract and the whole of another
+TRIBE_TRACTS = pd.DataFrame({
+    "level": "tribe",
+    "key": ["0100", "0100"],
+    "row": np.array([1, 3], dtype=np.int64),
+    "fraction": [0.5, 1.0],
+})
+HOUSING = pd.DataFrame({
+    "tract_geoid": pd.array([1001020100, 1001020100, 1003010100, None],
+                            dtype="Int64"),
+    "county_fips": [1001.0, 1001.0, 1003.0, 2001.0],
+    "state_fips": [1.0, 1.0, 1.0, 2.0],
+    "Assisted Units": np.array([10, 25, 40, 7], dtype=np.float32),
+})
+TRIBE_HOUSING = pd.DataFrame({
+    "level": "tribe",
+    "key": ["0100"],
+    "row": np.array([2], dtype=np.int64),
+})
+
+
+@pytest.fixture(scope="module")
+def aggregates(tmp_path_factory):
+    build = tmp_path_factory.mktemp("build")
+    report_data = build / "report_data"
+    report_data.mkdir()
+    TRACTS.to_parquet(report_data / "dac.parquet")
+    TRIBE_TRACTS.to_parquet(report_data / "dac_index.parquet")
+    HOUSING.to_parquet(report_data / "nhpd.parquet")
+    TRIBE_HOUSING.to_parquet(report_data / "nhpd_index.parquet")
+    pd.DataFrame({"GEOID": ["01", "02"], "NAME": ["One", "Two"]}).to_parquet(
+        report_data / "states.parquet")
+    pd.DataFrame({
+        "GEOID": ["01001", "01003", "02001"],
+        "NAME": ["Autauga", "Baldwin", "Aleutians"],
+    }).to_parquet(report_data / "counties.parquet")
+    pd.DataFrame({"GEOID": ["0100"], "NAME": ["Nation"]}).to_parquet(
+        report_data / "tt_shp.parquet")
+    subprocess.run([sys.executable, BUILD_SCRIPT], cwd=build, check=True,
+                   capture_output=True)
+    return pd.read_parquet(report_data / "aggregates.parquet").set_index(
+        ["level", "key"])
+
+
+@pytest.mark.parametrize("level, key, tracts, properties", [
+    ("state", "01", [0, 1, 2, 3], [0, 1, 2]),
+    ("state", "02", [4], [3]),
+    ("county", "01001", [0, 1, 2], [0, 1]),
+    ("county", "01003", [3], [2]),
+    ("city", "Alpha (Autauga County)", [0, 1], [0, 1]),
+    ("tribe", "0100", [1, 3], [2]),
+])
+def test_cube_matches_the_report_cover_page(aggregates, level, key, tracts,
+                                            properties):
+    row = aggregates.loc[(level, key)]
+    expected = cover_totals(format_tracts(TRACTS.iloc[tracts].copy()),
+                            format_housing(HOUSING.iloc[properties]))
+    assert row["tracts"] == len(tracts)
+    for column in ["dac_tracts", "qct_tracts", "properties",
+                   "assisted_units"]:
+        assert row[column] == expected[column], column
+    for column in ["avg_energy_burden_natl_pctile",
+                   "avg_nonwhite_pct_natl_pctile"]:
+        assert row[column] == pytest.approx(expected[column]), column
+
+
+def test_cube_weights_tribal_population_by_area(aggregates):
+    row = aggregates.loc[("tribe", "0100")]
+    assert row["population"] == pytest.approx(0.5 * 3000 + 500)
+    assert row["dac_population"] == pytest.approx(500)
+    assert row["NAME"] == "Nation"
+
+
+def test_unfiltered_report_drops_tracts_without_energy_burden(aggregates):
+    # Why the cover page only uses the cube when the tract counts agree
+    report = report_data_filter(format_tracts(TRACTS.iloc[[0, 1, 2]].copy()),
+                                (0, 100), False, False)
+    assert len(report) == 2
+    assert aggregates.loc[("county", "01001"), "tracts"] == 3
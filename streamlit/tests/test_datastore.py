@@ -0,0 +1,161 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+import datastore
+from datastore import (DataRegistry, GeoidRangeIndex, MembershipIndex,
+                       format_tracts)
+from spatial import SpatialIndex
+
+# Sorted int64 tract GEOIDs, as stored in the artifacts. The second tract
+# holds two rows, like a tract with two properties in the housing table.
+GEOIDS = [
+    1001020100,
+    1001020200,
+    1001020200,
+    1003010100,
+    6001400100,
+    6001400200,
+]
+
+
+def test_span_selects_the_rows_of_a_boundary():
+    index = GeoidRangeIndex(GEOIDS)
+    assert index.span("State", "01") == slice(0, 4)
+    assert index.span("State", "06") == slice(4, 6)
+    assert index.span("County", "01001") == slice(0, 3)
+    assert index.span("County", "01003") == slice(3, 4)
+    assert index.span("Census Tract ID", "01001020200") == slice(1, 3)
+
+
+def test_span_of_a_boundary_without_rows_is_empty():
+    index = GeoidRangeIndex(GEOIDS)
+    for level, key in [("State", "02"), ("County", "01002"),
+                       ("Census Tract ID", "06001400300")]:
+        span = index.span(level, key)
+        assert span.start == span.stop
+
+
+def test_rows_keeps_the_order_of_the_tracts_asked_for():
+    index = GeoidRangeIndex(GEOIDS)
+    rows = index.rows([6001400200, 1001020200, 1003010100])
+    assert rows.tolist() == [5, 1, 2, 3]
+    assert index.rows([9999999999]).tolist() == []
+    assert index.rows([]).tolist() == []
+
+
+def test_rows_without_a_tract_sort_last_and_are_ignored():
+    # Properties outside every tract have a null GEOID
+    index = GeoidRangeIndex(pd.Series([*GEOIDS, None, None], dtype="Int64"))
+    assert index.span("State", "06") == slice(4, 6)
+    assert index.rows([6001400200]).tolist() == [5]
+    assert index.nbytes == len(GEOIDS) * 8
+
+
+def test_membership_index_lookup():
+    index = MembershipIndex(
+        pd.DataFrame({
+            "level": ["tribe", "city", "tribe", "tribe"],
+            "key": ["0100", "Boston (Suffolk County)", "0200", "0100"],
+            "row": [3, 0, 1, 5],
+            "fraction": [0.5, 1.0, 1.0, 0.25],
+        }))
+    rows, fractions = index.lookup("Tribe or Territory", "0100")
+    assert rows.tolist() == [3, 5]
+    assert fractions.tolist() == [0.5, 0.25]
+    rows, _ = index.lookup("City", "Boston (Suffolk County)")
+    assert rows.tolist() == [0]
+    rows, _ = index.lookup("Tribe or Territory", "0300")
+    assert rows.tolist() == []
+
+
+def test_membership_index_without_fractions_counts_rows_whole():
+    index = MembershipIndex(
+        pd.DataFrame({
+            "level": ["tribe", "tribe"],
+            "key": ["0100", "0100"],
+            "row": [2, 7],
+        }))
+    rows, fractions = index.lookup("Tribe or Territory", "0100")
+    assert rows.tolist() == [2, 7]
+    assert np.all(fractions == 1)
+
+
+def test_registry_shares_geometry_and_evicts_it_together(monkeypatch):
+    sizes = {"tracts": 60, "tree": 10, "other": 50}
+    monkeypatch.setattr(datastore, "dataset_size",
+                        lambda name, dataset: sizes[name])
+    tracts = gpd.GeoDataFrame(
+        geometry=[shapely.box(i, 0, i + 1, 1) for i in range(3)],
+        crs="EPSG:4269")
+    store = DataRegistry(
+        {
+            "tracts": lambda: tracts,
+            "tree": lambda: SpatialIndex(store.get("tracts")),
+            "other": lambda: "other",
+        },
+        budget_bytes=100,
+        shared={"tree": "tracts"})
+    tree = store.get("tree")
+    # The tree holds the frame's geometry objects, not copies
+    assert all(a is b for a, b in zip(tree.geometries, tracts.geometry.values))
+    assert store.peek("tracts") is tracts
+    # Over budget: the least recently used frame goes, and the tree with it
+    store.get("other")
+    assert store.peek("tracts") is None
+    assert store.peek("tree") is None
+    assert store.stats().loc["tree", "evictions"] == 1
+
+
+def test_dataset_size_counts_shared_geometry_once():
+    tracts = gpd.GeoDataFrame(
+        geometry=[shapely.box(i, 0, i + 1, 1) for i in range(3)],
+        crs="EPSG:4269")
+    tree = SpatialIndex(tracts)
+    assert datastore.dataset_size("tract_tree", tree) == tree.tree_nbytes
+    assert tree.nbytes > tree.tree_nbytes
+
+
+def test_data_version_changes_with_every_artifact(tmp_path, monkeypatch):
+    monkeypatch.setattr(datastore, "REPORT_DATA", str(tmp_path))
+
+    def build(changed=None):
+        for name in datastore.ARTIFACTS:
+            sha256 = "new" if name == changed else "old"
+            (tmp_path / f"{name}.meta.json").write_text(
+                f'{{"schema_version": {datastore.SCHEMA_VERSION}, '
+                f'"sha256": "{sha256}"}}')
+        return datastore.data_version()
+
+    baseline = build()
+    for name in ["dac_low", "dac_mid", "dac_high", "search_index"]:
+        assert build(changed=name) != baseline, name
+
+
+def test_format_tracts_turns_missing_indicators_into_nan():
+    tracts = pd.DataFrame({
+        "GEOID": np.array([1001020100, 6001400100], dtype=np.int64),
+        "DAC_indicator": pd.array([1, pd.NA], dtype="Int8"),
+        "avg_energy_burden_natl_pctile": np.array([12.345, np.nan],
+                                                  dtype=np.float32),
+    })
+    formatted = format_tracts(tracts)
+    assert formatted["GEOID"].tolist() == ["01001020100", "06001400100"]
+    assert formatted["DAC_indicator"].dtype == np.float64
+    assert formatted["DAC_indicator"].iloc[0] == 1
+    assert np.isnan(formatted["DAC_indicator"].iloc[1])
+    assert formatted["avg_energy_burden_natl_pctile"].iloc[0] == 12.35
+
+
+def test_pinned_datasets_outlive_the_budget(monkeypatch):
+    monkeypatch.setattr(datastore, "dataset_size", lambda name, dataset: 60)
+    store = DataRegistry({name: lambda name=name: name for name in "abc"},
+                         budget_bytes=100)
+    store.pin("a")
+    store.get("b")
+    store.get("c")
+    # b was evicted, the older but pinned a was not
+    assert store.peek("a") == "a"
+    assert store.peek("b") is None
+    assert store.peek("c") == "c"
@@ -0,0 +1,84 @@
+import re
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from pdfreport import INDICATORS, PDF, generate_pdf
+
+# Tracts in Alabama and California. The county names carry no state suffix,
+# as in the tract table.
+TRACTS = pd.DataFrame({
+    "GEOID": ["01001020100", "06037101110"],
+    "city": ["Prattville", "Los Angeles"],
+    "county_name": ["Autauga County", "Los Angeles County"],
+    "population": [1912.0, 4283.0],
+    "DAC_status": ["Disadvantaged", "Not Disadvantaged"],
+    "QCT_status": ["Eligible", "Not Eligible"],
+    "DAC_check": ["Yes", "No"],
+    "QCT_check": ["Yes", "No"],
+    "tract_state_percentile": [61.2, 12.5],
+    "tract_national_percentile": [70.0, 20.25],
+    **{column: [88.5, np.nan] for _, column in INDICATORS},
+})
+
+
+def page_text(pdf):
+    # Text of an uncompressed PDF, as drawn by the text operators
+    return " ".join(text.decode("latin-1")
+                    for text in re.findall(rb"\((.*?)\) Tj", pdf.output()))
+
+
+def test_tract_details_name_the_state_from_the_geoid():
+    pdf = PDF(format="letter")
+    pdf.set_compression(False)
+    pdf.add_page()
+    pdf.set_font("Helvetica", size=9)
+    pdf.tract_details(TRACTS)
+    text = page_text(pdf)
+    assert "Census Tract 01001020100" in text
+    assert "State: AL" in text
+    assert "State: CA" in text
+    assert "County: Los Angeles County" in text
+    # Tracts without an indicator show N/A instead of a bar value
+    assert "N/A" in text
+
+
+def test_detailed_report_adds_the_tract_pages():
+    image = BytesIO()
+    Image.new("RGB", (40, 30), "white").save(image, format="PNG")
+    shape = pd.DataFrame({"NAME": ["Two Tracts"]})
+    housing = pd.DataFrame({
+        column: [] for column in ["Property Name", "Street Address", "City",
+                                  "Zip Code", "Subsidy Name", "Assisted Units"]
+    })
+
+    def pages(detailed):
+        pdf = generate_pdf(shape, image.getvalue(), TRACTS, housing,
+                           cover_page=False, include_nhpd=False,
+                           detailed=detailed)
+        assert pdf.startswith(b"%PDF")
+        return len(re.findall(rb"/Type /Page\b", pdf))
+
+    assert pages(detailed=True) == pages(detailed=False) + 1
+
+
+def test_tract_table_shortens_names_wider_than_their_cells():
+    tracts = TRACTS.assign(city=["Prattville", "Rancho Palos Verdes Estates"],
+                           county_name=["Autauga County",
+                                        "Matanuska-Susitna Borough County"])
+    pdf = PDF(format="letter")
+    pdf.set_compression(False)
+    pdf.add_page()
+    pdf.set_font("Helvetica", size=8)
+    pdf.tract_table(tracts)
+    text = page_text(pdf)
+    assert "Prattville" in text
+    assert "Rancho Palos Verdes Estates" not in text
+    assert "Matanuska-Susitna Borough County" not in text
+    # The shortened names fit the City (30) and County (45) columns
+    for shortened, width in [("Rancho Palos V...", 30),
+                             ("Matanuska-Susitna Boroug...", 45)]:
+        assert shortened in text
+        assert pdf.get_string_width(shortened) < width - 2 * pdf.c_margin
@@ -0,0 +1,104 @@
+import os
+import pickle
+
+import plotly.graph_objects as go
+import pytest
+
+import datastore
+import reportcache
+from datastore import DataRegistry, registry
+
+REQUEST = ("County", "Suffolk County, MA", (0, 100), False, False, False,
+           False, False, False)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(reportcache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(registry, "data_version", lambda: "v1")
+    return tmp_path
+
+
+def figure():
+    return go.Figure(go.Scatter(x=[1, 2], y=[3, 4]))
+
+
+def test_key_depends_on_every_request_field(cache):
+    key = reportcache.cache_key(REQUEST)
+    assert reportcache.cache_key(tuple(REQUEST)) == key
+    for position in range(len(REQUEST)):
+        changed = list(REQUEST)
+        changed[position] = "changed"
+        assert reportcache.cache_key(tuple(changed)) != key
+
+
+def test_key_changes_with_data_and_report_format(cache, monkeypatch):
+    key = reportcache.cache_key(REQUEST)
+    monkeypatch.setattr(registry, "data_version", lambda: "v2")
+    rebuilt = reportcache.cache_key(REQUEST)
+    assert rebuilt != key
+    monkeypatch.setattr(reportcache, "REPORT_FORMAT",
+                        reportcache.REPORT_FORMAT + 1)
+    assert reportcache.cache_key(REQUEST) not in (key, rebuilt)
+
+
+def test_entry_round_trip(cache):
+    key = reportcache.cache_key(REQUEST)
+    assert reportcache.get(key) is None
+    reportcache.put(key, figure(), b"png bytes", b"%PDF bytes")
+    entry = reportcache.get(key)
+    assert entry["png"] == b"png bytes"
+    assert entry["pdf"] == b"%PDF bytes"
+    assert entry["fig"].to_plotly_json() == figure().to_plotly_json()
+    assert os.listdir(cache) == [f"{key}.report"]
+
+
+def test_malformed_entries_are_misses(cache):
+    key = reportcache.cache_key(REQUEST)
+    reportcache.put(key, figure(), b"png", b"pdf")
+    path = reportcache.entry_path(key)
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:-1])
+    assert reportcache.get(key) is None
+    # Entries are never unpickled
+    with open(path, "wb") as f:
+        pickle.dump({"png": b"png", "pdf": b"pdf"}, f)
+    assert reportcache.get(key) is None
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    keys = [reportcache.cache_key((*REQUEST[:1], name, *REQUEST[2:]))
+            for name in ("a", "b", "c")]
+    for age, key in enumerate(keys):
+        reportcache.put(key, figure(), b"x" * 1000, b"y" * 1000)
+        os.utime(reportcache.entry_path(key), (age, age))
+    # Reading an entry makes it the most recently used
+    reportcache.get(keys[0])
+    size = os.path.getsize(reportcache.entry_path(keys[0]))
+    reportcache.evict(budget_bytes=2 * size)
+    assert reportcache.get(keys[0]) is not None
+    assert reportcache.get(keys[1]) is None
+    assert reportcache.get(keys[2]) is not None
+
+
+def test_data_version_is_read_once_per_load(monkeypatch):
+    reads = []
+
+    def data_version():
+        # Stands in for reading every artifact sidecar
+        reads.append(1)
+        return f"v{len(reads)}"
+
+    monkeypatch.setattr(datastore, "data_version", data_version)
+    monkeypatch.setattr(datastore, "dataset_size", lambda name, dataset: 0)
+    store = DataRegistry({"numbers": lambda: [1, 2, 3]}, budget_bytes=2**20)
+    assert store.data_version() == "v1"
+    assert store.data_version() == "v1"
+    assert len(reads) == 1
+    store.get("numbers")
+    assert store.data_version() == "v2"
+    store.get("numbers")
+    assert store.data_version() == "v2"
+    assert len(reads) == 2
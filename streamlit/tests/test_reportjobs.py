@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+
+import reportjobs
+from reportjobs import ReportJobQueue
+
+REQUEST = ("County", "Suffolk County, MA", (0, 100), False, False, False,
+           False, False, False)
+OTHER_REQUEST = ("County", "Norfolk County, MA", *REQUEST[2:])
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    # build_report signals that it started, then waits for the test to
+    # release it before its next stage, where a cancelled job stops
+    started = threading.Event()
+    release = threading.Event()
+
+    def build_report(job, *request):
+        started.set()
+        release.wait(5)
+        job.set_stage("Rendering map", 0.4)
+        return {"request": request}
+
+    monkeypatch.setattr(reportjobs, "build_report", build_report)
+    return started, release
+
+
+def test_identical_requests_share_a_job(worker):
+    _, release = worker
+    queue = ReportJobQueue(workers=1)
+    job = queue.submit(REQUEST)
+    assert queue.submit(REQUEST) is job
+    assert job.subscribers == 2
+    release.set()
+    job.future.result(5)
+    assert job.status == "done"
+    assert job.result == {"request": REQUEST}
+    # Finished jobs are kept for the next session asking for the report
+    assert queue.submit(REQUEST) is job
+
+
+def test_job_is_cancelled_when_its_last_subscriber_leaves(worker):
+    started, release = worker
+    queue = ReportJobQueue(workers=1)
+    job = queue.submit(REQUEST)
+    queue.submit(REQUEST)
+    assert started.wait(5)
+    queue.cancel(job.id)
+    assert not job.cancelled.is_set()
+    queue.cancel(job.id)
+    assert job.cancelled.is_set()
+    release.set()
+    job.future.result(5)
+    assert job.status == "cancelled"
+    assert job.result is None
+
+
+def test_queued_job_is_cancelled_without_taking_a_worker(worker):
+    started, release = worker
+    queue = ReportJobQueue(workers=1)
+    running = queue.submit(REQUEST)
+    assert started.wait(5)
+    queued = queue.submit(OTHER_REQUEST)
+    queue.cancel(queued.id)
+    assert queued.status == "cancelled"
+    assert queued.future.cancelled()
+    release.set()
+    running.future.result(5)
+    assert running.status == "done"
+
+
+def test_request_for_a_job_being_cancelled_starts_a_new_job(worker):
+    started, release = worker
+    queue = ReportJobQueue(workers=2)
+    job = queue.submit(REQUEST)
+    assert started.wait(5)
+    queue.cancel(job.id)
+    # Still "running" until the worker reaches its next stage
+    assert job.status == "running"
+    replacement = queue.submit(REQUEST)
+    assert replacement is not job
+    assert queue.get(job.id) is replacement
+    release.set()
+    job.future.result(5)
+    replacement.future.result(5)
+    assert job.status == "cancelled"
+    assert replacement.status == "done"
+
+
+def test_failed_job_is_logged_and_not_reused(monkeypatch, caplog):
+
+    def build_report(job, *request):
+        raise ValueError("no tracts")
+
+    monkeypatch.setattr(reportjobs, "build_report", build_report)
+    queue = ReportJobQueue(workers=1)
+    job = queue.submit(REQUEST)
+    job.future.result(5)
+    assert job.status == "failed"
+    assert isinstance(job.error, ValueError)
+    assert "no tracts" in caplog.text
+    assert queue.submit(REQUEST) is not job
@@ -0,0 +1,90 @@
+import pandas as pd
+import pytest
+
+from equity_common.searchkeys import index_entries, normalize, search_keys
+from search import KEY_LENGTH, SearchIndex
+
+COUNTIES = [
+    "Suffolk County, MA",
+    "Norfolk County, MA",
+    "Middlesex County, MA",
+    "Doña Ana County, NM",
+    "Essex County, NJ",
+]
+STATES = ["Massachusetts", "New Mexico", "New Jersey"]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return SearchIndex(
+        pd.concat([
+            index_entries(COUNTIES, "County"),
+            index_entries(STATES, "State"),
+        ],
+                  ignore_index=True))
+
+
+def test_normalize_transliterates_before_dropping_non_ascii():
+    assert normalize("Doña Ana County, NM") == "dona ana county nm"
+    assert normalize("Mayagüez Municipio") == "mayaguez municipio"
+    assert normalize("Ｆｕｌｌ ｗｉｄｔｈ") == "full width"
+    assert normalize("  St. Mary's   Parish ") == "st mary s parish"
+
+
+def test_search_keys_start_at_every_word():
+    assert search_keys("Suffolk County, MA") == [
+        "suffolk county ma", "county ma", "ma"
+    ]
+    assert search_keys("!!") == []
+
+
+def test_whole_name_matches_come_before_later_words(index):
+    assert index.search("ne", "State") == ["New Jersey", "New Mexico"]
+    assert index.search("mex") == ["New Mexico"]
+    assert index.search("nm", "County") == ["Doña Ana County, NM"]
+    # Only the start of a word matches, "essex" is not one in "Middlesex"
+    assert index.search("essex", "County") == ["Essex County, NJ"]
+    # Equal keys keep the order the names were indexed in
+    assert index.search("county ma", "County") == [
+        "Suffolk County, MA", "Norfolk County, MA", "Middlesex County, MA"
+    ]
+    assert index.search("ma") == [
+        "Massachusetts", "Suffolk County, MA", "Norfolk County, MA",
+        "Middlesex County, MA"
+    ]
+
+
+def test_accents_and_case_are_ignored(index):
+    assert index.search("DONA") == ["Doña Ana County, NM"]
+    assert index.search("doña") == ["Doña Ana County, NM"]
+
+
+def test_one_typo_is_tolerated(index):
+    assert index.search("sufolk") == ["Suffolk County, MA"]
+    assert index.search("norflok") == ["Norfolk County, MA"]
+    # Too short to guess at
+    assert index.search("nx") == []
+
+
+def test_level_and_limit(index):
+    assert index.search("new", "County") == []
+    assert index.search("county", "County", limit=2) == [
+        "Suffolk County, MA", "Norfolk County, MA"
+    ]
+    assert index.search("   ") == []
+
+
+def test_names_of_pages_through_a_level(index):
+    assert index.count_of("County") == len(COUNTIES)
+    names = (index.names_of("County", 2) + index.names_of("County", 2, 2) +
+             index.names_of("County", 2, 4))
+    assert names == sorted(COUNTIES, key=normalize)
+    assert index.names_of("County", 2, 6) == []
+
+
+def test_long_names_match_on_their_first_characters():
+    name = "Confederated Tribes of the Umatilla Indian Reservation"
+    index = SearchIndex(index_entries([name], "Tribe or Territory"))
+    assert index.search("confederated tribes of the umatilla") == [name]
+    assert index.search(normalize(name)[:KEY_LENGTH]) == [name]
+    assert index.search("umatilla indian") == [name]
@@ -0,0 +1,82 @@
+import json
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+from spatial import CRS, SpatialIndex, area_name, custom_shape, geojson_area
+
+# 2x2 grid of one degree tiles, rows in reading order:
+#   0 1
+#   2 3
+TILES = [
+    shapely.box(-100, 41, -99, 42),
+    shapely.box(-99, 41, -98, 42),
+    shapely.box(-100, 40, -99, 41),
+    shapely.box(-99, 40, -98, 41),
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return SpatialIndex(gpd.GeoDataFrame(geometry=TILES, crs=CRS))
+
+
+def test_locate_finds_the_tile_of_each_point(index):
+    located = index.locate([-99.5, -98.5, -99.5, -98.5],
+                           [41.5, 41.5, 40.5, 40.5])
+    assert located.tolist() == [0, 1, 2, 3]
+
+
+def test_locate_outside_or_without_coordinates_is_minus_one(index):
+    located = index.locate([-97.5, np.nan, -99.5], [40.5, 40.5, np.nan])
+    assert located.tolist() == [-1, -1, -1]
+
+
+def test_locate_on_a_shared_edge_picks_the_first_row(index):
+    # On the edge between 0 and 1, and on the corner of all four
+    assert index.locate([-99, -99], [41.5, 41]).tolist() == [0, 0]
+
+
+def test_overlap_is_the_share_of_each_tile_inside(index):
+    # The west half of tile 0 and a quarter of each tile around the center
+    rows, fractions = index.overlap(shapely.box(-100, 41, -99.5, 42))
+    assert rows.tolist() == [0]
+    assert fractions == pytest.approx([0.5], rel=1e-6)
+    rows, fractions = index.overlap(shapely.box(-99.5, 40.5, -98.5, 41.5))
+    assert rows.tolist() == [0, 1, 2, 3]
+    assert fractions == pytest.approx([0.25] * 4, rel=1e-2)
+
+
+def test_overlap_leaves_out_tiles_only_touching_the_area(index):
+    area = shapely.box(-98, 40, -97, 42)
+    assert index.intersecting(area).tolist() == [1, 3]
+    rows, fractions = index.overlap(area)
+    assert rows.tolist() == []
+    assert fractions.tolist() == []
+
+
+def test_geojson_area_unions_the_polygons_of_a_collection():
+    collection = {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "properties": {},
+             "geometry": json.loads(shapely.to_geojson(tile))}
+            for tile in TILES[:2]
+        ] + [
+            {"type": "Feature", "properties": {},
+             "geometry": {"type": "Point", "coordinates": [-99, 41]}},
+        ],
+    }
+    location = geojson_area(json.dumps(collection), "North tiles")
+    assert area_name(location) == "North tiles"
+    shape = custom_shape(location)
+    assert shape.crs == CRS
+    assert shape.geometry.iloc[0].equals(shapely.box(-100, 41, -98, 42))
+
+
+def test_geojson_area_without_polygons_is_an_error():
+    with pytest.raises(ValueError):
+        geojson_area(json.dumps({"type": "Point", "coordinates": [0, 0]}),
+                     "Nowhere")